@@ -0,0 +1,117 @@
+"""
+Throughput of fixed 800-step padding versus length-bucketed batches with masking.
+
+Usage:
+    python benchmarks/bench_bucketing.py [--corpus SHARD_DIR] [--packages N] [--batch-size B]
+
+The length distribution is taken from a packed corpus when --corpus is given. Otherwise a
+synthetic mix is used: a third of the packages are short install-script packages
+(1-20 APIs), the rest follow a log-normal distribution capped at max_length. The same
+Bi-LSTM architecture as lstmTrain.py is timed for inference (predict_on_batch) and one
+training epoch (train_on_batch), once with every batch padded to max_length and once
+with bucket_batches and a Masking layer.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import numpy as np
+from tensorflow.keras.models import Model
+from tensorflow.keras.layers import Input, LSTM, Dense, Bidirectional, Masking
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'training'))
+from vectorize import bucket_boundaries, bucket_batches  # noqa: E402
+
+
+def synthetic_lengths(packages, max_length, seed=0):
+    rng = np.random.default_rng(seed)
+    short = rng.integers(1, 21, size=packages // 3)
+    long = rng.lognormal(mean=4.5, sigma=1.0, size=packages - len(short)).astype(np.int64) + 1
+    return np.minimum(np.concatenate([short, long]), max_length)
+
+
+def corpus_lengths(shard_dir, packages, max_length, seed=0):
+    from corpus import PackedCorpus
+    lengths = PackedCorpus(shard_dir).lengths(max_length)
+    rng = np.random.default_rng(seed)
+    return rng.choice(lengths, size=min(packages, len(lengths)), replace=False)
+
+
+def create_model(input_shape, masking):
+    inputs = Input(shape=input_shape)
+    masked = Masking(mask_value=0.0)(inputs) if masking else inputs
+    lstm_out = Bidirectional(LSTM(units=64, dropout=0.1, recurrent_dropout=0.1))(masked)
+    outputs = Dense(1, activation='sigmoid')(lstm_out)
+    model = Model(inputs, outputs)
+    model.compile(optimizer='adam', loss='binary_crossentropy')
+    return model
+
+
+def make_batch(lengths, width, vector_size, rng):
+    batch = np.zeros((len(lengths), width, vector_size), dtype=np.float32)
+    for row, length in enumerate(lengths):
+        batch[row, :length] = rng.standard_normal((length, vector_size))
+    return batch
+
+
+def run(model, batches, labels, train):
+    # warm up every distinct shape so tracing is not timed
+    for indices, batch in {batch.shape[1]: (indices, batch) for indices, batch in batches}.values():
+        model.predict_on_batch(batch)
+        if train:
+            model.train_on_batch(batch, labels[indices])
+    start = time.perf_counter()
+    for indices, batch in batches:
+        if train:
+            model.train_on_batch(batch, labels[indices])
+        else:
+            model.predict_on_batch(batch)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=None)
+    parser.add_argument('--packages', type=int, default=2048)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--max-length', type=int, default=800)
+    parser.add_argument('--vector-size', type=int, default=100)
+    args = parser.parse_args()
+
+    if args.corpus:
+        lengths = corpus_lengths(args.corpus, args.packages, args.max_length)
+    else:
+        lengths = synthetic_lengths(args.packages, args.max_length)
+    rng = np.random.default_rng(1)
+    labels = rng.integers(0, 2, size=len(lengths)).astype(np.float32)
+
+    fixed = [(indices, make_batch(lengths[indices], args.max_length, args.vector_size, rng))
+             for indices in np.array_split(np.arange(len(lengths)), max(1, len(lengths) // args.batch_size))]
+    bucketed = [(indices, make_batch(lengths[indices], width, args.vector_size, rng))
+                for indices, width in bucket_batches(lengths, args.batch_size, bucket_boundaries(args.max_length))]
+
+    fixed_model = create_model((args.max_length, args.vector_size), masking=False)
+    bucketed_model = create_model((None, args.vector_size), masking=True)
+
+    report = {
+        'packages': int(len(lengths)),
+        'length_percentiles': {p: int(np.percentile(lengths, p)) for p in (50, 90, 99)},
+        'padded_steps': {
+            'fixed': int(len(lengths) * args.max_length),
+            'bucketed': int(sum(len(indices) * batch.shape[1] for indices, batch in bucketed)),
+        },
+    }
+    for mode, train in (('inference', False), ('training', True)):
+        fixed_seconds = run(fixed_model, fixed, labels, train)
+        bucketed_seconds = run(bucketed_model, bucketed, labels, train)
+        report[mode] = {
+            'fixed_packages_per_second': len(lengths) / fixed_seconds,
+            'bucketed_packages_per_second': len(lengths) / bucketed_seconds,
+            'speedup': fixed_seconds / bucketed_seconds,
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
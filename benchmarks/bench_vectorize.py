@@ -0,0 +1,84 @@
+"""
+Compares the former per-token vectorize_sequences with the gather-based SequenceVectorizer.
+
+Usage:
+    python benchmarks/bench_vectorize.py [--packages N] [--max-length L] [--w2v PATH]
+
+Sequences are sampled from the Word2Vec vocabulary (plus a few unknown APIs) with lengths
+drawn around max_length, then both implementations are timed and their peak allocations
+are measured with tracemalloc. The outputs are checked to be numerically identical.
+"""
+import os
+import sys
+import time
+import json
+import argparse
+import tracemalloc
+import numpy as np
+from gensim.models import Word2Vec
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'training'))
+from vectorize import SequenceVectorizer  # noqa: E402
+
+
+def legacy_vectorize_sequences(sequences, model, max_length):
+    vectorized_sequences = []
+    for seq in sequences:
+        vectorized_seq = [model.wv[api] if api in model.wv else np.zeros(model.vector_size) for api in seq]
+        if len(vectorized_seq) < max_length:
+            vectorized_seq.extend([np.zeros(model.vector_size)] * (max_length - len(vectorized_seq)))
+        else:
+            vectorized_seq = vectorized_seq[:max_length]
+        vectorized_sequences.append(vectorized_seq)
+    return np.array(vectorized_sequences)
+
+
+def make_sequences(vocab, packages, max_length, seed=0):
+    rng = np.random.default_rng(seed)
+    tokens = list(vocab) + ['unknownApi']
+    lengths = rng.integers(max_length // 8, max_length * 3 // 2, size=packages)
+    return [[tokens[i] for i in rng.integers(0, len(tokens), size=n)] for n in lengths]
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    default_w2v = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'training', 'word2vec_window10.model')
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--packages', type=int, default=500)
+    parser.add_argument('--max-length', type=int, default=800)
+    parser.add_argument('--w2v', default=default_w2v)
+    args = parser.parse_args()
+
+    w2v_model = Word2Vec.load(args.w2v)
+    sequences = make_sequences(w2v_model.wv.index_to_key, args.packages, args.max_length)
+
+    legacy, legacy_time, legacy_peak = measure(lambda: legacy_vectorize_sequences(sequences, w2v_model, args.max_length))
+    vectorizer = SequenceVectorizer(w2v_model, args.max_length)
+    ids, encode_time, encode_peak = measure(lambda: vectorizer.encode(sequences))
+    embedded, embed_time, embed_peak = measure(lambda: vectorizer.embed(ids))
+
+    assert np.allclose(legacy, embedded), 'SequenceVectorizer output differs from the legacy implementation'
+
+    report = {
+        'packages': args.packages,
+        'max_length': args.max_length,
+        'legacy': {'seconds': legacy_time, 'peak_bytes': legacy_peak, 'result_bytes': legacy.nbytes},
+        'encode': {'seconds': encode_time, 'peak_bytes': encode_peak, 'result_bytes': ids.nbytes},
+        'embed': {'seconds': embed_time, 'peak_bytes': embed_peak, 'result_bytes': embedded.nbytes},
+        'speedup': legacy_time / (encode_time + embed_time),
+        'memory_reduction': legacy_peak / max(encode_peak, embed_peak),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
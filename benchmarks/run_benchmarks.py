@@ -0,0 +1,380 @@
+"""
+Benchmark suite for extraction, vectorization, training and inference throughput.
+
+Usage:
+    python benchmarks/run_benchmarks.py run [--stages extract,vectorize,train,inference] [--out results.json]
+    python benchmarks/run_benchmarks.py compare <base.json> <head.json> [--tolerance 0.1]
+
+`run` works on synthetic data only, so results from different commits are comparable:
+    extract    packages/sec through extract.py's run_extractor (the queue that extract.py runs by
+               default) on packages from synthetic_packages.py, and the per-stage cost (call graph,
+               feature extraction, serialization) recorded by the extractor in STAGE_TIMINGS_FILE.
+               The `npm run start` fallback is reported under npm_start. Skipped when
+               feature-extract is not installed.
+    vectorize  load_api_sequences, vectorize_sequences, SequenceVectorizer and packed corpus
+               throughput on generated *_rst.json files
+    train      train_on_batch step time of the lstmTrain.py Bi-LSTM
+    inference  model load time, Test.py-style predict throughput and single/batch latency
+
+Results are written as JSON (by default to benchmarks/results/<commit>-<time>.json) together
+with the commit, machine and library versions. `compare` prints the relative change of every
+metric between two result files and exits with status 1 when a throughput or latency metric
+regressed by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+import numpy as np
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+TRAINING_DIR = os.path.join(REPO_ROOT, 'training')
+sys.path.insert(0, TRAINING_DIR)
+sys.path.insert(0, REPO_ROOT)
+from synthetic_packages import generate_packages  # noqa: E402
+
+STAGES = ['extract', 'vectorize', 'train', 'inference']
+
+
+def _summary(seconds):
+    milliseconds = np.asarray(seconds) * 1000
+    p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+    return {'mean_ms': float(milliseconds.mean()), 'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _git(*args):
+    try:
+        return subprocess.check_output(['git', *args], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _metadata(args):
+    versions = {'python': platform.python_version(), 'numpy': np.__version__}
+    for module in ('tensorflow', 'gensim'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(), 'cpu_count': os.cpu_count()},
+        'versions': versions,
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('command', 'out')},
+    }
+
+
+def _vocabulary(args):
+    from gensim.models import Word2Vec
+    return Word2Vec.load(args.w2v)
+
+
+def _write_sequences(feature_dir, vocab, packages, max_length, seed=0):
+    # a third short install-script packages, the rest log-normal like the extracted datasets
+    rng = np.random.default_rng(seed)
+    os.makedirs(feature_dir, exist_ok=True)
+    tokens = list(vocab) + ['unknownApi']
+    short = rng.integers(1, 21, size=packages // 3)
+    long = np.minimum(rng.lognormal(mean=4.5, sigma=1.0, size=packages - len(short)).astype(np.int64) + 1, 2 * max_length)
+    for index, length in enumerate(np.concatenate([short, long])):
+        with open(os.path.join(feature_dir, f'synthetic-package-{index}_rst.json'), 'w') as file:
+            json.dump([tokens[i] for i in rng.integers(0, len(tokens), size=length)], file)
+
+
+def load_api_sequences(directory):
+    # the loader of lstmTrain.py, location.py and Test.py
+    api_sequences = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            with open(os.path.join(directory, filename), 'r') as file:
+                api_sequences.append(json.load(file))
+    return api_sequences
+
+
+def _extract_path(work_dir, run):
+    """
+    Extracts the synthetic dataset into fresh output directories under work_dir with run(call graph,
+    feature position, feature directory) and summarizes the throughput and the STAGE_TIMINGS_FILE records.
+    """
+    output_dirs = [os.path.join(work_dir, name) for name in ('call-graphs', 'feature-positions', 'features')]
+    for path in output_dirs:
+        os.makedirs(path, exist_ok=True)
+    timings_path = os.path.join(work_dir, 'stage-timings.jsonl')
+    os.environ['STAGE_TIMINGS_FILE'] = timings_path
+
+    cwd = os.getcwd()
+    os.chdir(REPO_ROOT)
+    try:
+        _, elapsed = _timed(lambda: run(*output_dirs))
+    finally:
+        os.chdir(cwd)
+        del os.environ['STAGE_TIMINGS_FILE']
+
+    extracted = len([name for name in os.listdir(output_dirs[2]) if name.endswith('_rst.json')])
+    records = []
+    if os.path.exists(timings_path):
+        with open(timings_path, 'r') as file:
+            records = [json.loads(line) for line in file if line.strip()]
+    stages = {}
+    for stage in ('callGraphMs', 'featureExtractionMs', 'serializationMs', 'totalMs'):
+        values = [record[stage] / 1000 for record in records if stage in record]
+        if values:
+            stages[stage[:-len('Ms')]] = _summary(values)
+    return {
+        'extracted': extracted,
+        'failed': sum('failedStage' in record for record in records),
+        # includes building the extractor
+        'seconds': elapsed,
+        'packages_per_second': extracted / elapsed,
+        'stages': stages,
+    }
+
+
+def bench_extract(args, work_dir):
+    if shutil.which('npm') is None or not os.path.isdir(os.path.join(REPO_ROOT, 'feature-extract', 'node_modules')):
+        return {'skipped': 'feature-extract dependencies are not installed (run setup.sh)'}
+    import extract
+
+    dataset_dir = os.path.join(work_dir, 'datasets', 'synthetic')
+    generate_packages(dataset_dir, args.extract_packages, files=args.files, functions=args.functions,
+                      call_depth=args.call_depth, features=args.features)
+
+    def run_npm_start(call_graph_dir, feature_pos_dir, feature_dir):
+        # run_npm_start reads its paths from the module globals set by extract.py's main
+        extract.dataset_name = 'synthetic'
+        extract.dataset_dir_path = dataset_dir
+        extract.call_graph_dir_path = call_graph_dir
+        extract.feature_pos_dir_path = feature_pos_dir
+        extract.sequential_feature_dir_path = feature_dir
+        extract.run_npm_start()
+
+    # an extraction cache of the environment would turn the second path into cache restores
+    cache_dir = os.environ.pop('EXTRACTION_CACHE_DIR', None)
+    try:
+        # the default path of extract.py (use_queue = True), then the `npm run start` fallback
+        results = _extract_path(os.path.join(work_dir, 'queue'),
+                                lambda *output_dirs: extract.run_extractor(dataset_dir, *output_dirs))
+        results['npm_start'] = _extract_path(os.path.join(work_dir, 'npm-start'), run_npm_start)
+    finally:
+        if cache_dir is not None:
+            os.environ['EXTRACTION_CACHE_DIR'] = cache_dir
+    return {'packages': args.extract_packages, **results}
+
+
+def bench_vectorize(args, work_dir):
+    from vectorize import SequenceVectorizer, vectorize_sequences
+    from corpus import PackedCorpus, pack_directory
+
+    w2v_model = _vocabulary(args)
+    feature_dir = os.path.join(work_dir, 'sequences')
+    _write_sequences(feature_dir, w2v_model.wv.index_to_key, args.packages, args.max_length)
+    packages = args.packages
+
+    sequences, load_time = _timed(lambda: load_api_sequences(feature_dir))
+    _, legacy_time = _timed(lambda: vectorize_sequences(sequences, w2v_model, args.max_length))
+    vectorizer = SequenceVectorizer(w2v_model, args.max_length)
+    ids, encode_time = _timed(lambda: vectorizer.encode(sequences))
+    _, embed_time = _timed(lambda: vectorizer.embed(ids))
+    shard_dir = os.path.join(work_dir, 'corpus')
+    _, pack_time = _timed(lambda: pack_directory(feature_dir, shard_dir, 1))
+    corpus = PackedCorpus(shard_dir)
+    _, corpus_encode_time = _timed(lambda: corpus.encode(vectorizer))
+    return {
+        'packages': packages,
+        'tokens': int(sum(len(sequence) for sequence in sequences)),
+        'load_api_sequences': {'seconds': load_time, 'packages_per_second': packages / load_time},
+        'vectorize_sequences': {'seconds': legacy_time, 'packages_per_second': packages / legacy_time},
+        'encode': {'seconds': encode_time, 'packages_per_second': packages / encode_time},
+        'embed': {'seconds': embed_time, 'packages_per_second': packages / embed_time},
+        'corpus_pack': {'seconds': pack_time, 'packages_per_second': packages / pack_time},
+        'corpus_encode': {'seconds': corpus_encode_time, 'packages_per_second': packages / corpus_encode_time},
+    }
+
+
+def _create_model(args):
+    from tensorflow.keras.models import Model
+    from tensorflow.keras.layers import Input, LSTM, Dense, Bidirectional, Masking
+    # the architecture and defaults of lstmTrain.py
+    inputs = Input(shape=(None, args.vector_size))
+    masked = Masking(mask_value=0.0)(inputs)
+    lstm_out = Bidirectional(LSTM(units=64, activation='tanh', recurrent_activation='sigmoid', dropout=0.1, recurrent_dropout=0.1))(masked)
+    outputs = Dense(1, activation='sigmoid')(lstm_out)
+    model = Model(inputs, outputs)
+    model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
+    return model
+
+
+def _random_batch(rng, batch_size, width, vector_size):
+    x = rng.standard_normal((batch_size, width, vector_size)).astype(np.float32)
+    # random lengths, the zero padding is skipped by the Masking layer
+    for row, length in enumerate(rng.integers(1, width + 1, size=batch_size)):
+        x[row, length:] = 0.0
+    return x, rng.integers(0, 2, size=batch_size).astype(np.float32)
+
+
+def bench_train(args, work_dir):
+    try:
+        import tensorflow  # noqa: F401
+    except ImportError:
+        return {'skipped': 'tensorflow is not installed'}
+    rng = np.random.default_rng(0)
+    model = _create_model(args)
+    batches = [_random_batch(rng, args.batch_size, args.max_length, args.vector_size) for _ in range(args.train_steps)]
+    for x, y in batches[:2]:
+        model.train_on_batch(x, y)
+    step_times = []
+    for x, y in batches:
+        _, elapsed = _timed(lambda: model.train_on_batch(x, y))
+        step_times.append(elapsed)
+    return {
+        'batch_size': args.batch_size,
+        'width': args.max_length,
+        'steps': args.train_steps,
+        'step': _summary(step_times),
+        'sequences_per_second': args.batch_size * len(step_times) / sum(step_times),
+    }
+
+
+def bench_inference(args, work_dir):
+    try:
+        from tensorflow.keras.models import load_model
+    except ImportError:
+        return {'skipped': 'tensorflow is not installed'}
+    if not os.path.exists(args.model):
+        return {'skipped': f'model {args.model} does not exist'}
+    from vectorize import SequenceVectorizer
+
+    model, load_time = _timed(lambda: load_model(args.model))
+    vectorizer = SequenceVectorizer(_vocabulary(args), args.max_length)
+    feature_dir = os.path.join(work_dir, 'inference-sequences')
+    _write_sequences(feature_dir, vectorizer.token_to_id, args.packages, args.max_length, seed=1)
+    vectors = vectorizer.vectorize(load_api_sequences(feature_dir))
+
+    model.predict(vectors[:args.batch_size], verbose=0)
+    _, predict_time = _timed(lambda: model.predict(vectors, batch_size=args.batch_size, verbose=0))
+    single, batch = [], []
+    for index in range(args.latency_samples):
+        model.predict_on_batch(vectors[index:index + 1])
+        _, elapsed = _timed(lambda: model.predict_on_batch(vectors[index:index + 1]))
+        single.append(elapsed)
+        start = index * args.batch_size % max(len(vectors) - args.batch_size, 1)
+        _, elapsed = _timed(lambda: model.predict_on_batch(vectors[start:start + args.batch_size]))
+        batch.append(elapsed)
+    return {
+        'packages': len(vectors),
+        'model_load_seconds': load_time,
+        # Test.py scores the whole directory with one model.predict call
+        'predict': {'seconds': predict_time, 'packages_per_second': len(vectors) / predict_time},
+        'latency_single': _summary(single),
+        f'latency_batch_{args.batch_size}': _summary(batch),
+    }
+
+
+def _flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def _direction(metric):
+    # +1 when higher is better, -1 when lower is better, 0 for informational metrics
+    name = metric.rsplit('.', 1)[-1]
+    if name.endswith('per_second'):
+        return 1
+    if name.endswith('_ms') or name.endswith('seconds'):
+        return -1
+    return 0
+
+
+def compare(base_path, head_path, tolerance):
+    with open(base_path, 'r') as file:
+        base = json.load(file)
+    with open(head_path, 'r') as file:
+        head = json.load(file)
+    base_metrics, head_metrics = _flatten(base['results']), _flatten(head['results'])
+    print(f"base {base['meta']['commit']}  head {head['meta']['commit']}")
+    regressions = 0
+    for metric in sorted(set(base_metrics) & set(head_metrics)):
+        before, after = base_metrics[metric], head_metrics[metric]
+        direction = _direction(metric)
+        if direction == 0 or before == 0:
+            continue
+        change = (after - before) / before
+        regressed = direction * change < -tolerance
+        regressions += regressed
+        print(f"{metric:60s} {before:14.4f} -> {after:14.4f}  {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run or compare the SerMalDetector benchmarks.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run')
+    run_parser.add_argument('--stages', default=','.join(STAGES), help=f'comma-separated subset of {",".join(STAGES)}')
+    run_parser.add_argument('--out', default=None, help='result file (benchmarks/results/<commit>-<time>.json by default)')
+    run_parser.add_argument('--w2v', default=os.path.join(TRAINING_DIR, 'word2vec_window10.model'))
+    run_parser.add_argument('--model', default=os.path.join(TRAINING_DIR, 'malware_detection_model.keras'))
+    run_parser.add_argument('--packages', type=int, default=2000, help='feature sequences for vectorize and inference')
+    run_parser.add_argument('--extract-packages', type=int, default=50, help='synthetic npm packages for extract')
+    run_parser.add_argument('--files', type=int, default=5, help='JavaScript files per synthetic package')
+    run_parser.add_argument('--functions', type=int, default=8, help='functions per synthetic file')
+    run_parser.add_argument('--call-depth', type=int, default=3, help='call chain length in synthetic files')
+    run_parser.add_argument('--features', type=int, default=2, help='extractor features per synthetic function')
+    run_parser.add_argument('--max-length', type=int, default=800)
+    run_parser.add_argument('--vector-size', type=int, default=100)
+    run_parser.add_argument('--batch-size', type=int, default=32)
+    run_parser.add_argument('--train-steps', type=int, default=20)
+    run_parser.add_argument('--latency-samples', type=int, default=50)
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('head')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        sys.exit(1 if compare(args.base, args.head, args.tolerance) else 0)
+
+    stages = [stage.strip() for stage in args.stages.split(',') if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f'unknown stages: {", ".join(sorted(unknown))}')
+    report = {'meta': _metadata(args), 'results': {}}
+    benchmarks = {'extract': bench_extract, 'vectorize': bench_vectorize, 'train': bench_train, 'inference': bench_inference}
+    with tempfile.TemporaryDirectory(prefix='sermal-bench-') as work_dir:
+        for stage in stages:
+            print(f'Running {stage} ...', file=sys.stderr)
+            report['results'][stage] = benchmarks[stage](args, os.path.join(work_dir, stage))
+
+    out = args.out
+    if out is None:
+        commit = (report['meta']['commit'] or 'unknown')[:12]
+        out = os.path.join(BENCHMARKS_DIR, 'results', f"{commit}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(json.dumps(report['results'], indent=2))
+    print(f'Results written to {out}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Generator of synthetic npm packages for the benchmarks.
+
+Every package has a package.json (optionally with an install script) and `files` JavaScript
+files of `functions` functions each. Function j of a file calls function j + 1 of the same
+file and, every `call_depth` functions, the first function of the next file, so jelly finds
+call chains of about `call_depth` functions per file. Each function body mixes plain code
+with the APIs the extractor looks for (require of network, process and file system modules,
+base64 and Buffer use, process.env, domains, IPs, sensitive paths), `features` of them per
+function on average. The output only depends on the arguments and the seed.
+
+Usage:
+    python benchmarks/synthetic_packages.py <out_dir> [--packages 100] [--files 5] [--functions 8]
+                                            [--call-depth 3] [--features 2] [--filler 20] [--tgz] [--seed 0]
+
+With --tgz the packages are written as npm-pack style <name>-1.0.0.tgz archives (files under
+package/), the input format of extract.py --gz and create-data; otherwise as directories.
+"""
+import io
+import os
+import json
+import random
+import tarfile
+import argparse
+
+FEATURE_SNIPPETS = [
+    "const http = require('http');",
+    "const https = require('https');",
+    "const cp = require('child_process');",
+    "const fs = require('fs');",
+    "const crypto = require('crypto');",
+    "const os = require('os'); const home = os.homedir();",
+    "const encoded = Buffer.from(data, 'base64');",
+    "const token = process.env.NPM_TOKEN;",
+    "const host = 'https://registry.example.com/collect';",
+    "const ip = '192.168.10.24';",
+    "const secret = '/etc/passwd';",
+    "const bytes = '\\x68\\x65\\x6c\\x6c\\x6f';",
+]
+FILLER_SNIPPETS = [
+    "let total = 0; for (let i = 0; i < items.length; i++) { total += items[i]; }",
+    "const result = items.map(item => item * 2).filter(item => item > 10);",
+    "if (options && options.verbose) { console.log('value', value); }",
+    "const merged = Object.assign({ verbose: false }, options || {});",
+    "const text = String(value).trim().toLowerCase();",
+]
+
+
+def _function_source(file_index, function_index, functions, files, call_depth, features, filler, rng):
+    lines = [f'function f{file_index}_{function_index}(items, options, value, data) {{']
+    lines.append('  items = items || []; value = value || 1; data = data || \'\';')
+    # every snippet gets its own block so repeated declarations do not clash
+    for _ in range(filler):
+        lines.append('  { ' + rng.choice(FILLER_SNIPPETS) + ' }')
+    for _ in range(rng.randint(0, 2 * features)):
+        lines.append('  { ' + rng.choice(FEATURE_SNIPPETS) + ' }')
+    if function_index + 1 < functions and (function_index + 1) % call_depth != 0:
+        lines.append(f'  f{file_index}_{function_index + 1}(items, options, value, data);')
+    elif file_index + 1 < files:
+        lines.append(f'  next.f{file_index + 1}_0(items, options, value, data);')
+    lines.append('  return value;')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def generate_package(name: str, files: int = 5, functions: int = 8, call_depth: int = 3, features: int = 2,
+                     filler: int = 20, install_script: bool = True, seed: int = 0):
+    """
+    Returns the files of one synthetic package as a {relative path: content} dict.
+    """
+    rng = random.Random(f'{name}:{seed}')
+    package_files = {}
+    for file_index in range(files):
+        parts = []
+        if file_index + 1 < files:
+            # index.js lives in the package root, the other files in lib/
+            parts.append(f"const next = require('./{'lib/' if file_index == 0 else ''}file{file_index + 1}');")
+        for function_index in range(functions):
+            parts.append(_function_source(file_index, function_index, functions, files, call_depth, features, filler, rng))
+        parts.append('module.exports = { ' + ', '.join(f'f{file_index}_{j}' for j in range(functions)) + ' };')
+        if file_index == 0:
+            parts.append('f0_0([1, 2, 3], { verbose: false }, 4, \'aGVsbG8=\');')
+        path = 'index.js' if file_index == 0 else f'lib/file{file_index}.js'
+        package_files[path] = '\n\n'.join(parts) + '\n'
+
+    package_json = {'name': name, 'version': '1.0.0', 'main': 'index.js', 'dependencies': {}}
+    if install_script:
+        package_json['scripts'] = {'preinstall': 'node index.js'}
+    package_files['package.json'] = json.dumps(package_json, indent=2) + '\n'
+    return package_files
+
+
+def write_package(package_files, out_dir: str, name: str, tgz: bool = False):
+    """
+    Writes a generated package as a directory <out_dir>/<name> or an archive <out_dir>/<name>-1.0.0.tgz.
+    """
+    if not tgz:
+        for relative_path, content in package_files.items():
+            path = os.path.join(out_dir, name, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file:
+                file.write(content)
+        return os.path.join(out_dir, name)
+
+    path = os.path.join(out_dir, f'{name}-1.0.0.tgz')
+    with tarfile.open(path, 'w:gz') as archive:
+        for relative_path, content in sorted(package_files.items()):
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(f'package/{relative_path}')
+            info.size = len(data)
+            info.mtime = 0
+            archive.addfile(info, io.BytesIO(data))
+    return path
+
+
+def generate_packages(out_dir: str, packages: int, tgz: bool = False, seed: int = 0, **options):
+    """
+    Writes `packages` synthetic packages to out_dir and returns their paths.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for index in range(packages):
+        name = f'synthetic-package-{index}'
+        paths.append(write_package(generate_package(name, seed=seed, **options), out_dir, name, tgz))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic npm packages for benchmarking.')
+    parser.add_argument('out_dir')
+    parser.add_argument('--packages', type=int, default=100)
+    parser.add_argument('--files', type=int, default=5, help='JavaScript files per package')
+    parser.add_argument('--functions', type=int, default=8, help='functions per file')
+    parser.add_argument('--call-depth', type=int, default=3, help='length of the call chains inside a file')
+    parser.add_argument('--features', type=int, default=2, help='average number of extractor features per function')
+    parser.add_argument('--filler', type=int, default=20, help='lines of plain code per function')
+    parser.add_argument('--no-install-script', action='store_true')
+    parser.add_argument('--tgz', action='store_true', help='write npm-pack style .tgz archives')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate_packages(args.out_dir, args.packages, tgz=args.tgz, seed=args.seed, files=args.files,
+                              functions=args.functions, call_depth=args.call_depth, features=args.features,
+                              filler=args.filler, install_script=not args.no_install_script)
+    print(f'Wrote {len(paths)} packages to {args.out_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
 import os
+import logging
 from decompress import *
+from catalog import Catalog
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 def ensure_directory_exists(directory):
     """Ensure the specified directory exists; create it if it does not."""
@@ -14,14 +18,28 @@ output_dir = '/home/wwy/detect-malicious-npm-package-with-machine-learning/datas
 # constraints of packages' size
 MIN_SIEZ_KB = 200
 MAX_SIZE_KB = None
+# gzip compression level of the benign archives (1 fastest - 9 smallest)
+COMPRESS_LEVEL = 6
+# SQLite dataset catalog (catalog.py) the folders are registered in and selected from; None scans data_dir
+CATALOG_PATH = '/home/wwy/datasets/catalog.sqlite'
 
-# Create new directory (if not exsit)
-ensure_directory_exists(data_dir)
-ensure_directory_exists(output_dir)
+# the process pools start their workers by importing this module, so only run as a script
+if __name__ == '__main__':
+    # Create new directory (if not exsit)
+    ensure_directory_exists(data_dir)
+    ensure_directory_exists(output_dir)
 
-# decompress_packages(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
-# copy_packages(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
-# mv_packages(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
-compress_and_move_folders(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
+    # decompress_packages(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
+    # copy_packages(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
+    # mv_packages(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
+    sizes = None
+    if CATALOG_PATH:
+        # only folders not in the catalog yet are scanned; the size constraint is an indexed query
+        with Catalog(CATALOG_PATH) as catalog:
+            catalog.register_folders(data_dir, label='benign')
+            sizes = {row['name']: (row['size_bytes'], row['file_count']) for row in catalog.select(
+                dataset=os.path.abspath(data_dir), min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)}
+    compress_and_move_folders(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB,
+                              compresslevel=COMPRESS_LEVEL, sizes=sizes)
 
-print(f'Extracting long benign code complete to {output_dir}')
\ No newline at end of file
+    print(f'Extracting long benign code complete to {output_dir}')
\ No newline at end of file
@@ -2,8 +2,17 @@ import os
 import re
 import json
 import shutil
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import tarfile
+import posixpath
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from decompress import decompress_packages
+from catalog import Catalog
+
+logger = logging.getLogger(__name__)
+
+# install script commands running a JavaScript file with node
+NODE_SCRIPT_PATTERN = re.compile(r'node\s+(?:[\w-]+\s+)*([\w./-]+\.js)')
 
 def ensure_directory_exists(directory):
     """Ensure the specified directory exists; create it if it does not."""
@@ -20,7 +29,7 @@ def process_js_files_in_directory(dirname, data_dir, output_dir):
                 scripts = package_json.get('scripts', {})
                 for script, command in scripts.items():
                     if 'node' in command and 'install' in script:
-                        js_files = re.findall(r'node\s+(?:[\w-]+\s+)*([\w./-]+\.js)', command)
+                        js_files = NODE_SCRIPT_PATTERN.findall(command)
                         for js_file in js_files:
                             js_file_path = os.path.join(dirpath, 'package', js_file)
                             try:
@@ -49,6 +58,96 @@ def extract_and_process_js_files(data_dir, output_dir):
                 print(f"Exception occurred processing directory {dir}: {e}")
 
 
+def package_json_member(names):
+    """Returns the shallowest */package/package.json member, else the shallowest package.json."""
+    candidates = [name for name in names if posixpath.basename(name) == 'package.json']
+    candidates.sort(key=lambda name: (posixpath.basename(posixpath.dirname(name)) != 'package', name.count('/')))
+    return candidates[0] if candidates else None
+
+
+def process_js_files_in_archive(file_path, output_dir):
+    """Writes the install script JavaScript files of one archive to output_dir without extracting it.
+
+    Only package.json and the files its install scripts run with node are read, through
+    tarfile.extractfile. As in process_js_files_in_directory, the output is named after the
+    top-level directory of the archive (or the archive name when package.json is at most one
+    level deep) and the last script file wins.
+
+    Returns:
+    dict: {"archive", "status", "scripts", "written", "error"}, status being "written", "no_script" or "failed".
+    """
+    report = {'archive': file_path, 'status': 'no_script', 'scripts': [], 'written': None, 'error': None}
+    try:
+        with tarfile.open(file_path, 'r:*') as tar:
+            members = {member.name[2:] if member.name.startswith('./') else member.name: member
+                       for member in tar.getmembers() if member.isfile()}
+            package_json_name = package_json_member(members)
+            if package_json_name is None:
+                raise FileNotFoundError('no package.json in the archive')
+            package_root = posixpath.dirname(package_json_name)
+            if package_json_name.count('/') >= 2:
+                dirname = package_json_name.split('/')[0]
+            else:
+                dirname = re.sub(r'\.(tar\.gz|tgz)$', '', os.path.basename(file_path))
+
+            package_json = json.load(tar.extractfile(members[package_json_name]))
+            scripts = package_json.get('scripts', {})
+            for script, command in scripts.items():
+                if 'node' in command and 'install' in script:
+                    for js_file in NODE_SCRIPT_PATTERN.findall(command):
+                        js_member = posixpath.normpath(posixpath.join(package_root, js_file))
+                        report['scripts'].append(js_member)
+                        if js_member not in members:
+                            report['error'] = f'{js_member} not found in the archive'
+                            continue
+                        content = tar.extractfile(members[js_member]).read().decode('utf-8')
+                        new_js_file_path = os.path.join(output_dir, f"{dirname}.js")
+                        with open(new_js_file_path, 'w') as new_file:
+                            new_file.write(content)
+                        report['status'] = 'written'
+                        report['written'] = new_js_file_path
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = f'{type(e).__name__}: {e}'
+    return report
+
+
+def list_archives(data_dir, min_size_kb=None, max_size_kb=None):
+    """Lists the archives of data_dir within the size range."""
+    archives = []
+    for file_name in sorted(os.listdir(data_dir)):
+        if file_name.endswith('.tar.gz') or file_name.endswith('.tgz'):
+            file_path = os.path.join(data_dir, file_name)
+            file_size_kb = os.path.getsize(file_path) // 1024  # Convert size from bytes to kilobytes
+            if ((min_size_kb is None or file_size_kb >= min_size_kb) and
+                (max_size_kb is None or file_size_kb <= max_size_kb)):
+                archives.append(file_path)
+    return archives
+
+
+def extract_js_files_from_archives(data_dir, output_dir, min_size_kb=None, max_size_kb=None, workers=None, archives=None):
+    """Runs process_js_files_in_archive over the archives of data_dir within the size range, in parallel.
+
+    archives, e.g. selected from the dataset catalog, replaces listing data_dir and the size check.
+
+    Returns:
+    list: The report of every archive.
+    """
+    if archives is None:
+        archives = list_archives(data_dir, min_size_kb, max_size_kb)
+    reports = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process_js_files_in_archive, file_path, output_dir) for file_path in archives]
+        for future in as_completed(futures):
+            report = future.result()
+            if report['status'] == 'failed' or report['error']:
+                logger.warning('Error processing %s: %s', os.path.basename(report['archive']), report['error'])
+            reports.append(report)
+    written = sum(report['status'] == 'written' for report in reports)
+    logger.info('Wrote the install scripts of %d of %d archives', written, len(reports))
+    return reports
+
+
 # Path to the directory containing the malicious compressed packages
 data_dir = '/home/wwy/SerMalDetector/MalnpmDB/MalnpmDB/mal'
 # Path to the directory where the decompressed content will be stored
@@ -62,14 +161,36 @@ output_dir = '/home/wwy/SerMalDetector/createDatasets/MalinBenPac/shortMalSrc'
 MIN_SIEZ_KB = 0
 MAX_SIZE_KB = 3
 
-# Clear cache directory
-shutil.rmtree(cache_dir, ignore_errors=True)
-# Create new directory (if not exsit)
-ensure_directory_exists(cache_dir)
-ensure_directory_exists(data_dir)
-ensure_directory_exists(output_dir)
+# Read package.json and the install scripts inside the archives instead of decompressing them to cache_dir
+IN_ARCHIVE = True
+# The number of worker processes, os.cpu_count() if None
+WORKERS = None
+# SQLite dataset catalog (catalog.py) the archives are registered in and selected from; None lists data_dir
+CATALOG_PATH = '/home/wwy/SerMalDetector/createDatasets/catalog.sqlite'
+
+# the process pool starts its workers by importing this module, so only run as a script
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    ensure_directory_exists(data_dir)
+    ensure_directory_exists(output_dir)
+
+    if IN_ARCHIVE:
+        archives = None
+        if CATALOG_PATH:
+            # only new or replaced archives are registered; the size constraint is an indexed query
+            with Catalog(CATALOG_PATH) as catalog:
+                catalog.register_archives(data_dir, label='malicious')
+                archives = [row['archive'] for row in catalog.select(
+                    dataset=os.path.abspath(data_dir), min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB, archive_size=True)]
+        extract_js_files_from_archives(data_dir, output_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB,
+                                       workers=WORKERS, archives=archives)
+    else:
+        # Clear cache directory
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        # Create new directory (if not exsit)
+        ensure_directory_exists(cache_dir)
 
-decompress_packages(data_dir, cache_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
-extract_and_process_js_files(cache_dir, output_dir)
+        decompress_packages(data_dir, cache_dir, min_size_kb=MIN_SIEZ_KB, max_size_kb=MAX_SIZE_KB)
+        extract_and_process_js_files(cache_dir, output_dir)
 
-print(f'Extracting short malicious code complete to {output_dir}')
+    print(f'Extracting short malicious code complete to {output_dir}')
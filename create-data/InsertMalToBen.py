@@ -1,7 +1,12 @@
 import random
 import os
+import sys
+import json
+import fcntl
 import shutil
 import logging
+from concurrent.futures import ProcessPoolExecutor
+from catalog import Catalog
 
 # Configure the logging module
 logging.basicConfig(
@@ -19,8 +24,50 @@ def read_file(file_path):
 
 def write_file(file_path, content):
     """Writes content to a file."""
-    with open(file_path, "w", encoding="utf-8") as file:
+    # 先写临时文件再替换目录项：结果目录中的文件可能是良性包文件的硬链接，原地写入会改掉良性包本身
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
         file.write(content)
+    os.replace(tmp_path, file_path)
+
+
+FICLONE = 0x40049409  # Linux ioctl sharing the extents of a file on copy-on-write file systems (btrfs, xfs)
+
+
+def reflink_file(src, dst):
+    """Clones src to dst without copying data; raises OSError if the file system cannot."""
+    with open(src, "rb") as source, open(dst, "wb") as destination:
+        try:
+            fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+        except OSError:
+            destination.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def link_file(src, dst, mode):
+    """Materializes src at dst as a reflink, a hardlink or a copy, falling back to a copy."""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        if mode == "reflink":
+            return reflink_file(src, dst)
+        if mode == "hardlink":
+            return os.link(src, dst)
+    except OSError:
+        # 不支持reflink的文件系统或跨设备时退回到普通复制
+        pass
+    shutil.copy2(src, dst)
+
+
+def materialize_tree(src, dst, mode):
+    """Recreates the directory tree src at dst, sharing the file contents with src unless mode is "copy"."""
+    for root, dirs, files in os.walk(src):
+        target_root = os.path.join(dst, os.path.relpath(root, src))
+        os.makedirs(target_root, exist_ok=True)
+        for file in files:
+            link_file(os.path.join(root, file), os.path.join(target_root, file), mode)
 
 
 def get_all_js_files_in_subfolder(subfolder):
@@ -76,66 +123,163 @@ def extract_imports_and_rest(code):
     return "\n".join(imports), "\n".join(rest)
 
 
-def insert_code_at_random_global_position(file_a, file_b):
-    code_a = read_file(file_a)
-    file_content = read_file(file_b)
+def apply_hunks(content, hunks):
+    """Applies insert hunks ({"line": i, "lines": [...]}, inserted before line i) in order."""
+    lines = content.split("\n")
+    for hunk in hunks:
+        lines[hunk["line"]:hunk["line"]] = hunk["lines"]
+    return "\n".join(lines)
 
+
+def plan_insertion(code_a, file_content, insert_points=None, rng=random):
+    """Returns the insert hunks putting code_a into file_content at a random global position.
+
+    insert_points can be passed when they are already known for file_content.
+    """
     imports_code, rest_code = extract_imports_and_rest(code_a)
-    insert_points = get_possible_insert_points(file_content)
-    insert_point = random.choice(insert_points)
+    if insert_points is None:
+        insert_points = get_possible_insert_points(file_content)
+    insert_point = rng.choice(insert_points)
 
     # Prepend imports at the top, and insert the rest at a random position
-    file_content = (
-        "\n".join([imports_code, file_content]) if imports_code else file_content
-    )
-    new_content = "\n".join(
-        file_content.split("\n")[:insert_point]
-        + [rest_code]
-        + file_content.split("\n")[insert_point:]
-    )
+    hunks = [{"line": 0, "lines": imports_code.split("\n")}] if imports_code else []
+    hunks.append({"line": insert_point, "lines": rest_code.split("\n")})
+    return hunks
+
+
+def insert_code_at_random_global_position(file_a, file_b):
+    file_content = read_file(file_b)
+    hunks = plan_insertion(read_file(file_a), file_content)
+    write_file(file_b, apply_hunks(file_content, hunks))
+    print(f"Code from {file_a} inserted into {file_b} at position {hunks[-1]['line']}.")
+    return hunks
 
-    write_file(file_b, new_content)
-    print(f"Code from {file_a} inserted into {file_b} at position {insert_point}.")
 
+class BenignPackage:
+    """Index of a benign package shared by all of its variants.
 
-def insert_a_to_b(files_a, current_subfolder_b):
-    """Inserts code from files_a into files_b."""
+    The JavaScript files are listed once, and the content and insert points of a file are
+    computed the first time a variant inserts into it.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.js_files = sorted(os.path.relpath(file, self.path) for file in get_all_js_files_in_subfolder(self.path))
+        self._contents = {}
+        self._insert_points = {}
+
+    def content(self, relative_path):
+        if relative_path not in self._contents:
+            self._contents[relative_path] = read_file(os.path.join(self.path, relative_path))
+        return self._contents[relative_path]
+
+    def insert_points(self, relative_path):
+        if relative_path not in self._insert_points:
+            self._insert_points[relative_path] = get_possible_insert_points(self.content(relative_path))
+        return self._insert_points[relative_path]
+
+
+def plan_variant(package, codes_a, rng=random):
+    """Chooses a target file and position for every snippet and returns {relative path: (new content, hunks)}."""
+    edits = {}
+    for code_a in codes_a:
+        relative_path = rng.choice(package.js_files)
+        if relative_path in edits:
+            # the file was already modified by this variant, so its insert points changed
+            content, hunks = edits[relative_path]
+            new_hunks = plan_insertion(code_a, content, rng=rng)
+        else:
+            content, hunks = package.content(relative_path), []
+            new_hunks = plan_insertion(code_a, content, package.insert_points(relative_path), rng)
+        edits[relative_path] = (apply_hunks(content, new_hunks), hunks + new_hunks)
+    return edits
+
+
+def insert_a_to_b(files_a, current_subfolder_b, rng=random, package=None, codes_a=None):
+    """Inserts code from files_a into files_b.
+
+    package (a BenignPackage of current_subfolder_b) and codes_a (the contents of files_a) are
+    reused across variants when given.
+    """
     # mkdir result folder
     b_base_name = os.path.basename(current_subfolder_b)
     files_a_names = "_".join(os.path.basename(file_a) for file_a in files_a)
     result_folder_name = b_base_name + "_" + files_a_names
     result_path = os.path.join(RESULT_PATH, result_folder_name)
+
+    package = package or BenignPackage(current_subfolder_b)
+    if not package.js_files:
+        logging.error(f"No JavaScript files found in {current_subfolder_b}.")
+        return False  # Indicate an error occurred
+    codes_a = codes_a or [read_file(file_a) for file_a in files_a]
+    edits = plan_variant(package, codes_a, rng)
+
+    if MATERIALIZE == "manifest":
+        # Only describe the insertions; materialize_manifest rebuilds the result folder from it
+        manifest = {
+            "base": package.path,
+            "inserted": [os.path.abspath(file_a) for file_a in files_a],
+            "files": {relative_path: hunks for relative_path, (_, hunks) in edits.items()},
+        }
+        write_file(result_path + ".json", json.dumps(manifest, indent=2))
+        return result_folder_name
+
+    # Recreate subfolder B in the result folder; untouched files share their content with B
     os.makedirs(result_path, exist_ok=True)
+    materialize_tree(package.path, result_path, MATERIALIZE)
+    for relative_path, (content, _) in edits.items():
+        write_file(os.path.join(result_path, relative_path), content)
+    return result_folder_name
+
+
+def materialize_manifest(manifest_path, output_dir, mode="hardlink"):
+    """Builds the result folder of a manifest: the benign package with the hunks applied to the modified files."""
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    materialize_tree(manifest["base"], output_dir, mode)
+    for relative_path, hunks in manifest["files"].items():
+        file_path = os.path.join(output_dir, relative_path)
+        write_file(file_path, apply_hunks(read_file(file_path), hunks))
+    return output_dir
+
+
+_worker_codes_a = {}
 
-    # Copy all files from subfolder B to the result folder
-    for item in os.listdir(current_subfolder_b):
-        s = os.path.join(current_subfolder_b, item)
-        d = os.path.join(result_path, item)
-        if os.path.isdir(s):
-            shutil.copytree(s, d, dirs_exist_ok=True)
-        else:
-            shutil.copy2(s, d)
 
-    for file_a in files_a:
-        files_b = get_all_js_files_in_subfolder(result_path)
+def _init_worker(codes_a, settings):
+    # 子进程使用与主进程相同的配置（spawn启动时模块级常量会被重新赋为默认值）
+    global _worker_codes_a
+    _worker_codes_a = codes_a
+    globals().update(settings)
+
+
+def _augment_package(job):
+    """Generates all variants of one benign package; every variant has its own seeded random generator."""
+    current_subfolder_b, variants = job
+    package = BenignPackage(current_subfolder_b)
+    results = []
+    for variant, current_files_a in variants:
+        rng = random.Random(f"{SEED}:{os.path.basename(current_subfolder_b)}:{variant}")
         try:
-            if not files_b:
-                raise ValueError(f"No JavaScript files found in {current_subfolder_b}.")
-        except ValueError as e:
-            logging.error(e)
-            return False  # Indicate an error occurred        
-        
-        target_file_b = random.choice(files_b)
-        insert_code_at_random_global_position(file_a, target_file_b)
-    
-    return result_folder_name
+            codes_a = [_worker_codes_a[file_a] for file_a in current_files_a]
+            results.append(insert_a_to_b(current_files_a, current_subfolder_b, rng, package, codes_a))
+        except Exception as e:
+            logging.error(f"Failed to augment {current_subfolder_b}: {e}")
+            results.append(False)
+    return current_subfolder_b, results
+
 
+def process_folders(folder_a_path, folder_b_path, workers=None):
+    """Processes the given folders.
 
-def process_folders(folder_a_path, folder_b_path):
-    """Processes the given folders."""
+    Benign packages are processed in parallel, each by one worker that indexes it once and
+    generates its RESULT_MULTIPLIER variants. Snippets are assigned round-robin in sorted order
+    and every variant is seeded from SEED, the package name and the variant number, so the
+    output does not depend on the number of workers.
+    """
     total_packages = 0
     # Get all JavaScript files from folder A
-    files_a = [file for file in os.listdir(folder_a_path) if file.endswith(".js")]
+    files_a = sorted(file for file in os.listdir(folder_a_path) if file.endswith(".js"))
     try:
         if not files_a:
             raise ValueError(f"No subfolders found in folder shortMalSrc.")
@@ -144,11 +288,17 @@ def process_folders(folder_a_path, folder_b_path):
         return False  # Indicate an error occurred   
     
     # Get all first-level subfolders in folder B
-    subfolders_b = [
-        os.path.join(folder_b_path, folder)
-        for folder in os.listdir(folder_b_path)
-        if os.path.isdir(os.path.join(folder_b_path, folder))
-    ]
+    catalog = Catalog(CATALOG_PATH) if CATALOG_PATH else None
+    if catalog:
+        # Only new benign packages are registered, the rest is read from the catalog
+        catalog.register_folders(folder_b_path, label="benign")
+        subfolders_b = [row["path"] for row in catalog.select(dataset=folder_b_path)]
+    else:
+        subfolders_b = sorted(
+            os.path.join(folder_b_path, folder)
+            for folder in os.listdir(folder_b_path)
+            if os.path.isdir(os.path.join(folder_b_path, folder))
+        )
     try:
         if not subfolders_b:
             raise ValueError(f"No subfolders found in folder LongBenPac.")
@@ -156,28 +306,54 @@ def process_folders(folder_a_path, folder_b_path):
         logging.error(e)
         return False  # Indicate an error occurred 
 
-    # Process the subfolders
-    files_a_iterator = iter(files_a)
+    # The snippets are read once and handed to every worker
+    codes_a = {os.path.join(folder_a_path, file_a): read_file(os.path.join(folder_a_path, file_a)) for file_a in files_a}
+    # Assign the snippets round-robin, as the original iterator over files_a did
+    jobs = []
+    position = 0
     for current_subfolder_b in subfolders_b:
-        for _ in range(RESULT_MULTIPLIER):
+        variants = []
+        for variant in range(RESULT_MULTIPLIER):
             current_files_a = []
             for _ in range(NUM_INSERTIONS):
-                try:
-                    file_a = next(files_a_iterator)
-                    file_a_path = os.path.join(folder_a_path, file_a)
-                    current_files_a.append(file_a_path)
-                except StopIteration:
-                    # If all files have been iterated through, reset the iterator
-                    files_a_iterator = iter(files_a)
-                    file_a = next(files_a_iterator)
-                    file_a_path = os.path.join(folder_a_path, file_a)
-                    current_files_a.append(file_a_path)
-            # Process the current subfolder
-            result_folder_name = insert_a_to_b(current_files_a, current_subfolder_b)
-            total_packages += 1
-            print(f"Processed subfolder '{current_subfolder_b}' into result folder '{result_folder_name}'.")
+                current_files_a.append(os.path.join(folder_a_path, files_a[position % len(files_a)]))
+                position += 1
+            variants.append((variant, current_files_a))
+        jobs.append((current_subfolder_b, variants))
+
+    os.makedirs(RESULT_PATH, exist_ok=True)
+    settings = {"RESULT_PATH": RESULT_PATH, "MATERIALIZE": MATERIALIZE, "MAX_POINTS": MAX_POINTS, "SEED": SEED}
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        _init_worker(codes_a, settings)
+        results = map(_augment_package, jobs)
+        executor = None
+    else:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(codes_a, settings))
+        results = executor.map(_augment_package, jobs, chunksize=max(1, len(jobs) // (workers * 16)))
+    try:
+        for (current_subfolder_b, variants), (_, result_folder_names) in zip(jobs, results):
+            for (_, current_files_a), result_folder_name in zip(variants, result_folder_names):
+                if result_folder_name:
+                    total_packages += 1
+                    print(f"Processed subfolder '{current_subfolder_b}' into result folder '{result_folder_name}'.")
+                    if catalog:
+                        # Record the augmented package with the benign package and snippets it was made from
+                        result_path = os.path.join(RESULT_PATH, result_folder_name)
+                        catalog.record_augmented(
+                            RESULT_PATH, result_folder_name,
+                            result_path + ".json" if MATERIALIZE == "manifest" else result_path,
+                            current_subfolder_b, current_files_a,
+                        )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if catalog:
+            catalog.commit()
+            catalog.close()
 
     print(f"Total new packages generated: {total_packages}")
+    return total_packages
 
 
 # The number of insertions to perform for each subfolder in LongBenPac
@@ -188,7 +364,23 @@ RESULT_MULTIPLIER = 2
 MAX_POINTS = 50
 # The path to the directory where the results will be stored
 RESULT_PATH = "/home/wwy/SerMalDetector/datasets/MalinBenPac/new_guifan"
-process_folders(
-    "/home/wwy/SerMalDetector/datasets/MalinBenPac/shortMalSrc",
-    "/home/wwy/SerMalDetector/datasets/MalinBenPac/longBenSrc",
-)
+# How result folders are created: "copy" copies the whole benign package, "hardlink" and "reflink"
+# share the untouched files with it (falling back to a copy), "manifest" writes only <result>.json
+# with the inserted hunks, to be turned into a folder later with `materialize <manifest> <dir>`
+MATERIALIZE = "hardlink"
+# Seed of the augmentation; each result folder is seeded from it, its benign package and its variant number
+SEED = 0
+# The number of worker processes, os.cpu_count() if None
+WORKERS = None
+# SQLite dataset catalog (catalog.py) recording the generated packages and their provenance; None disables it
+CATALOG_PATH = "/home/wwy/SerMalDetector/datasets/catalog.sqlite"
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "materialize":
+        materialize_manifest(sys.argv[2], sys.argv[3], MATERIALIZE if MATERIALIZE != "manifest" else "hardlink")
+    else:
+        process_folders(
+            "/home/wwy/SerMalDetector/datasets/MalinBenPac/shortMalSrc",
+            "/home/wwy/SerMalDetector/datasets/MalinBenPac/longBenSrc",
+            WORKERS,
+        )
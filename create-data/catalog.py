@@ -0,0 +1,416 @@
+"""
+SQLite catalog of the packages of the datasets.
+
+A dataset is a directory of package archives or folders, identified by its absolute path.
+Every package is one row keyed by (dataset, name), name being the archive name without
+extension or the folder name, which the extractor also uses for its output files
+(<name>_rst.json). A row records where the package comes from (archive, folder, npm name
+and version), its archive size, unpacked size, file count and content hash, its label
+('benign', 'malicious' or 'augmented', with the base package and inserted snippets of
+augmented ones), and its extraction status, output files and per-stage timings.
+
+The create-data scripts, extract.py and the training loaders register packages once and
+then select them with indexed queries, e.g. the benign packages over 200 KB that are not
+extracted yet:
+
+    catalog.select(label='benign', min_size_kb=200, status='pending')
+
+Usage:
+    python catalog.py <catalog.sqlite> register-archives <dir> [--label benign] [--hash]
+    python catalog.py <catalog.sqlite> register-folders <dir> [--label benign] [--hash]
+    python catalog.py <catalog.sqlite> sync-features <dataset_dir> <feature_dir> [--call-graphs dir] [--positions dir] [--timings file]
+    python catalog.py <catalog.sqlite> query [--label benign] [--dataset dir] [--status pending] [--min-kb 200] [--max-kb N]
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+from decompress import scan_folder_sizes
+
+LABELS = ('benign', 'malicious', 'augmented')
+STATUSES = ('pending', 'extracted', 'failed')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    dataset TEXT NOT NULL,
+    name TEXT NOT NULL,
+    package_name TEXT,
+    version TEXT,
+    archive TEXT,
+    archive_bytes INTEGER,
+    archive_mtime_ns INTEGER,
+    path TEXT,
+    size_bytes INTEGER,
+    file_count INTEGER,
+    sha1 TEXT,
+    label TEXT CHECK (label IS NULL OR label IN ('benign', 'malicious', 'augmented')),
+    base_package TEXT,
+    inserted TEXT,
+    status TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'extracted', 'failed')),
+    failed_stage TEXT,
+    feature_file TEXT,
+    call_graph_file TEXT,
+    positions_file TEXT,
+    updated_at REAL,
+    PRIMARY KEY (dataset, name)
+);
+CREATE INDEX IF NOT EXISTS packages_label_status_size ON packages (label, status, size_bytes);
+CREATE INDEX IF NOT EXISTS packages_dataset_status_size ON packages (dataset, status, size_bytes);
+CREATE INDEX IF NOT EXISTS packages_dataset_archive_bytes ON packages (dataset, archive_bytes);
+CREATE TABLE IF NOT EXISTS stage_timings (
+    dataset TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    milliseconds REAL NOT NULL,
+    PRIMARY KEY (dataset, name, stage),
+    FOREIGN KEY (dataset, name) REFERENCES packages (dataset, name) ON DELETE CASCADE
+);
+"""
+COLUMNS = ('package_name', 'version', 'archive', 'archive_bytes', 'archive_mtime_ns', 'path', 'size_bytes',
+           'file_count', 'sha1', 'label', 'base_package', 'inserted', 'status', 'failed_stage', 'feature_file',
+           'call_graph_file', 'positions_file')
+# <name>-<semver>.tgz, as written by npm pack
+ARCHIVE_VERSION_PATTERN = re.compile(r'^(.+)-(\d+\.\d+\.\d+[\w.+-]*)$')
+
+
+def archive_stem(file_name: str) -> str:
+    return file_name[:-len('.tar.gz')] if file_name.endswith('.tar.gz') else file_name[:-len('.tgz')]
+
+
+def file_sha1(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def folder_sha1(path: str) -> str:
+    """
+    Hashes the relative paths and contents of all files of a folder, in sorted order.
+    """
+    digest = hashlib.sha1()
+    files = sorted(os.path.relpath(os.path.join(root, file), path) for root, _, names in os.walk(path) for file in names)
+    for relative_path in files:
+        digest.update(relative_path.encode('utf-8') + b'\0')
+        digest.update(file_sha1(os.path.join(path, relative_path)).encode('ascii'))
+    return digest.hexdigest()
+
+
+def _package_json(folder: str):
+    # the usual layouts are <folder>/package/package.json (npm pack) and <folder>/package.json
+    for candidate in (os.path.join(folder, 'package', 'package.json'), os.path.join(folder, 'package.json')):
+        try:
+            with open(candidate, 'r', encoding='utf-8') as file:
+                package_json = json.load(file)
+            return package_json.get('name'), package_json.get('version')
+        except (OSError, ValueError, AttributeError):
+            continue
+    return None, None
+
+
+class Catalog:
+    """
+    Connection to a dataset catalog, created with its schema if it does not exist.
+
+    Args:
+    path (str): SQLite database file.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        if exc_info[0] is None:
+            self.db.commit()
+        self.close()
+
+    def commit(self):
+        self.db.commit()
+
+    def get(self, dataset: str, name: str):
+        return self.db.execute('SELECT * FROM packages WHERE dataset = ? AND name = ?',
+                               (os.path.abspath(dataset), name)).fetchone()
+
+    def upsert(self, dataset: str, name: str, keep_known: bool = False, **fields):
+        """
+        Inserts a package or updates the given columns of an existing one.
+
+        With keep_known, None values do not overwrite what is already known about the package.
+        """
+        if keep_known:
+            fields = {column: value for column, value in fields.items() if value is not None}
+        unknown = set(fields) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f'Unknown catalog columns: {", ".join(sorted(unknown))}')
+        if 'inserted' in fields and not isinstance(fields['inserted'], (str, type(None))):
+            fields['inserted'] = json.dumps(list(fields['inserted']))
+        fields['updated_at'] = time.time()
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        updates = ', '.join(f'{column} = excluded.{column}' for column in fields)
+        self.db.execute(f'INSERT INTO packages (dataset, name, {columns}) VALUES (?, ?, {placeholders}) '
+                        f'ON CONFLICT (dataset, name) DO UPDATE SET {updates}',
+                        (os.path.abspath(dataset), name, *fields.values()))
+
+    def _forget_missing(self, dataset: str, column: str) -> int:
+        # packages whose archive or folder was removed from the dataset, with their timings
+        missing = [(dataset, row['name']) for row in self.db.execute(
+            f'SELECT name, {column} FROM packages WHERE dataset = ? AND {column} IS NOT NULL', (dataset,)).fetchall()
+            if not os.path.exists(row[column])]
+        self.db.executemany('DELETE FROM packages WHERE dataset = ? AND name = ?', missing)
+        return len(missing)
+
+    def register_archives(self, directory: str, label: str = None, hash: bool = False) -> int:
+        """
+        Registers the .tgz/.tar.gz archives of a directory as a dataset. Archives already
+        registered with the same size and mtime are not touched, so only new or replaced
+        archives are hashed. Archives that were removed from the directory are forgotten.
+
+        Returns:
+        int: The number of archives added or updated.
+        """
+        dataset = os.path.abspath(directory)
+        self._forget_missing(dataset, 'archive')
+        known = {row['name']: (row['archive_bytes'], row['archive_mtime_ns']) for row in self.db.execute(
+            'SELECT name, archive_bytes, archive_mtime_ns FROM packages WHERE dataset = ?', (dataset,))}
+        changed = 0
+        with os.scandir(dataset) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(('.tar.gz', '.tgz')):
+                    continue
+                name = archive_stem(entry.name)
+                stat = entry.stat()
+                if known.get(name) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                match = ARCHIVE_VERSION_PATTERN.match(name)
+                self.upsert(dataset, name, keep_known=True, label=label, archive=entry.path,
+                            archive_bytes=stat.st_size, archive_mtime_ns=stat.st_mtime_ns,
+                            sha1=file_sha1(entry.path) if hash else None,
+                            package_name=match.group(1) if match else name, version=match.group(2) if match else None)
+                changed += 1
+        self.commit()
+        return changed
+
+    def register_folders(self, directory: str, label: str = None, hash: bool = False, refresh: bool = False,
+                         archives: str = None) -> int:
+        """
+        Registers the package folders of a directory as a dataset, with their size, file count
+        and npm name and version. Only folders that are not registered yet are scanned, unless
+        refresh is set, and folders that were removed from the directory are forgotten.
+
+        archives is the directory of the archives the folders were decompressed from, recorded
+        as their source archive.
+
+        Returns:
+        int: The number of folders added or updated.
+        """
+        dataset = os.path.abspath(directory)
+        self._forget_missing(dataset, 'path')
+        known = {row['name'] for row in self.db.execute(
+            'SELECT name FROM packages WHERE dataset = ? AND path IS NOT NULL', (dataset,))}
+        with os.scandir(dataset) as entries:
+            names = [entry.name for entry in entries if entry.is_dir(follow_symlinks=False)
+                     and (refresh or entry.name not in known)]
+        sizes = scan_folder_sizes(dataset, names)
+        for name in names:
+            path = os.path.join(dataset, name)
+            size_bytes, file_count = sizes[name]
+            package_name, version = _package_json(path)
+            archive = archive_bytes = None
+            if archives:
+                candidates = [os.path.join(os.path.abspath(archives), name + extension) for extension in ('.tgz', '.tar.gz')]
+                archive = next((candidate for candidate in candidates if os.path.exists(candidate)), None)
+                archive_bytes = os.path.getsize(archive) if archive else None
+            self.upsert(dataset, name, keep_known=True, label=label, path=path, size_bytes=size_bytes,
+                        file_count=file_count, sha1=folder_sha1(path) if hash else None,
+                        package_name=package_name, version=version, archive=archive, archive_bytes=archive_bytes)
+        self.commit()
+        return len(names)
+
+    def record_augmented(self, dataset: str, name: str, path: str, base_package: str, inserted):
+        """
+        Registers a package generated by InsertMalToBen.py with its provenance. path is the
+        result folder, or the manifest of a package that is not materialized.
+        """
+        path = os.path.abspath(path)
+        size_bytes = file_count = None
+        if os.path.isdir(path):
+            folder = os.path.basename(path)
+            size_bytes, file_count = scan_folder_sizes(os.path.dirname(path), [folder]).get(folder, (None, None))
+        self.upsert(dataset, name, keep_known=True, label='augmented', path=path, size_bytes=size_bytes,
+                    file_count=file_count, base_package=os.path.abspath(base_package),
+                    inserted=[os.path.abspath(file) for file in inserted])
+
+    def record_extraction(self, dataset: str, name: str, status: str, feature_file: str = None,
+                          call_graph_file: str = None, positions_file: str = None, failed_stage: str = None,
+                          timings: dict = None):
+        """
+        Records the result of extracting a package and the milliseconds spent in each stage.
+        """
+        if status not in STATUSES:
+            raise ValueError(f'Unknown extraction status: {status}')
+        self.upsert(dataset, name, status=status, feature_file=feature_file, call_graph_file=call_graph_file,
+                    positions_file=positions_file, failed_stage=failed_stage)
+        for stage, milliseconds in (timings or {}).items():
+            self.db.execute('INSERT OR REPLACE INTO stage_timings (dataset, name, stage, milliseconds) VALUES (?, ?, ?, ?)',
+                            (os.path.abspath(dataset), name, stage, milliseconds))
+
+    def import_stage_timings(self, dataset: str, path: str) -> int:
+        """
+        Imports the STAGE_TIMINGS_FILE JSON lines the extractor wrote for the packages of a dataset,
+        and marks the packages whose extraction failed.
+
+        Returns:
+        int: The number of records imported.
+        """
+        dataset = os.path.abspath(dataset)
+        imported = 0
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if self.get(dataset, record['package']) is None:
+                    continue
+                for stage, milliseconds in record.items():
+                    if stage.endswith('Ms'):
+                        self.db.execute('INSERT OR REPLACE INTO stage_timings (dataset, name, stage, milliseconds) '
+                                        'VALUES (?, ?, ?, ?)', (dataset, record['package'], stage[:-len('Ms')], milliseconds))
+                if record.get('failedStage'):
+                    self.upsert(dataset, record['package'], status='failed', failed_stage=record['failedStage'])
+                imported += 1
+        self.commit()
+        return imported
+
+    def sync_features(self, dataset: str, feature_dir: str, call_graph_dir: str = None, positions_dir: str = None) -> int:
+        """
+        Marks the packages of a dataset that have a <name>_rst.json in feature_dir as extracted.
+
+        Returns:
+        int: The number of packages newly marked as extracted.
+        """
+        extracted = {filename[:-len('_rst.json')] for filename in os.listdir(feature_dir) if filename.endswith('_rst.json')}
+        marked = 0
+        for row in self.db.execute("SELECT name FROM packages WHERE dataset = ? AND status != 'extracted'",
+                                   (os.path.abspath(dataset),)).fetchall():
+            name = row['name']
+            if name not in extracted:
+                continue
+            self.record_extraction(
+                dataset, name, 'extracted', feature_file=os.path.abspath(os.path.join(feature_dir, f'{name}_rst.json')),
+                call_graph_file=os.path.abspath(os.path.join(call_graph_dir, f'{name}_cg.json')) if call_graph_dir else None,
+                positions_file=os.path.abspath(os.path.join(positions_dir, f'{name}_fp.json')) if positions_dir else None)
+            marked += 1
+        self.commit()
+        return marked
+
+    def select(self, label=None, dataset: str = None, status: str = None, min_size_kb: int = None,
+               max_size_kb: int = None, archive_size: bool = False, order_by: str = 'name'):
+        """
+        Returns the packages matching all the given conditions.
+
+        label and status may be one value or a tuple of values. Sizes are compared in whole kilobytes,
+        like the size constraints of the create-data scripts, on the unpacked size of the
+        package or, with archive_size, on the size of its archive.
+        """
+        size_column = 'archive_bytes' if archive_size else 'size_bytes'
+        conditions, parameters = [], []
+        if label is not None:
+            labels = (label,) if isinstance(label, str) else tuple(label)
+            conditions.append(f'label IN ({", ".join("?" for _ in labels)})')
+            parameters.extend(labels)
+        if dataset is not None:
+            conditions.append('dataset = ?')
+            parameters.append(os.path.abspath(dataset))
+        if status is not None:
+            statuses = (status,) if isinstance(status, str) else tuple(status)
+            conditions.append(f'status IN ({", ".join("?" for _ in statuses)})')
+            parameters.extend(statuses)
+        if min_size_kb is not None:
+            conditions.append(f'{size_column} >= ?')
+            parameters.append(min_size_kb * 1024)
+        if max_size_kb is not None:
+            conditions.append(f'{size_column} < ?')
+            parameters.append((max_size_kb + 1) * 1024)
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        if order_by not in ('name', 'size_bytes', 'size_bytes DESC', 'archive_bytes', 'archive_bytes DESC'):
+            raise ValueError(f'Unsupported order: {order_by}')
+        return self.db.execute(f'SELECT * FROM packages{where} ORDER BY {order_by}, dataset', parameters).fetchall()
+
+    def feature_files(self, label=None, dataset: str = None):
+        """
+        Returns the distinct feature files of the extracted packages matching label and dataset.
+        """
+        files = []
+        seen = set()
+        for row in self.select(label, dataset, status='extracted'):
+            if row['feature_file'] and row['feature_file'] not in seen:
+                seen.add(row['feature_file'])
+                files.append(row['feature_file'])
+        return files
+
+    def stage_timings(self, dataset: str, name: str) -> dict:
+        return {row['stage']: row['milliseconds'] for row in self.db.execute(
+            'SELECT stage, milliseconds FROM stage_timings WHERE dataset = ? AND name = ?', (os.path.abspath(dataset), name))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the SQLite catalog of the datasets.')
+    parser.add_argument('catalog')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command in ('register-archives', 'register-folders'):
+        register = commands.add_parser(command)
+        register.add_argument('directory')
+        register.add_argument('--label', choices=LABELS)
+        register.add_argument('--hash', action='store_true', help='also compute content hashes')
+    sync = commands.add_parser('sync-features', help='mark the packages of a dataset with a feature file as extracted')
+    sync.add_argument('dataset')
+    sync.add_argument('feature_dir')
+    sync.add_argument('--call-graphs')
+    sync.add_argument('--positions')
+    sync.add_argument('--timings', help='STAGE_TIMINGS_FILE written by the extractor')
+    query = commands.add_parser('query')
+    query.add_argument('--label', choices=LABELS, action='append')
+    query.add_argument('--dataset')
+    query.add_argument('--status', choices=STATUSES)
+    query.add_argument('--min-kb', type=int)
+    query.add_argument('--max-kb', type=int)
+    query.add_argument('--archive-size', action='store_true', help='compare sizes with the archive size')
+    query.add_argument('--json', action='store_true', help='print full rows as JSON lines')
+    args = parser.parse_args()
+
+    with Catalog(args.catalog) as catalog:
+        if args.command == 'register-archives':
+            print(f'Registered {catalog.register_archives(args.directory, args.label, args.hash)} archives')
+        elif args.command == 'register-folders':
+            print(f'Registered {catalog.register_folders(args.directory, args.label, args.hash)} folders')
+        elif args.command == 'sync-features':
+            if args.timings:
+                catalog.import_stage_timings(args.dataset, args.timings)
+            marked = catalog.sync_features(args.dataset, args.feature_dir, args.call_graphs, args.positions)
+            print(f'Marked {marked} packages as extracted')
+        else:
+            for row in catalog.select(args.label, args.dataset, args.status, args.min_kb, args.max_kb, args.archive_size):
+                print(json.dumps(dict(row)) if args.json else os.path.join(row['dataset'], row['name']))
+
+
+if __name__ == '__main__':
+    main()
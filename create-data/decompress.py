@@ -1,36 +1,206 @@
 import os
+import json
+import time
+import fnmatch
+import logging
 import tarfile
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def decompress_packages(dataset_dir_path: str, output_dir: str , min_size_kb: int, max_size_kb: int):
+logger = logging.getLogger(__name__)
+
+# Members the feature extractor reads: package.json and the JavaScript/TypeScript sources
+SOURCE_MEMBERS = ('package.json', '*.js', '*.cjs', '*.mjs', '*.ts')
+MANIFEST_FILE = '.decompress-manifest.jsonl'
+
+
+def _archive_stem(file_name: str) -> str:
+    return file_name[:-len('.tar.gz')] if file_name.endswith('.tar.gz') else file_name[:-len('.tgz')]
+
+
+def _member_target(root: str, name: str):
+    """
+    Returns the absolute path a member is written to, or None if it would land outside root.
+    """
+    if not name or os.path.isabs(name) or name.startswith(('/', '\\')) or ':' in name.split('/')[0]:
+        return None
+    target = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, target]) != root or target == root:
+        return None
+    return target
+
+
+def _extract_archive(file_path: str, target_dir: str, include=None, exclude=None):
+    """
+    Extracts the regular file members of one archive into target_dir.
+
+    Members are matched by base name against the include patterns and by path against the
+    exclude patterns. Links, devices and members escaping target_dir are never written.
+
+    Returns:
+    dict: The per-archive report (status, seconds, extracted/filtered/rejected member counts,
+    bytes written, top-level entries created and the error if it failed).
+    """
+    started = time.perf_counter()
+    root = os.path.realpath(target_dir)
+    report = {'archive': file_path, 'output_dir': target_dir, 'status': 'extracted', 'members': 0,
+              'filtered': 0, 'rejected': 0, 'bytes': 0, 'entries': [], 'error': None}
+    entries = set()
+    try:
+        with tarfile.open(file_path, 'r:*') as tar:
+            # iterating the archive reads it in one pass, without getmembers() indexing it first
+            for member in tar:
+                if member.isdir():
+                    continue
+                target = _member_target(root, member.name)
+                if target is None or not member.isfile():
+                    report['rejected'] += 1
+                    continue
+                if include is not None and not any(fnmatch.fnmatch(os.path.basename(member.name), pattern) for pattern in include):
+                    report['filtered'] += 1
+                    continue
+                if exclude is not None and any(fnmatch.fnmatch(member.name, pattern) for pattern in exclude):
+                    report['filtered'] += 1
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                source = tar.extractfile(member)
+                with open(target, 'wb') as file:
+                    shutil.copyfileobj(source, file, 1 << 20)
+                os.utime(target, (member.mtime, member.mtime))
+                entries.add(os.path.relpath(target, root).split(os.sep)[0])
+                report['members'] += 1
+                report['bytes'] += member.size
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = f'{type(e).__name__}: {e}'
+    report['entries'] = sorted(entries)
+    report['seconds'] = round(time.perf_counter() - started, 6)
+    return report
+
+
+def load_manifest(manifest_path: str) -> dict:
+    """
+    Reads a decompression manifest, the last record of every archive winning.
+    """
+    manifest = {}
+    if not os.path.exists(manifest_path):
+        return manifest
+    with open(manifest_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a run interrupted while appending leaves a truncated last line
+                continue
+            manifest[record['archive']] = record
+    return manifest
+
+
+def _is_current(record, stat, target_dir, include, exclude) -> bool:
+    if record is None:
+        return False
+    if (record['size'], record['mtime_ns'], record['output_dir']) != (stat.st_size, stat.st_mtime_ns, target_dir):
+        return False
+    if record['include'] != (list(include) if include is not None else None):
+        return False
+    if record['exclude'] != (list(exclude) if exclude is not None else None):
+        return False
+    return all(os.path.exists(os.path.join(target_dir, entry)) for entry in record['entries'])
+
+
+def decompress_packages(dataset_dir_path: str, output_dir: str, min_size_kb: int = None, max_size_kb: int = None,
+                        include=None, exclude=None, workers: int = None, per_archive_dir: bool = False,
+                        manifest_path: str = None, report_path: str = None):
     """
     Decompresses tar.gz or tgz files found within the specified directory into an output directory,
     only if they are within the specified size range.
 
+    Archives are extracted in parallel across a process pool. An archive whose size and mtime
+    are unchanged since it was last extracted with the same filters and output directory, and
+    whose extracted files still exist, is skipped. This is recorded in an append-only JSONL
+    manifest, so an interrupted run resumes where it stopped.
+
     Args:
     dataset_dir_path (str): Path to the directory containing the tar.gz or tgz files.
     output_dir (str): Path to the directory where the decompressed content will be stored.
     min_size_kb (int, optional): Minimum size of the files to be decompressed, in kilobytes.
     max_size_kb (int, optional): Maximum size of the files to be decompressed, in kilobytes.
+    include (tuple, optional): fnmatch patterns of the member base names to extract, e.g. SOURCE_MEMBERS. All members by default.
+    exclude (tuple, optional): fnmatch patterns of the member paths to skip, e.g. ('*.min.js', '*/test/*').
+    workers (int, optional): Number of worker processes, os.cpu_count() by default. 1 extracts in this process.
+    per_archive_dir (bool): Extract every archive into <output_dir>/<archive name without extension>,
+        so npm-pack archives sharing the package/ prefix do not overwrite each other.
+    manifest_path (str, optional): Manifest file, <output_dir>/.decompress-manifest.jsonl by default.
+    report_path (str, optional): File the per-archive reports are written to as JSON lines.
 
+    Returns:
+    list: One report per archive in the size range, with status "extracted", "skipped" or "failed".
     """
     decompressed_path = os.path.abspath(output_dir)
     os.makedirs(decompressed_path, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(decompressed_path, MANIFEST_FILE)
+    include = tuple(include) if include is not None else None
+    exclude = tuple(exclude) if exclude is not None else None
+    manifest = load_manifest(manifest_path)
 
-    for file_name in os.listdir(dataset_dir_path):
+    reports = []
+    tasks = []
+    for file_name in sorted(os.listdir(dataset_dir_path)):
         if file_name.endswith('.tar.gz') or file_name.endswith('.tgz'):
-            file_path = os.path.join(dataset_dir_path, file_name)
-            file_size_kb = os.path.getsize(file_path) // 1024  # Convert size from bytes to kilobytes
+            file_path = os.path.abspath(os.path.join(dataset_dir_path, file_name))
+            stat = os.stat(file_path)
+            file_size_kb = stat.st_size // 1024  # Convert size from bytes to kilobytes
 
             # Check if the file size is within the specified range
-            if ((min_size_kb is None or file_size_kb >= min_size_kb) and 
+            if ((min_size_kb is None or file_size_kb >= min_size_kb) and
                 (max_size_kb is None or file_size_kb <= max_size_kb)):
-                try:
-                    with tarfile.open(file_path, 'r:*') as tar:
-                        tar.extractall(path=decompressed_path)
-                    # print(f'Successfully decompressed {file_name}')
-                except Exception as e:
-                    print(f'Error decompressing {file_name}: {e}')
+                target_dir = os.path.join(decompressed_path, _archive_stem(file_name)) if per_archive_dir else decompressed_path
+                if _is_current(manifest.get(file_path), stat, target_dir, include, exclude):
+                    reports.append({'archive': file_path, 'output_dir': target_dir, 'status': 'skipped', 'seconds': 0.0})
+                else:
+                    tasks.append((file_path, stat, target_dir))
+
+    # the manifest is compacted to one record per archive before new records are appended
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        for record in manifest.values():
+            file.write(json.dumps(record) + '\n')
+    os.replace(tmp_path, manifest_path)
+
+    started = time.perf_counter()
+    with open(manifest_path, 'a') as manifest_file:
+        def record(stat, report):
+            reports.append(report)
+            if report['status'] == 'failed':
+                logger.warning('Error decompressing %s: %s', os.path.basename(report['archive']), report['error'])
+                return
+            manifest_file.write(json.dumps({
+                'archive': report['archive'], 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'output_dir': report['output_dir'], 'include': list(include) if include is not None else None,
+                'exclude': list(exclude) if exclude is not None else None, 'entries': report['entries'],
+                'members': report['members'], 'extracted_at': time.time(),
+            }) + '\n')
+            manifest_file.flush()
+
+        if workers == 1 or len(tasks) <= 1:
+            for file_path, stat, target_dir in tasks:
+                record(stat, _extract_archive(file_path, target_dir, include, exclude))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_extract_archive, file_path, target_dir, include, exclude): stat
+                           for file_path, stat, target_dir in tasks}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+
+    if report_path:
+        with open(report_path, 'w') as file:
+            for report in reports:
+                file.write(json.dumps(report) + '\n')
+    counts = {status: sum(report['status'] == status for report in reports) for status in ('extracted', 'skipped', 'failed')}
+    logger.info('Decompressed %d archives in %.1fs (%d skipped, %d failed)', counts['extracted'],
+                time.perf_counter() - started, counts['skipped'], counts['failed'])
+    return reports
+
 
 def copy_packages(dataset_dir_path: str, output_dir: str, min_size_kb: int, max_size_kb: int):
     """
@@ -88,38 +258,157 @@ def mv_packages(dataset_dir_path: str, output_dir: str, min_size_kb: int, max_si
                 except Exception as e:
                     print(f'Error moving {file_name}: {e}')
 
-def compress_and_move_folders(dataset_dir_path: str, output_dir: str, min_size_kb: int, max_size_kb: int):
+COMPRESS_MANIFEST_FILE = '.compress-manifest.json'
+
+
+def scan_folder_sizes(dataset_dir_path: str, names=None) -> dict:
+    """
+    Computes the size of every folder in dataset_dir_path in a single os.scandir pass.
+
+    Args:
+    dataset_dir_path (str): Path to the directory containing the folders.
+    names (iterable, optional): Only scan the folders with these names.
+
+    Returns:
+    dict: {folder name: (total bytes of its files, number of files)}. Symlinks are not followed.
+    """
+    sizes = {}
+    with os.scandir(dataset_dir_path) as entries:
+        folders = [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+    if names is not None:
+        names = set(names)
+        folders = [folder for folder in folders if folder.name in names]
+    for folder in folders:
+        total = count = 0
+        stack = [folder.path]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat(follow_symlinks=False).st_size
+                        count += 1
+        sizes[folder.name] = (total, count)
+    return sizes
+
+
+def _compress_folder(folder_path: str, tar_file_path: str, compresslevel: int):
+    started = time.perf_counter()
+    report = {'folder': folder_path, 'archive': tar_file_path, 'status': 'compressed', 'error': None}
+    # written next to the final archive under a temporary name, so there is no cross-device move
+    tmp_path = f'{tar_file_path}.{os.getpid()}.tmp'
+    try:
+        with tarfile.open(tmp_path, 'w:gz', compresslevel=compresslevel) as tar:
+            tar.add(folder_path, arcname=os.path.basename(folder_path))
+        os.replace(tmp_path, tar_file_path)
+        report['archive_bytes'] = os.path.getsize(tar_file_path)
+    except Exception as e:
+        report['status'] = 'failed'
+        report['error'] = f'{type(e).__name__}: {e}'
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    report['seconds'] = round(time.perf_counter() - started, 6)
+    return report
+
+
+def load_compress_manifest(output_dir: str) -> dict:
     """
-    Compresses folders found within the specified directory into tar.gz files and moves them
-    to an output directory, only if they are within the specified size range.
+    Reads the manifest written by compress_and_move_folders:
+    {archive file name: {"folder", "size_bytes", "files", "archive_bytes", "compresslevel", "seconds", "created_at"}}.
+    """
+    manifest_path = os.path.join(output_dir, COMPRESS_MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def _save_compress_manifest(output_dir: str, manifest: dict):
+    manifest_path = os.path.join(output_dir, COMPRESS_MANIFEST_FILE)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def compress_and_move_folders(dataset_dir_path: str, output_dir: str, min_size_kb: int, max_size_kb: int,
+                              compresslevel: int = 9, workers: int = None, sizes: dict = None):
+    """
+    Compresses folders found within the specified directory into tar.gz files in an output
+    directory, only if they are within the specified size range.
+
+    Folder sizes come from one scan_folder_sizes pass and the folders are compressed in parallel
+    across a process pool, each straight into output_dir. The size, file count, archive size and
+    timing of every archive are kept in <output_dir>/.compress-manifest.json for the later steps
+    (see load_compress_manifest); a folder whose archive exists and whose size and file count
+    match the manifest is not compressed again.
 
     Args:
     dataset_dir_path (str): Path to the directory containing the folders.
-    output_dir (str): Path to the directory where the compressed files will be moved.
+    output_dir (str): Path to the directory where the compressed files will be written.
     min_size_kb (int): Minimum size of the folders to be compressed, in kilobytes.
     max_size_kb (int): Maximum size of the folders to be compressed, in kilobytes.
+    compresslevel (int): gzip compression level, from 1 (fastest) to 9 (smallest).
+    workers (int, optional): Number of worker processes, os.cpu_count() by default. 1 compresses in this process.
+    sizes (dict, optional): Known {folder name: (bytes, files)} of the folders to consider, e.g. from the
+        dataset catalog, used instead of scanning dataset_dir_path.
+
+    Returns:
+    list: One report per folder in the size range, with status "compressed", "skipped" or "failed".
     """
     destination_path = os.path.abspath(output_dir)
     os.makedirs(destination_path, exist_ok=True)
+    manifest = load_compress_manifest(destination_path)
 
-    for folder_name in os.listdir(dataset_dir_path):
-        folder_path = os.path.join(dataset_dir_path, folder_name)
-        if os.path.isdir(folder_path):
-            folder_size_kb = sum(os.path.getsize(os.path.join(dirpath, filename)) 
-                                 for dirpath, _, filenames in os.walk(folder_path) 
-                                 for filename in filenames) // 1024  # Convert size from bytes to kilobytes
-
-            # Check if the folder size is within the specified range
-            if ((min_size_kb is None or folder_size_kb >= min_size_kb) and 
-                (max_size_kb is None or folder_size_kb <= max_size_kb)):
-                tar_file_path = os.path.join(dataset_dir_path, f"{folder_name}.tar.gz")
-                try:
-                    # Compress the folder
-                    with tarfile.open(tar_file_path, "w:gz") as tar:
-                        tar.add(folder_path, arcname=os.path.basename(folder_path))
-                    
-                    # Move the compressed file to the destination directory
-                    shutil.move(tar_file_path, destination_path)
-                    # print(f'Successfully compressed and moved {folder_name}')
-                except Exception as e:
-                    print(f'Error compressing and moving {folder_name}: {e}')
\ No newline at end of file
+    reports = []
+    tasks = {}
+    if sizes is None:
+        sizes = scan_folder_sizes(dataset_dir_path)
+    for folder_name, (folder_size, file_count) in sorted(sizes.items()):
+        folder_size_kb = folder_size // 1024  # Convert size from bytes to kilobytes
+
+        # Check if the folder size is within the specified range
+        if ((min_size_kb is None or folder_size_kb >= min_size_kb) and
+            (max_size_kb is None or folder_size_kb <= max_size_kb)):
+            archive_name = f"{folder_name}.tar.gz"
+            tar_file_path = os.path.join(destination_path, archive_name)
+            known = manifest.get(archive_name)
+            if (known and os.path.exists(tar_file_path) and known['size_bytes'] == folder_size
+                    and known['files'] == file_count and known['compresslevel'] == compresslevel):
+                reports.append({'folder': os.path.join(dataset_dir_path, folder_name), 'archive': tar_file_path,
+                                'status': 'skipped', 'seconds': 0.0})
+                continue
+            tasks[(os.path.join(dataset_dir_path, folder_name), tar_file_path)] = (archive_name, folder_size, file_count)
+
+    def record(report):
+        reports.append(report)
+        if report['status'] == 'failed':
+            logger.warning('Error compressing and moving %s: %s', os.path.basename(report['folder']), report['error'])
+            return
+        archive_name, folder_size, file_count = tasks[(report['folder'], report['archive'])]
+        manifest[archive_name] = {
+            'folder': os.path.abspath(report['folder']), 'size_bytes': folder_size, 'files': file_count,
+            'archive_bytes': report['archive_bytes'], 'compresslevel': compresslevel,
+            'seconds': report['seconds'], 'created_at': time.time(),
+        }
+
+    started = time.perf_counter()
+    try:
+        if workers == 1 or len(tasks) <= 1:
+            for folder_path, tar_file_path in tasks:
+                record(_compress_folder(folder_path, tar_file_path, compresslevel))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_compress_folder, folder_path, tar_file_path, compresslevel)
+                           for folder_path, tar_file_path in tasks]
+                for future in as_completed(futures):
+                    record(future.result())
+    finally:
+        # also saved when interrupted, so the archives finished so far are not compressed again
+        _save_compress_manifest(destination_path, manifest)
+
+    counts = {status: sum(report['status'] == status for report in reports) for status in ('compressed', 'skipped', 'failed')}
+    logger.info('Compressed %d folders in %.1fs (%d skipped, %d failed)', counts['compressed'],
+                time.perf_counter() - started, counts['skipped'], counts['failed'])
+    return reports
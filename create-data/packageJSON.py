@@ -1,43 +1,383 @@
+"""
+Mines the package.json of npm package archives into a columnar table.
+
+package.json is read straight from every .tgz/.tar.gz archive, in parallel, without
+decompressing the archive; npm pack writes it among the first members, so reading usually
+stops after a few of them. Every package becomes one row with all of its scripts, the
+scripts npm runs on install as separate columns, the JavaScript files its install scripts
+run with node, its bin, main, dependencies and devDependencies. The table is written as
+Parquet (.parquet) or Arrow IPC (.arrow, .feather), which needs pyarrow, or as JSON lines
+(.jsonl). Mining into an existing table only reads the archives that are new or changed
+since, and forgets the removed ones.
+
+Usage:
+    python packageJSON.py mine <archive_dir> <table.parquet> [--workers N] [--min-kb N] [--max-kb N]
+    python packageJSON.py query <table.parquet> [--scripts preinstall install postinstall] [--pattern node] [--csv nodeJSON.csv]
+"""
 import os
-import json
+import re
 import csv
+import sys
+import json
+import tarfile
+import argparse
+import posixpath
+from concurrent.futures import ProcessPoolExecutor
+from ExtractShortMal import NODE_SCRIPT_PATTERN, package_json_member
+from catalog import archive_stem
+
+# scripts npm runs when the package is installed, each also stored in a script_<name> column
+INSTALL_SCRIPTS = ('preinstall', 'install', 'postinstall', 'prepare')
+MAP_COLUMNS = ('scripts', 'bin', 'dependencies', 'dev_dependencies')
+COLUMNS = ('name', 'archive', 'archive_bytes', 'archive_mtime_ns', 'package_name', 'version', 'main', 'scripts',
+           *(f'script_{script}' for script in INSTALL_SCRIPTS), 'node_files', 'bin', 'dependencies',
+           'dev_dependencies', 'error')
+FORMATS = ('.parquet', '.arrow', '.feather', '.jsonl')
+# rows buffered before they are written as one Parquet row group or Arrow record batch
+BATCH_ROWS = 10000
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('Parquet and Arrow tables need pyarrow (pip install pyarrow); use a .jsonl table without it')
+    return pyarrow
+
+
+def _schema():
+    pa = _require_pyarrow()
+    string_map = pa.map_(pa.string(), pa.string())
+    types = {'archive_bytes': pa.int64(), 'archive_mtime_ns': pa.int64(), 'node_files': pa.list_(pa.string())}
+    types.update((column, string_map) for column in MAP_COLUMNS)
+    return pa.schema([(column, types.get(column, pa.string())) for column in COLUMNS])
+
+
+def _table_format(path: str) -> str:
+    extension = os.path.splitext(path)[1]
+    if extension not in FORMATS:
+        raise ValueError(f'Unsupported table format {extension}, expected one of {", ".join(FORMATS)}')
+    return extension
+
+
+def _string(value):
+    return value if isinstance(value, str) else None
+
+
+def _string_map(value) -> dict:
+    # package.json is not validated by the registry, so only the string entries of an object are kept
+    if not isinstance(value, dict):
+        return {}
+    return {str(key): item for key, item in value.items() if isinstance(item, str)}
+
+
+def read_package_json(file_path: str):
+    """
+    Reads package.json from an archive without extracting it.
+
+    Returns:
+    (object, str): The parsed package.json and its member name.
+    """
+    with tarfile.open(file_path, 'r:*') as tar:
+        candidates = {}
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = member.name[2:] if member.name.startswith('./') else member.name
+            if posixpath.basename(name) != 'package.json':
+                continue
+            # package/package.json always wins in package_json_member, so stop reading there
+            if name == 'package/package.json':
+                return json.load(tar.extractfile(member)), name
+            candidates[name] = member
+        name = package_json_member(candidates)
+        if name is None:
+            raise FileNotFoundError('no package.json in the archive')
+        return json.load(tar.extractfile(candidates[name])), name
+
+
+def mine_archive(file_path: str) -> dict:
+    """
+    Returns the row of one archive. An archive without a readable package.json gets a row
+    with only its name, archive and error.
+    """
+    stat = os.stat(file_path)
+    row = dict.fromkeys(COLUMNS)
+    row.update(name=archive_stem(os.path.basename(file_path)), archive=file_path, archive_bytes=stat.st_size,
+               archive_mtime_ns=stat.st_mtime_ns, node_files=[])
+    row.update((column, {}) for column in MAP_COLUMNS)
+    try:
+        package_json, _ = read_package_json(file_path)
+        if not isinstance(package_json, dict):
+            raise ValueError('package.json is not an object')
+        row['package_name'] = _string(package_json.get('name'))
+        row['version'] = _string(package_json.get('version'))
+        row['main'] = _string(package_json.get('main'))
+        scripts = row['scripts'] = _string_map(package_json.get('scripts'))
+        for script in INSTALL_SCRIPTS:
+            row[f'script_{script}'] = scripts.get(script)
+        # same selection as ExtractShortMal: the files that install scripts run with node
+        row['node_files'] = [posixpath.normpath(js_file) for script, command in scripts.items()
+                             if 'node' in command and 'install' in script
+                             for js_file in NODE_SCRIPT_PATTERN.findall(command)]
+        bin_field = package_json.get('bin')
+        row['bin'] = {row['package_name'] or row['name']: bin_field} if isinstance(bin_field, str) else _string_map(bin_field)
+        row['dependencies'] = _string_map(package_json.get('dependencies'))
+        row['dev_dependencies'] = _string_map(package_json.get('devDependencies'))
+    except Exception as e:
+        row['error'] = f'{type(e).__name__}: {e}'
+    return row
+
+
+class _TableWriter:
+    """
+    Writes rows to a temporary file next to the table, which replaces the table on close.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.format = _table_format(path)
+        self.tmp_path = f'{path}.{os.getpid()}.tmp'
+        if self.format == '.jsonl':
+            self.file = open(self.tmp_path, 'w', encoding='utf-8')
+            return
+        self.schema = _schema()
+        if self.format == '.parquet':
+            import pyarrow.parquet as pq
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema, compression='zstd')
+        else:
+            self.writer = _require_pyarrow().ipc.new_file(self.tmp_path, self.schema)
+
+    def write_rows(self, rows):
+        if not rows:
+            return
+        if self.format == '.jsonl':
+            self.file.writelines(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+            return
+        pa = _require_pyarrow()
+        rows = [{**row, **{column: list(row[column].items()) for column in MAP_COLUMNS}} for row in rows]
+        self.writer.write_table(pa.Table.from_pylist(rows, schema=self.schema))
+
+    def write_batch(self, batch):
+        # a record batch of a previous table, written without converting it to rows
+        self.writer.write_table(_require_pyarrow().Table.from_batches([batch], schema=self.schema))
+
+    def close(self, replace: bool = True):
+        (self.file if self.format == '.jsonl' else self.writer).close()
+        if replace:
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.remove(self.tmp_path)
+
+
+def _read_batches(path: str, columns=None):
+    # record batches of a Parquet or Arrow table, read one at a time
+    if _table_format(path) == '.parquet':
+        import pyarrow.parquet as pq
+        yield from pq.ParquetFile(path).iter_batches(columns=columns)
+    else:
+        reader = _require_pyarrow().ipc.open_file(path)
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            yield batch.select(columns) if columns else batch
+
+
+def _read_jsonl(path: str):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _previous_archives(path: str) -> dict:
+    """Returns {archive: (bytes, mtime_ns)} of the rows of an existing table."""
+    if not os.path.exists(path):
+        return {}
+    columns = ['archive', 'archive_bytes', 'archive_mtime_ns']
+    if _table_format(path) == '.jsonl':
+        return {row['archive']: (row['archive_bytes'], row['archive_mtime_ns']) for row in _read_jsonl(path)}
+    previous = {}
+    for batch in _read_batches(path, columns):
+        archives, sizes, mtimes = (batch.column(column).to_pylist() for column in columns)
+        previous.update(zip(archives, zip(sizes, mtimes)))
+    return previous
+
+
+def list_archives(archive_dir: str, min_size_kb: int = None, max_size_kb: int = None):
+    """Returns [(path, bytes, mtime_ns)] of the archives of archive_dir within the size range, sorted by path."""
+    archives = []
+    with os.scandir(archive_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith(('.tar.gz', '.tgz')):
+                continue
+            stat = entry.stat()
+            size_kb = stat.st_size // 1024
+            if (min_size_kb is None or size_kb >= min_size_kb) and (max_size_kb is None or size_kb <= max_size_kb):
+                archives.append((os.path.abspath(entry.path), stat.st_size, stat.st_mtime_ns))
+    archives.sort()
+    return archives
+
+
+def mine_archives(archive_dir: str, table_path: str, workers: int = None, min_size_kb: int = None,
+                  max_size_kb: int = None) -> dict:
+    """
+    Mines the package.json of the archives of a directory into a table.
+
+    If the table exists, the rows of archives with the same size and mtime are copied from it
+    and only the other archives are read. The table is replaced once all rows are written.
+
+    Args:
+    archive_dir (str): Directory of .tgz/.tar.gz archives.
+    table_path (str): Output table, .parquet, .arrow, .feather or .jsonl.
+    workers (int, optional): Number of worker processes, os.cpu_count() by default. 1 mines in this process.
+    min_size_kb (int, optional): Minimum size of the archives to mine, in kilobytes.
+    max_size_kb (int, optional): Maximum size of the archives to mine, in kilobytes.
+
+    Returns:
+    dict: The number of archives in the table, mined, reused from the previous table and failed.
+    """
+    _table_format(table_path)
+    archives = list_archives(archive_dir, min_size_kb, max_size_kb)
+    previous = _previous_archives(table_path)
+    reused = {path for path, size, mtime_ns in archives if previous.get(path) == (size, mtime_ns)}
+    to_mine = [path for path, _, _ in archives if path not in reused]
+    stats = {'archives': len(archives), 'mined': len(to_mine), 'reused': len(reused), 'failed': 0}
+
+    writer = _TableWriter(table_path)
+    executor = None
+    try:
+        if reused:
+            if writer.format == '.jsonl':
+                batch = []
+                for row in _read_jsonl(table_path):
+                    if row['archive'] in reused:
+                        batch.append(row)
+                    if len(batch) >= BATCH_ROWS:
+                        writer.write_rows(batch)
+                        batch = []
+                writer.write_rows(batch)
+            else:
+                import pyarrow.compute as pc
+                keep = _require_pyarrow().array(sorted(reused))
+                for batch in _read_batches(table_path):
+                    writer.write_batch(batch.filter(pc.is_in(batch.column('archive'), value_set=keep)))
+
+        if workers != 1 and len(to_mine) > 1:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, len(to_mine) // ((workers or os.cpu_count()) * 16))
+            rows = executor.map(mine_archive, to_mine, chunksize=chunksize)
+        else:
+            rows = map(mine_archive, to_mine)
+        batch = []
+        for row in rows:
+            stats['failed'] += row['error'] is not None
+            batch.append(row)
+            if len(batch) >= BATCH_ROWS:
+                writer.write_rows(batch)
+                batch = []
+        writer.write_rows(batch)
+    except BaseException:
+        writer.close(replace=False)
+        raise
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    writer.close()
+    return stats
+
+
+def _row_from_arrow(row: dict) -> dict:
+    # map columns come back from Arrow as lists of (key, value) pairs
+    for column in MAP_COLUMNS:
+        if column in row:
+            row[column] = dict(row[column] or [])
+    return row
+
+
+def query_scripts(table_path: str, scripts=INSTALL_SCRIPTS, pattern: str = None, columns=None):
+    """
+    Returns the rows of the packages that have one of the given scripts matching a regular
+    expression, or that have one of them at all if pattern is None.
+
+    On Parquet and Arrow tables the filter runs on the columns of the table with pyarrow
+    (pattern in RE2 syntax), and only the columns the filter and the result need are read.
+
+    Args:
+    table_path (str): Table written by mine_archives.
+    scripts (tuple): Script names, e.g. INSTALL_SCRIPTS.
+    pattern (str, optional): Regular expression searched in the scripts.
+    columns (list, optional): Columns of the returned rows, all by default.
+
+    Returns:
+    list: The matching rows as dicts, maps as dicts.
+    """
+    if _table_format(table_path) == '.jsonl':
+        regex = re.compile(pattern) if pattern is not None else None
+        matched = []
+        for row in _read_jsonl(table_path):
+            commands = [row['scripts'][script] for script in scripts if script in row['scripts']]
+            if commands and (regex is None or any(regex.search(command) for command in commands)):
+                matched.append({column: row[column] for column in columns} if columns else row)
+        return matched
+
+    pa = _require_pyarrow()
+    import pyarrow.compute as pc
+    needed = [f'script_{script}' for script in scripts if script in INSTALL_SCRIPTS]
+    if len(needed) < len(scripts):
+        needed.append('scripts')
+    needed = list(dict.fromkeys((columns or list(COLUMNS)) + needed))
+    matched = []
+    for batch in _read_batches(table_path, needed):
+        mask = pa.array([False] * batch.num_rows)
+        for script in scripts:
+            if script in INSTALL_SCRIPTS:
+                values = batch.column(f'script_{script}')
+            else:
+                values = pc.map_lookup(batch.column('scripts'), script, 'first')
+            found = pc.is_valid(values) if pattern is None else pc.match_substring_regex(values, pattern)
+            mask = pc.or_(mask, pc.fill_null(found, False))
+        rows = batch.filter(mask).select(columns or list(COLUMNS)).to_pylist()
+        matched.extend(_row_from_arrow(row) for row in rows)
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mine the package.json of npm package archives into a table.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    mine = commands.add_parser('mine', help='read package.json from every archive of a directory')
+    mine.add_argument('archive_dir')
+    mine.add_argument('table', help='output table (.parquet, .arrow, .feather or .jsonl)')
+    mine.add_argument('--workers', type=int, default=None)
+    mine.add_argument('--min-kb', type=int, default=None)
+    mine.add_argument('--max-kb', type=int, default=None)
+    query = commands.add_parser('query', help='list the packages whose scripts match a pattern')
+    query.add_argument('table')
+    query.add_argument('--scripts', nargs='+', default=list(INSTALL_SCRIPTS), help='script names to search')
+    query.add_argument('--pattern', default=None, help='regular expression searched in the scripts')
+    query.add_argument('--csv', default=None, help='write name and matching scripts to a CSV file instead of stdout')
+    args = parser.parse_args()
+
+    if args.command == 'mine':
+        stats = mine_archives(args.archive_dir, args.table, args.workers, args.min_kb, args.max_kb)
+        print(f"Mined {stats['mined']} archives ({stats['failed']} failed), reused {stats['reused']}, "
+              f"{stats['archives']} packages in {args.table}")
+        return
+
+    regex = re.compile(args.pattern) if args.pattern is not None else None
+    rows = query_scripts(args.table, tuple(args.scripts), args.pattern, columns=['name', 'scripts'])
+    output = open(args.csv, 'w', newline='', encoding='utf-8') if args.csv else sys.stdout
+    try:
+        writer = csv.writer(output)
+        writer.writerow(['Directory', 'Scripts'])
+        for row in rows:
+            matching = {script: command for script, command in row['scripts'].items()
+                        if script in args.scripts and (regex is None or regex.search(command))}
+            writer.writerow([row['name'], json.dumps(matching)])
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f'{len(rows)} packages matched', file=sys.stderr)
 
-# 定义存储数据的目录
-data_dir = '/home/wwy/Datasets/MalinBen/.decompressed-packages'
-node_output_file = '../nodeJSON.csv'
-
-# 准备存储提取数据的列表
-curl_data = []
-node_data = []
-other_data = []
-
-# 遍历data目录下的所有子目录
-for dirname in os.listdir(data_dir):
-    dirpath = os.path.join(data_dir, dirname)
-    if os.path.isdir(dirpath):
-        # 构建package.json的完整路径
-        package_json_path = os.path.join(dirpath,'package','package.json')
-        try:
-            # 读取package.json文件
-            with open(package_json_path, 'r') as file:
-                package_json = json.load(file)
-                scripts = package_json.get('scripts', {})
-                # 仅保留包含"install"的脚本
-                filtered_scripts = {key: value for key, value in scripts.items() if 'install' in key}
-
-                # 对脚本进行分类
-                for script, command in filtered_scripts.items():
-                    if 'node' in command:
-                        node_data.append([dirname, json.dumps({script: command})])
-
-        except Exception as e:
-            print(f'Error reading {package_json_path}: {e}')
-
-# 写入NodeJSON.csv
-with open(node_output_file, 'w', newline='', encoding='utf-8') as csvfile:
-    writer = csv.writer(csvfile)
-    writer.writerow(['Directory', 'Node Scripts'])  
-    writer.writerows(node_data)  # 写入数据
-
-print(f'ALL scripts have been written to {node_output_file}')
 
+if __name__ == '__main__':
+    main()
@@ -1,49 +1,249 @@
 import os
+import json
 import hashlib
+import argparse
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
-def get_file_hash(file_path):
-    """Compute the MD5 hash of the file."""
+CHUNK_SIZE = 1 << 20
+PARTIAL_SIZE = 64 * 1024  # bytes read from the head and the tail of a file for the partial hash
+
+
+def get_file_hash(file_path, chunk_size=CHUNK_SIZE):
+    """Compute the MD5 hash of the file, reading it in chunks."""
     hasher = hashlib.md5()
     with open(file_path, 'rb') as file:
-        buffer = file.read()
-        hasher.update(buffer)
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            hasher.update(chunk)
     return hasher.hexdigest()
 
-def remove_duplicate_files(directory):
-    """Remove duplicate files in the given directory."""
-    files_by_hash = defaultdict(list)
-    removed_count = 0
 
-    # Populate the dictionary with file hashes and their paths
+def get_partial_hash(file_path, size):
+    """Compute the MD5 hash of the first and last PARTIAL_SIZE bytes of the file."""
+    hasher = hashlib.md5()
+    with open(file_path, 'rb') as file:
+        hasher.update(file.read(PARTIAL_SIZE))
+        if size > 2 * PARTIAL_SIZE:
+            file.seek(-PARTIAL_SIZE, os.SEEK_END)
+        hasher.update(file.read(PARTIAL_SIZE))
+    return hasher.hexdigest()
+
+
+def get_semantic_hash(file_path):
+    """Compute the MD5 hash of a feature sequence file's tokens, independent of its formatting."""
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            tokens = json.load(file)
+    except (ValueError, UnicodeDecodeError):
+        # not a JSON file: only byte-identical copies are duplicates
+        return 'bytes:' + get_file_hash(file_path)
+    return hashlib.md5(json.dumps(tokens, separators=(',', ':'), ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def _hash_job(job):
+    kind, file_path, size = job
+    try:
+        if kind == 'partial':
+            return get_partial_hash(file_path, size)
+        if kind == 'full':
+            return get_file_hash(file_path)
+        return get_semantic_hash(file_path)
+    except OSError:
+        return None
+
+
+class HashIndex:
+    """
+    Persistent index of the hashes of every file, reused while the file's size and mtime are unchanged.
+
+    Stored as {path: {"size", "mtime_ns", "partial", "full", "semantic"}} in a JSON file.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.entries = {}
+        if index_path and os.path.exists(index_path):
+            with open(index_path, 'r') as file:
+                self.entries = json.load(file)
+
+    def get(self, file_path, size, mtime_ns, kind):
+        entry = self.entries.get(file_path)
+        if entry and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            return entry.get(kind)
+        return None
+
+    def put(self, file_path, size, mtime_ns, kind, digest):
+        entry = self.entries.get(file_path)
+        if not entry or entry['size'] != size or entry['mtime_ns'] != mtime_ns:
+            entry = self.entries[file_path] = {'size': size, 'mtime_ns': mtime_ns}
+        entry[kind] = digest
+
+    def save(self, live_paths):
+        if not self.index_path:
+            return
+        # forget files that were removed or are no longer under the directory
+        self.entries = {path: entry for path, entry in self.entries.items() if path in live_paths}
+        tmp_path = f'{self.index_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.index_path)
+
+
+def _scan(directory, skip):
+    """Return [(path, size, mtime_ns)] of every file under directory, sorted by path."""
+    found = []
     for root, _, files in os.walk(directory):
         for file in files:
-            file_path = os.path.join(root, file)
-            file_hash = get_file_hash(file_path)
-            files_by_hash[file_hash].append(file_path)
+            file_path = os.path.abspath(os.path.join(root, file))
+            if file_path in skip:
+                continue
+            stat = os.stat(file_path)
+            found.append((file_path, stat.st_size, stat.st_mtime_ns))
+    found.sort()
+    return found
+
+
+def _hash_files(files, kind, index, executor, workers, stats):
+    """Return {path: digest} for files, hashing only those missing from the index."""
+    digests = {}
+    jobs = []
+    for file_path, size, mtime_ns in files:
+        digest = index.get(file_path, size, mtime_ns, kind)
+        if digest is None:
+            jobs.append((kind, file_path, size))
+        else:
+            digests[file_path] = digest
+    stats[kind + '_cached'] += len(digests)
+    stats[kind + '_hashed'] += len(jobs)
+    if executor is not None and len(jobs) > 1:
+        chunksize = max(1, len(jobs) // ((workers or os.cpu_count()) * 8))
+        results = executor.map(_hash_job, jobs, chunksize=chunksize)
+    else:
+        results = map(_hash_job, jobs)
+    stat = {file_path: (size, mtime_ns) for file_path, size, mtime_ns in files}
+    for (_, file_path, _), digest in zip(jobs, results):
+        if digest is not None:
+            index.put(file_path, *stat[file_path], kind, digest)
+            digests[file_path] = digest
+    return digests
+
+
+def _regroup(groups, digests):
+    """Split every group by digest, keeping the subgroups that still have several files."""
+    result = []
+    for group in groups:
+        by_digest = defaultdict(list)
+        for entry in group:
+            if entry[0] in digests:
+                by_digest[digests[entry[0]]].append(entry)
+        result.extend(subgroup for subgroup in by_digest.values() if len(subgroup) > 1)
+    return result
+
+
+def find_duplicate_files(directory, semantic=False, workers=None, index_path=None):
+    """
+    Find groups of duplicate files in the given directory.
+
+    Byte mode narrows the candidates in stages: files are grouped by size, then by a hash of
+    their head and tail, and only files still sharing a group get a chunked full hash.
+    Semantic mode treats feature sequence files with the same tokens as duplicates whatever
+    their formatting, so every file gets a hash of its normalized token list. Hashes are
+    computed across a process pool and kept in a persistent index, so a rerun only hashes
+    new or changed files.
 
-    # Count the total number of files before deduplication
-    total_files_before = sum(len(file_paths) for file_paths in files_by_hash.values())
+    Args:
+    directory (str): Directory to deduplicate.
+    semantic (bool): Compare the JSON token content instead of the bytes.
+    workers (int, optional): Number of hashing processes, os.cpu_count() by default. 1 hashes in this process.
+    index_path (str, optional): Hash index file, <directory>.dedup-index.json by default. An empty string disables it.
 
-    # Remove duplicates
-    for file_paths in files_by_hash.values():
-        if len(file_paths) > 1:
+    Returns:
+    (list, dict): The duplicate groups, each a list of paths sorted so that the first one is kept,
+    and the number of files scanned, hashed and reused from the index at every stage.
+    """
+    directory = os.path.abspath(directory)
+    if index_path is None:
+        index_path = directory.rstrip(os.sep) + '.dedup-index.json'
+    index = HashIndex(index_path)
+    files = _scan(directory, {os.path.abspath(index_path)} if index_path else set())
+    stats = defaultdict(int, files=len(files))
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers != 1 else None
+    try:
+        if semantic:
+            groups = _regroup([files], _hash_files(files, 'semantic', index, executor, workers, stats))
+        else:
+            by_size = defaultdict(list)
+            for entry in files:
+                by_size[entry[1]].append(entry)
+            groups = [group for group in by_size.values() if len(group) > 1]
+            # every stage hashes all of its candidates in one parallel pass
+            candidates = [entry for group in groups for entry in group]
+            groups = _regroup(groups, _hash_files(candidates, 'partial', index, executor, workers, stats))
+            # files no larger than 2 * PARTIAL_SIZE were hashed whole by the partial hash
+            done = [group for group in groups if group[0][1] <= 2 * PARTIAL_SIZE]
+            groups = [group for group in groups if group[0][1] > 2 * PARTIAL_SIZE]
+            candidates = [entry for group in groups for entry in group]
+            groups = done + _regroup(groups, _hash_files(candidates, 'full', index, executor, workers, stats))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    index.save({file_path for file_path, _, _ in files})
+    duplicates = [[file_path for file_path, _, _ in group] for group in groups]
+    duplicates.sort()
+    return duplicates, dict(stats)
+
+
+def remove_duplicate_files(directory, semantic=False, dry_run=False, workers=None, index_path=None, report_path=None):
+    """Remove duplicate files in the given directory, keeping the first path of every group.
+
+    With dry_run nothing is removed and only the report is produced. report_path receives one
+    JSON line per duplicate group: {"kept", "duplicates", "bytes"}.
+    """
+    duplicates, stats = find_duplicate_files(directory, semantic, workers, index_path)
+    removed_count = 0
+    reclaimed_bytes = 0
+
+    report = open(report_path, 'w') if report_path else None
+    try:
+        for file_paths in duplicates:
+            group_bytes = sum(os.path.getsize(file_path) for file_path in file_paths[1:])
+            if report:
+                report.write(json.dumps({'kept': file_paths[0], 'duplicates': file_paths[1:], 'bytes': group_bytes}) + '\n')
             # Keep the first file and remove the rest
             for file_path in file_paths[1:]:
-                os.remove(file_path)
+                if not dry_run:
+                    os.remove(file_path)
+                    print(f"Removed duplicate file: {file_path}")
                 removed_count += 1
-                print(f"Removed duplicate file: {file_path}")
+            reclaimed_bytes += group_bytes
+    finally:
+        if report:
+            report.close()
 
-    # Count the total number of files after deduplication
+    total_files_before = stats['files']
     total_files_after = total_files_before - removed_count
+    hashed = {kind: (stats.get(kind + '_hashed', 0), stats.get(kind + '_cached', 0)) for kind in ('partial', 'full', 'semantic')}
 
     print(f"Total files before deduplication: {total_files_before}")
-    print(f"Total duplicates removed: {removed_count}")
+    print(f"Total duplicates {'found' if dry_run else 'removed'}: {removed_count} ({reclaimed_bytes / 1024 / 1024:.1f} MB)")
     print(f"Total files after deduplication: {total_files_after}")
+    print('Hashed (new/from index): ' + ', '.join(f'{kind} {new}/{cached}' for kind, (new, cached) in hashed.items() if new or cached))
+    return duplicates
+
 
 if __name__ == "__main__":
-    directory = "/home/wwy/SerMalDetector/datasets/MalinBenPac/features"
-    if os.path.isdir(directory):
-        remove_duplicate_files(directory)
+    parser = argparse.ArgumentParser(description='Remove duplicate files from a directory.')
+    parser.add_argument('directory', nargs='?', default="/home/wwy/SerMalDetector/datasets/MalinBenPac/features")
+    parser.add_argument('--semantic', action='store_true', help='compare feature sequences by their tokens instead of their bytes')
+    parser.add_argument('--dry-run', action='store_true', help='only report the duplicates')
+    parser.add_argument('--report', default=None, help='JSONL file listing every duplicate group')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--index', default=None, help='hash index file (default: <directory>.dedup-index.json)')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.directory):
+        remove_duplicate_files(args.directory, args.semantic, args.dry_run, args.workers, args.index, args.report)
     else:
         print("Invalid directory path.")
@@ -1,5 +1,6 @@
 import os
 import tarfile
+from catalog import Catalog
 # Path to the directory containing the malicious compressed packages
 data_dir = '/home/wwy/MalnpmDB/MalnpmDB/ben'
 exist_dir = '/home/wwy/datasets/MalinBenPac/longBenSrc'
@@ -10,18 +11,24 @@ output_dir = '/home/wwy/datasets/BenPac/longBenSrc'
 a_folder_path = '/home/wwy/MalnpmDB/MalnpmDB/ben'
 b_folder_path = '/home/wwy/datasets/BenPac/longBenSrc'
 c_folder_path = '/home/wwy/datasets/MalinBenPac/longBenSrc'
+catalog_path = '/home/wwy/datasets/catalog.sqlite'  # 数据集目录库（catalog.py）
 
+# 在目录库中登记a文件夹的压缩包和c文件夹的包（只处理新增的），之后用查询代替列目录
+catalog = Catalog(catalog_path)
+catalog.register_archives(a_folder_path, label='benign')
+catalog.register_folders(c_folder_path, label='benign')
 # 获取c文件夹中的现有文件夹名
-existing_dirs_in_c = {name for name in os.listdir(c_folder_path) if os.path.isdir(os.path.join(c_folder_path, name))}
+existing_dirs_in_c = {row['name'] for row in catalog.select(dataset=os.path.abspath(c_folder_path))}
 
 # 遍历a文件夹中的.tar.gz文件
-for filename in os.listdir(a_folder_path):
+for row in catalog.select(dataset=os.path.abspath(a_folder_path)):
+    filename = os.path.basename(row['archive'])
     if filename.endswith('.tar.gz'):
         tar_name = filename[:-7]  # 去掉.tar.gz后缀的文件夹名
 
         # 如果c文件夹中不存在该文件夹名，则进行解压
         if tar_name not in existing_dirs_in_c:
-            tar_path = os.path.join(a_folder_path, filename)
+            tar_path = row['archive']
             with tarfile.open(tar_path, 'r:gz') as tar:
                 tar.extractall(b_folder_path)
             print(f'Extracted {filename} to {b_folder_path}')
@@ -1,29 +1,23 @@
 import os
-import tarfile
 import sys
+import json
+import time
+import queue
+import logging
+import threading
 import traceback
+import subprocess
+from collections import Counter, deque
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "create-data"))
+from decompress import decompress_packages, scan_folder_sizes, SOURCE_MEMBERS
+from catalog import Catalog
+from extraction_cache import events_offset, read_events, summarize, format_summary
+from extraction_report import build_report, format_report, load_records
 
-def decompress_packages(dataset_dir_path: str):
-    # 定义目标解压路径
-    decompressed_path = os.path.abspath("data/.cache")
-    # 确保目标解压路径存在
-    os.makedirs(decompressed_path, exist_ok=True)
-
-    # 遍历dataset_dir_path下的所有文件
-    for file_name in os.listdir(dataset_dir_path):
-        # 检查文件是否为.tar.gz或.tgz压缩文件
-        if file_name.endswith(".tar.gz") or file_name.endswith(".tgz"):
-            # 定义完整的文件路径
-            file_path = os.path.join(dataset_dir_path, file_name)
-            try:
-                # 打开压缩文件
-                with tarfile.open(file_path, "r:*") as tar:
-                    # 解压
-                    tar.extractall(path=decompressed_path)
-                print(f"Successfully decompressed {file_name}")
-            except Exception as e:
-                print(f"Error decompressing {file_name}: {e}")
+FEATURE_EXTRACT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "feature-extract")
+# memory one extractor worker (node and its jelly process) is expected to need, in MB
+WORKER_MEMORY_MB = 4096
 
 
 def run_npm_start():
@@ -43,6 +37,186 @@ def run_npm_start():
         os.chdir("..")
 
 
+def available_memory_mb():
+    """Returns MemAvailable of /proc/meminfo in MB, or None where it cannot be read."""
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "?"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class ExtractorWorker:
+    """
+    A `node main.js -q` extractor process, analyzing the packages written to its stdin one at a time.
+
+    A reader thread puts (worker, result) on the results queue for every JSON result line, and
+    (worker, None) once the process has exited.
+    """
+
+    def __init__(self, arguments, results):
+        self.process = subprocess.Popen(
+            ["node", "main.js", "-q", *arguments],
+            cwd=os.path.join(FEATURE_EXTRACT_DIR, "dist"),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+        self.package = None
+        self.started = None
+        threading.Thread(target=self._read, args=(results,), daemon=True).start()
+
+    def _read(self, results):
+        for line in self.process.stdout:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(result, dict) and "status" in result:
+                results.put((self, result))
+        self.process.wait()
+        results.put((self, None))
+
+    def send(self, package):
+        self.package = package
+        self.started = time.monotonic()
+        self.process.stdin.write(package[0] + "\n")
+        self.process.stdin.flush()
+
+    def stop(self):
+        # the process exits once it has read the end of its input
+        self.package = None
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+
+
+def run_extraction_queue(packages, call_graph_dir_path, feature_pos_dir_path, sequential_feature_dir_path,
+                         max_workers=None, worker_memory_mb=WORKER_MEMORY_MB, progress_interval=10):
+    """
+    Extracts the features of packages with extractor processes fed from a shared queue.
+
+    The largest packages are handed out first, so the run does not end waiting on a large
+    package that started last, and every worker asks for the next package as soon as it is
+    done with one. The number of workers starts at what the available memory allows for
+    worker_memory_mb each, grows by one worker at a time while there is room for two more,
+    and shrinks when the available memory falls under half a worker. A worker that dies (e.g.
+    killed for memory) fails its package and is replaced. Progress and the ETA, estimated
+    from the bytes of the packages done, are printed every progress_interval seconds.
+
+    Args:
+    packages (list): (package path, size in bytes) of every package.
+    max_workers (int, optional): Upper bound of the number of workers, os.cpu_count() by default.
+    worker_memory_mb (int): Memory reserved for each worker, in MB.
+
+    Returns:
+    Counter: The number of packages per status ("extracted", "cached", "skipped", "empty", "failed").
+    """
+    max_workers = max_workers or os.cpu_count()
+    pending = deque(sorted(packages, key=lambda package: package[1], reverse=True))
+    total, total_bytes = len(pending), sum(size for _, size in pending)
+    arguments = (call_graph_dir_path, feature_pos_dir_path, sequential_feature_dir_path)
+    results = queue.Queue()
+    workers = set()
+    counts = Counter()
+    done_bytes = 0
+    start = last_progress = time.monotonic()
+
+    def report_progress():
+        done = sum(counts.values())
+        elapsed = time.monotonic() - start
+        eta = elapsed * (total_bytes - done_bytes) / done_bytes if done_bytes else None
+        print(f"[{done}/{total}] {100 * done_bytes / max(total_bytes, 1):.1f}% of bytes, "
+              f"{len(workers)} workers, {done / max(elapsed, 1e-9):.2f} packages/s, "
+              f"elapsed {_format_seconds(elapsed)}, ETA {_format_seconds(eta)}, {dict(counts)}", flush=True)
+
+    def start_worker():
+        worker = ExtractorWorker(arguments, results)
+        workers.add(worker)
+        worker.send(pending.popleft())
+
+    available = available_memory_mb()
+    initial = max_workers if available is None else max(1, min(max_workers, available // worker_memory_mb))
+    try:
+        while pending and len(workers) < initial:
+            start_worker()
+        while workers:
+            try:
+                worker, result = results.get(timeout=progress_interval)
+            except queue.Empty:
+                report_progress()
+                last_progress = time.monotonic()
+                continue
+            if worker not in workers:
+                continue
+            if result is None:
+                # the worker exited; a package it was analyzing counts as failed
+                workers.discard(worker)
+                if worker.package is not None:
+                    print(f"Extractor exited with code {worker.process.returncode} while analyzing {worker.package[0]}")
+                    counts["failed"] += 1
+                    done_bytes += worker.package[1]
+                available = available_memory_mb()
+                if pending and (not workers or available is None or available >= worker_memory_mb):
+                    start_worker()
+                continue
+
+            counts[result["status"]] += 1
+            done_bytes += worker.package[1]
+            available = available_memory_mb()
+            if not pending:
+                worker.stop()
+                workers.discard(worker)
+            elif available is not None and available < worker_memory_mb // 2 and len(workers) > 1:
+                # under memory pressure, retire this worker instead of giving it another package
+                worker.stop()
+                workers.discard(worker)
+            else:
+                worker.send(pending.popleft())
+                if pending and len(workers) < max_workers and (available is None or available >= 2 * worker_memory_mb):
+                    start_worker()
+            if time.monotonic() - last_progress >= progress_interval:
+                report_progress()
+                last_progress = time.monotonic()
+    finally:
+        for worker in workers:
+            worker.process.kill()
+    report_progress()
+    return counts
+
+
+def run_extractor(dataset_dir_path, call_graph_dir_path, feature_pos_dir_path, sequential_feature_dir_path,
+                  packages=None, max_workers=None, worker_memory_mb=WORKER_MEMORY_MB):
+    """
+    Builds the extractor and extracts the features of every package folder of dataset_dir_path
+    with run_extraction_queue. packages ((package path, size in bytes), e.g. from the dataset
+    catalog) replaces scanning dataset_dir_path for the folders and their size.
+    """
+    subprocess.run(["npm", "run", "compile"], cwd=FEATURE_EXTRACT_DIR, check=True)
+    if packages is None:
+        sizes = {name: size for name, (size, _) in scan_folder_sizes(dataset_dir_path).items()}
+        packages = []
+        with os.scandir(dataset_dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    packages.append((os.path.abspath(entry.path), sizes.get(entry.name, 0)))
+    return run_extraction_queue(packages, call_graph_dir_path, feature_pos_dir_path, sequential_feature_dir_path,
+                                max_workers, worker_memory_mb)
+
+
 if __name__ == "__main__":
     # dataset that needs to be decompressed
     dataset_dir_path = "data/datasets/test"
@@ -71,12 +245,82 @@ if __name__ == "__main__":
     # dir to store the cache
     cache_dir = "data/.cache"
     cache_dir = os.path.abspath(os.path.join(cache_dir, dataset_name))
+    # SQLite dataset catalog (create-data/catalog.py) recording which packages are extracted; None disables it
+    catalog_path = os.path.abspath("data/catalog.sqlite")
+    # label of the packages of the dataset in the catalog: "benign", "malicious", "augmented" or None
+    dataset_label = None
+    # 用共享队列把包分发给提取进程（大包优先，并发数随可用内存调整）；False时用npm start的固定worker切分
+    use_queue = True
+    max_workers = None  # 提取进程数的上限，默认为CPU核数
+    worker_memory_mb = WORKER_MEMORY_MB  # 每个提取进程预留的内存（MB）
+    # 每个提取进程常驻的jelly调用图进程数（处理若干个包后重启）；0时每个包单独启动jelly。
+    # jelly server的协议尚未在真实的@cs-au-dk/jelly上验证，默认关闭
+    call_graph_workers = 0
+    # 提取缓存目录：按包内容哈希和各阶段的提取器版本/配置缓存调用图、特征位置和特征序列，未变化的包直接从缓存恢复；None关闭缓存
+    extraction_cache_dir = os.path.abspath("data/.extraction-cache")
+
+    archives_dir_path = None
     # 如果命令行参数为--gz，则解压数据集到cache路径下
     if len(sys.argv) > 1 and sys.argv[1] == "--gz":
-        if not os.path.exists(cache_dir + dataset_name):
-            os.makedirs(cache_dir)
-        decompress_packages(dataset_dir_path, cache_dir)
+        archives_dir_path = dataset_dir_path
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+        # 并行解压，只保留package.json和js/ts源文件；每个压缩包解压到单独的目录，未变化的压缩包直接跳过
+        decompress_packages(
+            dataset_dir_path,
+            cache_dir,
+            include=SOURCE_MEMBERS,
+            per_archive_dir=True,
+            report_path=cache_dir + ".decompress-report.jsonl",
+        )
         dataset_dir_path = cache_dir
 
-    # 执行npm start
-    run_npm_start()
+    catalog = None
+    packages = None
+    if catalog_path:
+        # 在目录库中登记新增的包，并把已有特征文件的包标记为已提取
+        catalog = Catalog(catalog_path)
+        package_dataset = dataset_dir_path
+        # 启用提取缓存时重新扫描已登记的包，使包大小反映包的当前内容
+        catalog.register_folders(package_dataset, label=dataset_label, refresh=bool(extraction_cache_dir),
+                                 archives=archives_dir_path)
+        catalog.sync_features(package_dataset, sequential_feature_dir_path, call_graph_dir_path, feature_pos_dir_path)
+        # 只把未提取（或提取失败）的包按其真实路径交给提取器，不再逐个检查_rst.json；
+        # 启用提取缓存时交出所有包：已提取的包若内容变化会被重新计算，未变化的包直接从缓存恢复
+        pending = catalog.select(dataset=package_dataset, status=None if extraction_cache_dir else ("pending", "failed"))
+        packages = [(row["path"], row["size_bytes"] or 0) for row in pending if row["path"]]
+        print(f"{len(pending)} packages of {dataset_name} to extract")
+
+    # 每个包各阶段的耗时和资源遥测（JSONL），运行结束后由extraction_report.py汇总
+    timings_file_path = dataset_dir_path + ".timings.jsonl"
+    if os.path.exists(timings_file_path):
+        os.remove(timings_file_path)
+    os.environ.setdefault("STAGE_TIMINGS_FILE", timings_file_path)
+
+    if extraction_cache_dir:
+        os.environ["EXTRACTION_CACHE_DIR"] = extraction_cache_dir
+        cache_events_offset = events_offset(extraction_cache_dir)
+
+    if call_graph_workers:
+        # CALL_GRAPH_MEMORY_MB is left to the environment: by default every server gets the 14336 MB heap of the jelly command
+        os.environ["CALL_GRAPH_WORKERS"] = str(call_graph_workers)
+
+    if catalog is None or pending:
+        if use_queue:
+            run_extractor(dataset_dir_path, call_graph_dir_path, feature_pos_dir_path, sequential_feature_dir_path,
+                          packages=packages, max_workers=max_workers, worker_memory_mb=worker_memory_mb)
+        else:
+            # 执行npm start：分析整个数据集目录，已有_rst.json的包由提取器跳过
+            run_npm_start()
+
+    if os.path.exists(os.environ["STAGE_TIMINGS_FILE"]):
+        print(format_report(build_report(load_records([os.environ["STAGE_TIMINGS_FILE"]]), top=5)))
+    if extraction_cache_dir:
+        print(format_summary(summarize(read_events(extraction_cache_dir, cache_events_offset))))
+
+    if catalog:
+        # 记录各阶段耗时和提取结果
+        if os.path.exists(os.environ["STAGE_TIMINGS_FILE"]):
+            catalog.import_stage_timings(package_dataset, os.environ["STAGE_TIMINGS_FILE"])
+        extracted = catalog.sync_features(package_dataset, sequential_feature_dir_path, call_graph_dir_path, feature_pos_dir_path)
+        print(f"Extracted {extracted} packages of {dataset_name}")
+        catalog.close()
@@ -0,0 +1,176 @@
+"""
+Reader of the extraction cache of feature-extract (src/cache/ExtractionCache.ts).
+
+With EXTRACTION_CACHE_DIR set, the extractor caches the call graph, feature positions and
+feature sequence of every package, keyed by the package content hash and the configuration
+hash of each stage (its version, options and rule data), and appends the hits and misses of
+every analyzed package to events.jsonl. This module summarizes those events and computes the
+same keys to tell which stages of a package are cached, without running the extractor.
+
+Usage:
+    python extraction_cache.py <cache_dir> stats [--since OFFSET]
+    python extraction_cache.py <cache_dir> lookup <package_dir>...
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+from collections import Counter
+
+STAGES = ("callGraph", "featureExtraction", "serialization")
+# the object whose presence marks a stage as cached
+STAGE_OBJECTS = {"callGraph": "meta.json", "featureExtraction": "fp.json", "serialization": "rst.json"}
+
+
+def _sha1(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def package_content_hash(package_path):
+    """
+    Hashes the content of a package the way the extractor does: the sorted relative paths of its
+    regular files and the sha1 of each file. Symbolic links inside the package are ignored.
+    """
+    files = []
+
+    def walk(dir_path, relative_dir_path):
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                relative_path = f"{relative_dir_path}/{entry.name}" if relative_dir_path else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    walk(entry.path, relative_path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(relative_path)
+
+    walk(package_path, "")
+    files.sort()
+    digest = hashlib.sha1()
+    for relative_path in files:
+        digest.update(relative_path.encode("utf-8") + b"\0")
+        with open(os.path.join(package_path, relative_path), "rb") as file:
+            digest.update(_sha1(file.read()).encode("ascii"))
+    return digest.hexdigest()
+
+
+def load_stage_hashes(cache_dir):
+    """Returns the stage configuration hashes the extractor last wrote to versions.json, or None."""
+    try:
+        with open(os.path.join(cache_dir, "versions.json"), "r") as file:
+            return json.load(file)["stages"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def stage_keys(package_path, stage_hashes):
+    """Returns (content hash, {stage: key}) of a package, each key chaining the key of the stage before it."""
+    content_hash = package_content_hash(package_path)
+    keys = {}
+    previous_key = content_hash
+    for stage in STAGES:
+        previous_key = keys[stage] = _sha1(f"{stage}:{stage_hashes[stage]}:{previous_key}".encode("utf-8"))
+    return content_hash, keys
+
+
+def lookup(cache_dir, package_path):
+    """
+    Tells which stages of a package are cached for the current extractor configuration.
+
+    Returns:
+    dict: {stage: bool}, all False if the extractor has not used the cache yet.
+    """
+    stage_hashes = load_stage_hashes(cache_dir)
+    if stage_hashes is None:
+        return {stage: False for stage in STAGES}
+    _, keys = stage_keys(package_path, stage_hashes)
+    cached = {stage: os.path.exists(os.path.join(cache_dir, "objects", key[:2], f"{key}.{STAGE_OBJECTS[stage]}"))
+              for stage, key in keys.items()}
+    if cached["callGraph"]:
+        # the extractor generates the call graph again if the cached run failed
+        key = keys["callGraph"]
+        try:
+            with open(os.path.join(cache_dir, "objects", key[:2], f"{key}.meta.json"), "r") as file:
+                cached["callGraph"] = json.load(file).get("ifCallGraphGenerated") == 1
+        except (OSError, ValueError):
+            cached["callGraph"] = False
+    return cached
+
+
+def events_offset(cache_dir):
+    """Returns the current size of events.jsonl, to read only the events of a later run with read_events."""
+    try:
+        return os.path.getsize(os.path.join(cache_dir, "events.jsonl"))
+    except OSError:
+        return 0
+
+
+def read_events(cache_dir, offset=0):
+    """Returns the events recorded in events.jsonl from byte offset on."""
+    events = []
+    try:
+        with open(os.path.join(cache_dir, "events.jsonl"), "rb") as file:
+            file.seek(offset)
+            for line in file:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # a line still being written by an extractor
+                    continue
+    except OSError:
+        pass
+    return events
+
+
+def summarize(events):
+    """
+    Counts the hits and misses of every stage.
+
+    Returns:
+    dict: {"packages", "fully_cached", "failed", stage: {"hit", "miss"} for every stage}.
+    """
+    summary = {"packages": len(events), "fully_cached": 0, "failed": 0}
+    for stage in STAGES:
+        summary[stage] = Counter()
+    for event in events:
+        for stage in STAGES:
+            if stage in event:
+                summary[stage][event[stage]] += 1
+        if event.get("failedStage"):
+            summary["failed"] += 1
+        elif all(event.get(stage) == "hit" for stage in STAGES):
+            summary["fully_cached"] += 1
+    for stage in STAGES:
+        summary[stage] = {"hit": summary[stage]["hit"], "miss": summary[stage]["miss"]}
+    return summary
+
+
+def format_summary(summary):
+    stages = ", ".join(f"{stage} {summary[stage]['hit']} hit/{summary[stage]['miss']} miss" for stage in STAGES)
+    return (f"Extraction cache: {summary['packages']} packages, {summary['fully_cached']} fully cached, "
+            f"{summary['failed']} failed; {stages}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the extraction cache of feature-extract.")
+    parser.add_argument("cache_dir")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    stats = subparsers.add_parser("stats", help="summarize the recorded cache hits and misses")
+    stats.add_argument("--since", type=int, default=0, help="byte offset of events.jsonl to start from")
+    stats.add_argument("--json", action="store_true", help="print the summary as JSON")
+    lookup_parser = subparsers.add_parser("lookup", help="tell which stages of packages are cached")
+    lookup_parser.add_argument("packages", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        summary = summarize(read_events(args.cache_dir, args.since))
+        print(json.dumps(summary) if args.json else format_summary(summary))
+    else:
+        if load_stage_hashes(args.cache_dir) is None:
+            sys.exit(f"{args.cache_dir} has no versions.json: the extractor has not used this cache yet")
+        for package_path in args.packages:
+            cached = lookup(args.cache_dir, package_path)
+            print(f"{package_path}: " + ", ".join(f"{stage} {'hit' if hit else 'miss'}" for stage, hit in cached.items()))
+
+
+if __name__ == "__main__":
+    main()
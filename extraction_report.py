@@ -0,0 +1,183 @@
+"""
+Report over the extraction telemetry written by feature-extract to STAGE_TIMINGS_FILE.
+
+Every analyzed package appends one JSON line with the wall time of each stage at the top level
+(callGraphMs, featureExtractionMs, serializationMs, totalMs, failedStage if a stage failed),
+the end time, the package file count and size, and under "stages" the peak RSS, cache result
+and sizes of each stage (call graph files/functions/edges and whether jelly hit its time limit,
+analyzed JavaScript files, AST nodes and string literals, features, sequence length).
+
+The report gives the p50/p95/p99 wall time and peak RSS of every stage, the slowest packages,
+the failures and jelly time limits, the string literals screened before the rule patterns, and the
+throughput over time, to size the hardware of extraction runs and to compare runs for regressions.
+
+Usage:
+    python extraction_report.py <timings.jsonl>... [--top 10] [--sort totalMs] [--bucket 60] [--json]
+"""
+import json
+import math
+import argparse
+from collections import Counter
+
+STAGES = ("callGraph", "featureExtraction", "serialization")
+
+
+def load_records(paths):
+    """Reads the telemetry records of the given JSONL files, skipping unreadable lines."""
+    records = []
+    for path in paths:
+        with open(path, "r") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+
+def percentile(values, q):
+    """The q-th percentile of values with linear interpolation, as numpy.percentile computes it."""
+    values = sorted(values)
+    if not values:
+        return None
+    position = (len(values) - 1) * q / 100
+    lower, upper = math.floor(position), math.ceil(position)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _distribution(values):
+    if not values:
+        return None
+    return {"count": len(values), "mean": sum(values) / len(values), "p50": percentile(values, 50),
+            "p95": percentile(values, 95), "p99": percentile(values, 99), "max": max(values)}
+
+
+def stage_summary(records):
+    """
+    Returns {stage: {"wall_ms": distribution, "peak_rss_mb": distribution, "cache": {result: count}}}
+    for every stage and "total", a distribution being {"count", "mean", "p50", "p95", "p99", "max"}.
+    """
+    summary = {}
+    for stage in STAGES + ("total",):
+        wall = [record[stage + "Ms"] for record in records if isinstance(record.get(stage + "Ms"), (int, float))]
+        stage_records = [record.get("stages", {}).get(stage, {}) for record in records]
+        rss = [details["peakRssBytes"] / 1024 / 1024 for details in stage_records if details.get("peakRssBytes")]
+        cache = Counter(details["cache"] for details in stage_records if details.get("cache"))
+        summary[stage] = {"wall_ms": _distribution(wall), "peak_rss_mb": _distribution(rss), "cache": dict(cache)}
+    return summary
+
+
+def slowest_packages(records, top=10, key="totalMs"):
+    """Returns the top records with the largest key (a stage wall time such as "callGraphMs")."""
+    timed = [record for record in records if isinstance(record.get(key), (int, float))]
+    return sorted(timed, key=lambda record: record[key], reverse=True)[:top]
+
+
+def throughput(records, bucket_seconds=60):
+    """
+    Buckets the records by their end time.
+
+    Returns:
+    list: {"start_s" (from the first record), "packages", "failed", "packages_per_second", "mb_per_second"}
+    for every bucket, empty if the records have no end time. The rates of the last bucket are taken
+    over the part of it the run lasted.
+    """
+    timed = sorted((record for record in records if "time" in record), key=lambda record: record["time"])
+    if not timed:
+        return []
+    first = timed[0]["time"]
+    span_seconds = (timed[-1]["time"] - first) / 1000
+    buckets = {}
+    for record in timed:
+        index = int((record["time"] - first) / 1000 // bucket_seconds)
+        bucket = buckets.setdefault(index, {"packages": 0, "failed": 0, "bytes": 0})
+        bucket["packages"] += 1
+        bucket["failed"] += bool(record.get("failedStage"))
+        bucket["bytes"] += record.get("packageBytes") or 0
+    result = []
+    for index, bucket in sorted(buckets.items()):
+        seconds = max(min(bucket_seconds, span_seconds - index * bucket_seconds), 1e-3)
+        result.append({"start_s": index * bucket_seconds, "packages": bucket["packages"], "failed": bucket["failed"],
+                       "packages_per_second": bucket["packages"] / seconds,
+                       "mb_per_second": bucket["bytes"] / 1024 / 1024 / seconds})
+    return result
+
+
+def build_report(records, top=10, sort_key="totalMs", bucket_seconds=60):
+    """Returns the whole report as a JSON-serializable dict."""
+    call_graphs = [record.get("stages", {}).get("callGraph", {}) for record in records]
+    feature_stages = [record.get("stages", {}).get("featureExtraction", {}) for record in records]
+    timed = [record["time"] for record in records if "time" in record]
+    return {
+        "packages": len(records),
+        "failed": dict(Counter(record["failedStage"] for record in records if record.get("failedStage"))),
+        "time_limit_reached": sum(bool(details.get("timeLimitReached")) for details in call_graphs),
+        "job_timed_out": sum(bool(details.get("jobTimedOut")) for details in call_graphs),
+        "call_graph_not_generated": sum(details.get("generated") is False for details in call_graphs),
+        "span_seconds": (max(timed) - min(timed)) / 1000 if timed else None,
+        "string_literals": {"matched": sum(details.get("stringLiterals", 0) for details in feature_stages),
+                            "screened": sum(details.get("screenedLiterals", 0) for details in feature_stages)},
+        "stages": stage_summary(records),
+        "slowest": [{"package": record["package"], sort_key: record[sort_key], "failedStage": record.get("failedStage"),
+                     "packageBytes": record.get("packageBytes"), "stages": record.get("stages")}
+                    for record in slowest_packages(records, top, sort_key)],
+        "throughput": throughput(records, bucket_seconds),
+    }
+
+
+def _format_distribution(distribution, unit):
+    if distribution is None:
+        return "-"
+    return (f"p50 {distribution['p50']:.1f}{unit}  p95 {distribution['p95']:.1f}{unit}  "
+            f"p99 {distribution['p99']:.1f}{unit}  max {distribution['max']:.1f}{unit}")
+
+
+def format_report(report, sort_key="totalMs"):
+    lines = [f"{report['packages']} packages, failed {report['failed'] or 0}, "
+             f"jelly time limit reached {report['time_limit_reached']}, "
+             f"call graph job timeout {report['job_timed_out']}, "
+             f"no call graph {report['call_graph_not_generated']}"]
+    literals = report["string_literals"]
+    if literals["matched"]:
+        lines.append(f"{literals['matched']} string literals, {literals['screened']} "
+                     f"({literals['screened'] / literals['matched']:.1%}) screened before the rule patterns")
+    for stage, summary in report["stages"].items():
+        cache = f"  cache {summary['cache']}" if summary["cache"] else ""
+        lines.append(f"{stage:<18} wall  {_format_distribution(summary['wall_ms'], 'ms')}{cache}")
+        if summary["peak_rss_mb"]:
+            lines.append(f"{'':<18} rss   {_format_distribution(summary['peak_rss_mb'], 'MB')}")
+    if report["slowest"]:
+        lines.append(f"Slowest packages by {sort_key}:")
+        for record in report["slowest"]:
+            call_graph = (record["stages"] or {}).get("callGraph", {})
+            details = [f"{record['packageBytes'] / 1024:.0f} KB" if record["packageBytes"] else None,
+                       f"{call_graph['functions']} functions" if "functions" in call_graph else None,
+                       "time limit" if call_graph.get("timeLimitReached") else None,
+                       "job timeout" if call_graph.get("jobTimedOut") else None,
+                       f"failed in {record['failedStage']}" if record["failedStage"] else None]
+            lines.append(f"  {record[sort_key]:>10.0f}ms  {record['package']}  "
+                         + ", ".join(detail for detail in details if detail))
+    if report["throughput"]:
+        lines.append(f"Throughput over {report['span_seconds']:.0f}s:")
+        for bucket in report["throughput"]:
+            lines.append(f"  +{bucket['start_s']:>6g}s  {bucket['packages']:>5} packages  "
+                         f"{bucket['packages_per_second']:.2f} packages/s  {bucket['mb_per_second']:.2f} MB/s"
+                         + (f"  {bucket['failed']} failed" if bucket["failed"] else ""))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the extraction telemetry (STAGE_TIMINGS_FILE).")
+    parser.add_argument("paths", nargs="+", help="telemetry JSONL files")
+    parser.add_argument("--top", type=int, default=10, help="number of slowest packages to list")
+    parser.add_argument("--sort", default="totalMs", help="wall time field to rank the packages by, e.g. callGraphMs")
+    parser.add_argument("--bucket", type=float, default=60, help="seconds per throughput bucket")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = build_report(load_records(args.paths), args.top, args.sort, args.bucket)
+    print(json.dumps(report, indent=2) if args.json else format_report(report, args.sort))
+
+
+if __name__ == "__main__":
+    main()
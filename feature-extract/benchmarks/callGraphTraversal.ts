@@ -0,0 +1,150 @@
+/**
+ * Golden-output check and benchmark of the call-graph traversal of the feature serialization:
+ * the former dfsTraversal, which scanned the whole fun2fun edge list at every visited node and
+ * copied the path for every callee, against traverseCallGraph on its adjacency index.
+ *
+ * Every run first checks that both produce identical sequences at depth limits 1 to 5 on a small
+ * synthetic graph, then times both on synthetic jelly call graphs of the given sizes (the former
+ * traversal only up to LEGACY_MAX_FUNCTIONS, above which it takes minutes) and on the given jelly
+ * call graph files, checking the sequences again wherever both run.
+ *
+ * Usage:
+ *     npx ts-node benchmarks/callGraphTraversal.ts [functions...] [--file call-graph.json ...] [--depth 3]
+ *
+ * The default sizes are 1000, 5000, 20000 and 50000 functions with 3 calls per function.
+ */
+import fs from 'fs'
+import { traverseCallGraph, type CallQueueMap, type JellyCallGraph } from '../src/feature-serialize/CallGraphTraversal'
+
+const FILES = 40
+const CALLS_PER_FUNCTION = 3
+const LEGACY_MAX_FUNCTIONS = 5000
+
+// deterministic pseudo-random numbers (mulberry32)
+function random(seed: number) {
+  return () => {
+    seed = (seed + 0x6d2b79f5) | 0
+    let t = Math.imul(seed ^ (seed >>> 15), 1 | seed)
+    t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296
+  }
+}
+
+/**
+ * A jelly-like call graph with cycles, self calls and duplicate edges. With 40 files, file
+ * indexes such as 1 and 10-19 share prefixes, as the entry lookup by startsWith matches them
+ */
+function syntheticCallGraph(functions: number, rand: () => number): JellyCallGraph {
+  const files = Array.from({ length: FILES }, (_, index) => `lib/file${index}.js`)
+  const locations: { [funcNum: string]: string } = {}
+  for (let func = 0; func < functions; func++) {
+    const line = 1 + func * 4
+    locations[String(func)] = `${Math.floor(rand() * FILES)}:${line}:1:${line + 3}:2`
+  }
+  const fun2fun: [number, number][] = []
+  for (let caller = 0; caller < functions; caller++) {
+    const calls = Math.floor(rand() * (2 * CALLS_PER_FUNCTION + 1))
+    for (let i = 0; i < calls; i++) {
+      // mostly nearby functions, as in a module, sometimes anywhere
+      const callee = rand() < 0.8 ? Math.min(functions - 1, Math.max(0, caller + Math.floor(rand() * 21) - 10)) : Math.floor(rand() * functions)
+      fun2fun.push([caller, callee])
+    }
+  }
+  const entries = files.filter(() => rand() < 0.5).concat(['lib/not-in-files.js'])
+  return { files, functions: locations, fun2fun, entries }
+}
+
+// the traversal initiateTraversal did before traverseCallGraph, with the depth limit as a parameter
+function legacyTraversal(callGraph: JellyCallGraph, depthLimit: number): CallQueueMap {
+  const callQueueMap: CallQueueMap = {}
+  function dfsTraversal(nodeIndex: number, CallGraphFun2Fun: [number, number][], currentPath: number[], fileName: string): void {
+    if (currentPath.length > depthLimit || (currentPath.includes(nodeIndex) && currentPath.length - currentPath.indexOf(nodeIndex) > 3)) {
+      return
+    }
+    callQueueMap[fileName] ||= []
+    currentPath.push(nodeIndex)
+    callQueueMap[fileName].push(nodeIndex.toString())
+    CallGraphFun2Fun.forEach(([caller, callee]) => {
+      if (caller === nodeIndex) {
+        dfsTraversal(callee, CallGraphFun2Fun, [...currentPath], fileName)
+      }
+    })
+    currentPath.pop()
+  }
+  const { files: CallGraphFiles = [], functions: CallGraphFunctions = {}, fun2fun: CallGraphFun2Fun = [], entries: CallGraphEntries = [] } = callGraph
+  CallGraphEntries.forEach(entry => {
+    const startNodeIndex = CallGraphFiles.indexOf(entry)
+    if (startNodeIndex !== -1) {
+      Object.keys(CallGraphFunctions).reverse().forEach(func => {
+        if (CallGraphFunctions[func].startsWith(startNodeIndex.toString())) {
+          dfsTraversal(parseInt(func), CallGraphFun2Fun, [], entry)
+        }
+      })
+    }
+  })
+  return callQueueMap
+}
+
+function timed<T>(fn: () => T): [T, number] {
+  const start = process.hrtime()
+  const result = fn()
+  const [seconds, nanoseconds] = process.hrtime(start)
+  return [result, seconds * 1000 + nanoseconds / 1000000]
+}
+
+function sequenceLength(callQueueMap: CallQueueMap) {
+  return Object.values(callQueueMap).reduce((total, sequence) => total + sequence.length, 0)
+}
+
+function compare(name: string, callGraph: JellyCallGraph, depthLimit: number) {
+  const runLegacy = Object.keys(callGraph.functions || {}).length <= LEGACY_MAX_FUNCTIONS
+  const [actual, indexedMs] = timed(() => traverseCallGraph(callGraph, depthLimit))
+  const result: { [key: string]: unknown } = {
+    graph: name,
+    functions: Object.keys(callGraph.functions || {}).length,
+    edges: (callGraph.fun2fun || []).length,
+    depthLimit,
+    sequenceLength: sequenceLength(actual),
+    indexedMs
+  }
+  if (runLegacy) {
+    const [expected, legacyMs] = timed(() => legacyTraversal(callGraph, depthLimit))
+    result.legacyMs = legacyMs
+    result.speedup = legacyMs / indexedMs
+    result.identical = JSON.stringify(actual) === JSON.stringify(expected)
+    if (!result.identical) {
+      process.exitCode = 1
+    }
+  }
+  console.log(JSON.stringify(result))
+}
+
+const args = process.argv.slice(2)
+const files: string[] = []
+const sizes: number[] = []
+let depthLimit = 3
+for (let i = 0; i < args.length; i++) {
+  if (args[i] === '--file') {
+    files.push(args[++i])
+  } else if (args[i] === '--depth') {
+    depthLimit = Number(args[++i])
+  } else {
+    sizes.push(Number(args[i]))
+  }
+}
+
+// golden output at every depth limit, including those where the cycle check cuts paths
+const golden = syntheticCallGraph(300, random(1))
+for (let depth = 1; depth <= 5; depth++) {
+  const identical = JSON.stringify(traverseCallGraph(golden, depth)) === JSON.stringify(legacyTraversal(golden, depth))
+  console.log(JSON.stringify({ golden: 'synthetic-300', depthLimit: depth, identical }))
+  if (!identical) {
+    process.exitCode = 1
+  }
+}
+for (const functions of sizes.length > 0 || files.length > 0 ? sizes : [1000, 5000, 20000, 50000]) {
+  compare(`synthetic-${functions}`, syntheticCallGraph(functions, random(functions)), depthLimit)
+}
+for (const file of files) {
+  compare(file, JSON.parse(fs.readFileSync(file, 'utf8')), depthLimit)
+}
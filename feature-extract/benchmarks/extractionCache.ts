@@ -0,0 +1,116 @@
+/**
+ * Check and benchmark of the call graph stage of the extraction cache, on synthetic packages in a
+ * temporary cache directory.
+ *
+ * The check stores the call graph of runs that failed, hit the jelly time limit or the job
+ * timeout of the call graph worker pool, or exited abnormally, as well as the result -1 an
+ * earlier cache stored, and checks that none of them is restored, so the next run generates the
+ * call graph again. A successful run must be restored
+ * with its call graph pointed at the package. The benchmark then times the content hash and the
+ * call graph restore of packages with the given numbers of files.
+ *
+ * Usage:
+ *     npx ts-node benchmarks/extractionCache.ts [files...]
+ *
+ * The default sizes are 10, 100 and 1000 files of 4 KB each.
+ */
+import fs from 'fs'
+import os from 'os'
+import path from 'path'
+import { ExtractionCache } from '../src/cache/ExtractionCache'
+import { type CallGraphRunStats } from '../src/call-graph/generateCallGraph'
+
+const FILE_BYTES = 4096
+const RESTORES = 20
+
+function milliseconds(start: [number, number]) {
+  const [seconds, nanoseconds] = process.hrtime(start)
+  return seconds * 1000 + nanoseconds / 1000000
+}
+
+function syntheticPackage(packagePath: string, files: number) {
+  fs.mkdirSync(path.join(packagePath, 'lib'), { recursive: true })
+  fs.writeFileSync(path.join(packagePath, 'package.json'), JSON.stringify({ name: path.basename(packagePath), version: '1.0.0' }))
+  for (let file = 0; file < files; file++) {
+    fs.writeFileSync(path.join(packagePath, 'lib', `file${file}.js`), `function f${file}() { return ${file} }\n`.padEnd(FILE_BYTES, '/'))
+  }
+}
+
+// a jelly call graph with absolute paths into the package, as jelly -j writes it
+function callGraphOf(packagePath: string) {
+  return JSON.stringify({ entries: [path.join(packagePath, 'lib/file0.js')], files: [path.join(packagePath, 'lib/file0.js')], functions: { 0: '0:1:1:1:30' }, fun2fun: [] })
+}
+
+async function check(workDir: string) {
+  const cache = new ExtractionCache(path.join(workDir, 'check-cache'))
+  const packagePath = path.join(workDir, 'check-package')
+  const callGraphFilePath = path.join(workDir, 'check_cg.json')
+  syntheticPackage(packagePath, 3)
+
+  const runs: Array<[string, number, CallGraphRunStats, number | null]> = [
+    ['failed', -1, { exitCode: 1 }, null],
+    ['timeLimitReached', -1, { timeLimitReached: true, exitCode: 0 }, null],
+    ['jobTimedOut', -1, { pooled: true, jobTimedOut: true, exitCode: null }, null],
+    ['abnormalExit', 1, { exitCode: 137 }, null],
+    ['generated', 1, { exitCode: 0 }, 1]
+  ]
+  let failures = 0
+  for (const [name, ifCallGraphGenerated, runStats, expected] of runs) {
+    // every run stands for a different package content, so each has keys of its own
+    fs.writeFileSync(path.join(packagePath, 'run.txt'), name)
+    const { keys } = await cache.getKeys(packagePath)
+    fs.writeFileSync(callGraphFilePath, callGraphOf(packagePath))
+    await cache.storeCallGraph(keys.callGraph, callGraphFilePath, packagePath, ifCallGraphGenerated, runStats)
+    fs.rmSync(callGraphFilePath)
+    const restored = await cache.restoreCallGraph(keys.callGraph, callGraphFilePath, packagePath)
+    const ok = restored === expected && (expected === null || fs.readFileSync(callGraphFilePath, 'utf8') === callGraphOf(packagePath))
+    console.log(JSON.stringify({ check: name, restored, ok }))
+    failures += ok ? 0 : 1
+  }
+
+  // the meta an earlier cache stored for a failed run
+  fs.writeFileSync(path.join(packagePath, 'run.txt'), 'storedFailure')
+  const { keys } = await cache.getKeys(packagePath)
+  const metaPath = path.join(cache.cacheDirPath, 'objects', keys.callGraph.slice(0, 2), `${keys.callGraph}.meta.json`)
+  fs.mkdirSync(path.dirname(metaPath), { recursive: true })
+  fs.writeFileSync(metaPath, JSON.stringify({ ifCallGraphGenerated: -1 }))
+  const restored = await cache.restoreCallGraph(keys.callGraph, callGraphFilePath, packagePath)
+  console.log(JSON.stringify({ check: 'storedFailure', restored, ok: restored === null }))
+  failures += restored === null ? 0 : 1
+  return failures
+}
+
+async function benchmark(workDir: string, files: number) {
+  const cache = new ExtractionCache(path.join(workDir, `cache-${files}`))
+  const packagePath = path.join(workDir, `package-${files}`)
+  const callGraphFilePath = path.join(workDir, `package-${files}_cg.json`)
+  syntheticPackage(packagePath, files)
+
+  let start = process.hrtime()
+  const { keys } = await cache.getKeys(packagePath)
+  const keysMs = milliseconds(start)
+  fs.writeFileSync(callGraphFilePath, callGraphOf(packagePath))
+  await cache.storeCallGraph(keys.callGraph, callGraphFilePath, packagePath, 1, { exitCode: 0 })
+  start = process.hrtime()
+  for (let i = 0; i < RESTORES; i++) {
+    await cache.restoreCallGraph(keys.callGraph, callGraphFilePath, packagePath)
+  }
+  console.log(JSON.stringify({ files, packageBytes: files * FILE_BYTES, contentHashMs: keysMs, callGraphRestoreMs: milliseconds(start) / RESTORES }))
+}
+
+async function main() {
+  const workDir = fs.mkdtempSync(path.join(os.tmpdir(), 'extraction-cache-'))
+  try {
+    if (await check(workDir) > 0) {
+      process.exitCode = 1
+    }
+    const sizes = process.argv.slice(2).map(Number)
+    for (const files of sizes.length > 0 ? sizes : [10, 100, 1000]) {
+      await benchmark(workDir, files)
+    }
+  } finally {
+    fs.rmSync(workDir, { recursive: true, force: true })
+  }
+}
+
+main()
@@ -0,0 +1,133 @@
+/**
+ * Benchmark of the call-graph function lookup of the AST feature pass: the former linear scan over
+ * all call-graph functions against FunctionLocationIndex, on synthetic call graphs of nested
+ * functions. The first CHECKED lookups of the index are checked against the linear scan.
+ *
+ * Usage:
+ *     npx ts-node benchmarks/functionLocationIndex.ts [functions...]
+ *
+ * The default sizes are 1000, 10000 and 50000 functions spread over 20 files, with 20000 lookups each.
+ */
+import path from 'path'
+import { FunctionLocationIndex, type SourceLocation } from '../src/feature-extract/FunctionLocationIndex'
+
+const FILES = 20
+const LOOKUPS = 20000
+// the linear scan is only timed on these first lookups, it takes minutes on all of them
+const CHECKED = 200
+
+// deterministic pseudo-random numbers (mulberry32)
+function random(seed: number) {
+  return () => {
+    seed = (seed + 0x6d2b79f5) | 0
+    let t = Math.imul(seed ^ (seed >>> 15), 1 | seed)
+    t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296
+  }
+}
+
+/**
+ * A jelly-like call graph: functions numbered in source order, nested up to 6 levels, each
+ * file's functions laid out over lines like a bundled package
+ */
+function syntheticCallGraph(functions: number, rand: () => number) {
+  const CallGraphFiles: string[] = []
+  const CallGraphFunctions: { [key: string]: string } = {}
+  const perFile = Math.ceil(functions / FILES)
+  let funcNum = 0
+  for (let file = 0; file < FILES; file++) {
+    CallGraphFiles.push(`lib/file${file}.js`)
+    // lay out `count` functions inside lines [first, last] at nesting depth `depth`
+    const layout = (first: number, last: number, count: number, depth: number) => {
+      let line = first
+      while (count > 0 && line < last) {
+        const children = depth < 6 ? Math.min(count - 1, Math.floor(rand() * 4)) : 0
+        const length = 2 + children * 3 + Math.floor(rand() * 3)
+        if (line + length > last) {
+          return
+        }
+        CallGraphFunctions[String(funcNum++)] = `${file}:${line}:${1 + Math.floor(rand() * 8)}:${line + length}:${2 + Math.floor(rand() * 40)}`
+        count--
+        layout(line + 1, line + length - 1, children, depth + 1)
+        count -= children
+        line += length + 1
+      }
+    }
+    layout(1, perFile * 6, perFile, 0)
+  }
+  return { CallGraphFiles, CallGraphFunctions }
+}
+
+// the lookup getFuncNum did before FunctionLocationIndex
+function linearScan(CallGraphFiles: string[], CallGraphFunctions: { [key: string]: string }, relativePath: string, loc: SourceLocation) {
+  const fileIndex = CallGraphFiles.findIndex((PathinGraph) => path.normalize(PathinGraph) === path.normalize(relativePath))
+  if (fileIndex === -1) {
+    return null
+  }
+  const startLine = loc.start.line
+  const startColumn = loc.start.column + 1
+  const endLine = loc.end.line
+  const endColumn = loc.end.column + 1
+  for (const [funcNum, location] of Object.entries(CallGraphFunctions)) {
+    const [fIndex, sLine, sColumn, eLine, eColumn] = location.split(':').map(Number)
+    const isWithinLineRange = startLine > sLine || (startLine === sLine && startColumn >= sColumn)
+    const isWithinEndLineRange = endLine < eLine || (endLine === eLine && endColumn <= eColumn)
+    if (fIndex === fileIndex && isWithinLineRange && isWithinEndLineRange) {
+      return funcNum
+    }
+  }
+  return null
+}
+
+function milliseconds(start: [number, number]) {
+  const [seconds, nanoseconds] = process.hrtime(start)
+  return seconds * 1000 + nanoseconds / 1000000
+}
+
+function benchmark(functions: number) {
+  const rand = random(functions)
+  const { CallGraphFiles, CallGraphFunctions } = syntheticCallGraph(functions, rand)
+  const lines = Math.ceil(functions / FILES) * 6
+  const lookups: Array<[string, SourceLocation]> = []
+  for (let i = 0; i < LOOKUPS; i++) {
+    const line = 1 + Math.floor(rand() * lines)
+    const column = Math.floor(rand() * 60)
+    const endLine = line + (rand() < 0.8 ? 0 : Math.floor(rand() * 3))
+    lookups.push([`lib/file${Math.floor(rand() * FILES)}.js`, { start: { line, column }, end: { line: endLine, column: column + 5 } }])
+  }
+
+  let start = process.hrtime()
+  const expected = lookups.slice(0, CHECKED).map(([file, loc]) => linearScan(CallGraphFiles, CallGraphFunctions, file, loc))
+  const linearMs = milliseconds(start)
+
+  start = process.hrtime()
+  const index = new FunctionLocationIndex(CallGraphFiles, CallGraphFunctions)
+  const buildMs = milliseconds(start)
+  start = process.hrtime()
+  const actual = lookups.map(([file, loc]) => {
+    const fileFunctions = index.forFile(file)
+    return fileFunctions === null ? null : fileFunctions.findNode(loc)
+  })
+  const indexMs = milliseconds(start)
+
+  const mismatches = expected.filter((funcNum, i) => funcNum !== actual[i]).length
+  console.log(JSON.stringify({
+    functions: Object.keys(CallGraphFunctions).length,
+    lookups: LOOKUPS,
+    found: actual.filter(funcNum => funcNum !== null).length,
+    linearScanUsPerLookup: linearMs * 1000 / CHECKED,
+    indexBuildMs: buildMs,
+    indexUsPerLookup: indexMs * 1000 / LOOKUPS,
+    lookupSpeedup: (linearMs / CHECKED) / (indexMs / LOOKUPS),
+    checked: CHECKED,
+    mismatches
+  }))
+  if (mismatches > 0) {
+    process.exitCode = 1
+  }
+}
+
+const sizes = process.argv.slice(2).map(Number)
+for (const functions of sizes.length > 0 ? sizes : [1000, 10000, 50000]) {
+  benchmark(functions)
+}
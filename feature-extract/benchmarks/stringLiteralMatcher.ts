@@ -0,0 +1,117 @@
+/**
+ * Golden-output check and benchmark of the string literal matching of the AST feature pass: the
+ * former pattern runs on every literal (IP, base64, the TLD alternation of getDomainPattern(),
+ * sensitive files, and byteString_Pattern over the whole file), against StringLiteralMatcher.
+ *
+ * The literals mimic a minified bundle: mostly identifiers and short words, some property paths,
+ * file paths, version numbers and random strings, and a few URLs, domains and IPs. The former
+ * matching is only timed on the first CHECKED literals, whose matches are checked against the matcher.
+ *
+ * Usage:
+ *     npx ts-node benchmarks/stringLiteralMatcher.ts [literals...]
+ *
+ * The default sizes are 10000, 100000 and 300000 literals.
+ */
+import { IP_Pattern, base64_Pattern, byteString_Pattern, getDomainPattern, SensitiveStringPattern } from '../src/feature-extract/Patterns'
+import { StringLiteralMatcher, type StringLiteralMatches } from '../src/feature-extract/StringLiteralMatcher'
+
+// the former matching is only timed on these first literals, byteString_Pattern makes it quadratic in the file size
+const CHECKED = 500
+
+// deterministic pseudo-random numbers (mulberry32)
+function random(seed: number) {
+  return () => {
+    seed = (seed + 0x6d2b79f5) | 0
+    let t = Math.imul(seed ^ (seed >>> 15), 1 | seed)
+    t = (t + Math.imul(t ^ (t >>> 7), 61 | t)) ^ t
+    return ((t ^ (t >>> 14)) >>> 0) / 4294967296
+  }
+}
+
+const WORDS = ['use strict', 'function', 'undefined', 'object', 'string', 'click', 'default', 'length', 'prototype', 'Symbol.iterator', 'a', 'b', '', ' ', 'px', 'none', 'color', 'hostname', 'ping']
+const DOTTED = ['module.exports', 'a.b.c', './lib/index.js', '../package.json', 'v1.2.3', 'index.d.ts', 'e.target.value', 'foo.community', '1.0.0-beta.1', 'Array.prototype.slice']
+const NETWORK = ['https://registry.npmjs.org/', 'http://evil.tk/payload', 'cdn.example.xyz', 'github.com', 'ftp://files.example.cn/a', 'www.google.com', 'api.x.top:8080', ' 8.8.8.8 ', '10.0.0.1', '1.2.3.4', 'ip 45.33.32.156 up']
+const PATHS = ['/etc/passwd', '/usr/bin/env', '~/.bashrc', 'xzshrc', '/bin/sh -c', '/dev/tcp/1.2.3.4/80', 'C:/Windows', 'a/b']
+const CHARS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789+/=.:-_'
+
+function syntheticLiterals(count: number, rand: () => number) {
+  const pick = (list: string[]) => list[Math.floor(rand() * list.length)]
+  const literals: string[] = []
+  for (let i = 0; i < count; i++) {
+    const kind = rand()
+    if (kind < 0.55) {
+      literals.push(pick(WORDS))
+    } else if (kind < 0.7) {
+      literals.push(pick(DOTTED))
+    } else if (kind < 0.77) {
+      literals.push(pick(NETWORK))
+    } else if (kind < 0.82) {
+      literals.push(pick(PATHS))
+    } else {
+      let literal = ''
+      const length = 4 + Math.floor(rand() * 40)
+      for (let j = 0; j < length; j++) {
+        literal += CHARS[Math.floor(rand() * CHARS.length)]
+      }
+      literals.push(literal)
+    }
+  }
+  return literals
+}
+
+// the matching the StringLiteral visitor did before StringLiteralMatcher
+function formerMatch(content: string, code: string): StringLiteralMatches {
+  const includeIP = content.match(IP_Pattern) != null
+  content.match(base64_Pattern)
+  const domains = content.match(getDomainPattern())
+  const includeSensitiveFiles = content.match(SensitiveStringPattern) != null
+  const includeByteString = code.match(byteString_Pattern) != null
+  return { includeIP, domains, includeSensitiveFiles, includeByteString }
+}
+
+function key(matches: StringLiteralMatches) {
+  const domains = matches.domains && [...matches.domains, matches.domains.index]
+  return JSON.stringify([matches.includeIP, domains, matches.includeSensitiveFiles, matches.includeByteString])
+}
+
+function milliseconds(start: [number, number]) {
+  const [seconds, nanoseconds] = process.hrtime(start)
+  return seconds * 1000 + nanoseconds / 1000000
+}
+
+function benchmark(count: number, withByteString: boolean) {
+  const literals = syntheticLiterals(count, random(count))
+  // the file the literals come from, one statement per line
+  const code = literals.map((literal, i) => `var v${i} = "${literal}";`).join('\n') + (withByteString ? '\nvar s = "\\x63\\x75\\x72\\x6c";' : '')
+
+  let start = process.hrtime()
+  const expected = literals.slice(0, CHECKED).map(literal => key(formerMatch(literal, code)))
+  const formerMs = milliseconds(start)
+
+  start = process.hrtime()
+  const matcher = new StringLiteralMatcher(code)
+  const actual = literals.map(literal => matcher.match(literal))
+  const matcherMs = milliseconds(start)
+
+  const mismatches = expected.filter((matches, i) => matches !== key(actual[i])).length
+  console.log(JSON.stringify({
+    literals: count,
+    byteString: withByteString,
+    screened: matcher.screened,
+    domains: actual.filter(matches => matches.domains !== null).length,
+    formerUsPerLiteral: formerMs * 1000 / Math.min(CHECKED, count),
+    matcherUsPerLiteral: matcherMs * 1000 / count,
+    speedup: (formerMs / Math.min(CHECKED, count)) / (matcherMs / count),
+    checked: Math.min(CHECKED, count),
+    mismatches
+  }))
+  if (mismatches > 0) {
+    process.exitCode = 1
+  }
+}
+
+const sizes = process.argv.slice(2).map(Number)
+benchmark(CHECKED, false)
+for (const count of sizes.length > 0 ? sizes : [10000, 100000, 300000]) {
+  benchmark(count, true)
+}
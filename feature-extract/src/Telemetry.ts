@@ -0,0 +1,148 @@
+import fs from 'fs'
+import promises from 'fs/promises'
+import path from 'path'
+
+// how often the resident memory is sampled while a stage runs
+const SAMPLE_INTERVAL_MS = 100
+
+/**
+ * Whether telemetry is collected, i.e. the STAGE_TIMINGS_FILE environment variable is set
+ */
+export function isTelemetryEnabled() {
+  return !!process.env.STAGE_TIMINGS_FILE
+}
+
+/**
+ * Append a telemetry record of a package as one JSON line to the file named by the
+ * STAGE_TIMINGS_FILE environment variable, if it is set. The records are summarized by
+ * extraction_report.py and imported into the dataset catalog
+ */
+export function recordTelemetry(record: object) {
+  const telemetryFilePath = process.env.STAGE_TIMINGS_FILE
+  if (!telemetryFilePath) {
+    return
+  }
+  fs.appendFileSync(telemetryFilePath, JSON.stringify(record) + '\n')
+}
+
+function readProcFile(filePath: string) {
+  try {
+    return fs.readFileSync(filePath, 'utf8')
+  } catch {
+    return null
+  }
+}
+
+/**
+ * The resident memory of a process and all of its descendants in bytes, read from /proc.
+ * Returns 0 where /proc is not available or the process has exited
+ * @param pid the process id of the root of the process tree
+ */
+export function getProcessTreeRss(pid: number): number {
+  const status = readProcFile(`/proc/${pid}/status`)
+  if (status === null) {
+    return 0
+  }
+  const match = status.match(/^VmRSS:\s+(\d+) kB/m)
+  let rss = match ? Number(match[1]) * 1024 : 0
+  const children = readProcFile(`/proc/${pid}/task/${pid}/children`)
+  for (const child of (children || '').split(' ')) {
+    if (child.trim()) {
+      rss += getProcessTreeRss(Number(child))
+    }
+  }
+  return rss
+}
+
+/**
+ * Tracks the peak resident memory of a stage: that of a child process tree (such as jelly)
+ * when a pid is given, otherwise that of this process. The memory of this process is also
+ * taken from its lifetime peak (process.resourceUsage().maxRSS), so a peak reached inside
+ * synchronous code, where the sampling timer cannot run, is not missed
+ */
+export class PeakRssMonitor {
+  private peakBytes = 0
+  private timer: NodeJS.Timeout | null = null
+  private readonly maxRssBefore = process.resourceUsage().maxRSS * 1024
+  private pid: number | undefined
+
+  constructor(pid?: number) {
+    this.pid = pid
+    this.sample()
+    this.timer = setInterval(() => this.sample(), SAMPLE_INTERVAL_MS)
+    // the sampling alone must not keep the process alive
+    this.timer.unref()
+  }
+
+  /**
+   * Follow the process tree of pid instead of this process
+   */
+  watch(pid: number | undefined) {
+    this.pid = pid
+    this.sample()
+  }
+
+  private sample() {
+    const rss = this.pid === undefined ? process.memoryUsage().rss : getProcessTreeRss(this.pid)
+    this.peakBytes = Math.max(this.peakBytes, rss)
+  }
+
+  /**
+   * Stop sampling
+   * @returns the peak resident memory in bytes, or null if it could not be measured
+   */
+  stop(): number | null {
+    if (this.timer) {
+      this.sample()
+      clearInterval(this.timer)
+      this.timer = null
+    }
+    if (this.pid === undefined) {
+      // a peak above the one before the stage was reached during the stage
+      const maxRssAfter = process.resourceUsage().maxRSS * 1024
+      if (maxRssAfter > this.maxRssBefore) {
+        this.peakBytes = Math.max(this.peakBytes, maxRssAfter)
+      }
+    }
+    return this.peakBytes || null
+  }
+}
+
+/**
+ * Count the regular files of a package and their total size
+ * @param packagePath the absolute path to the package directory
+ */
+export async function getPackageSize(packagePath: string) {
+  let files = 0
+  let bytes = 0
+  async function walk(dirPath: string) {
+    for (const entry of await promises.readdir(dirPath, { withFileTypes: true })) {
+      const entryPath = path.join(dirPath, entry.name)
+      if (entry.isDirectory()) {
+        await walk(entryPath)
+      } else if (entry.isFile()) {
+        files += 1
+        bytes += (await promises.stat(entryPath)).size
+      }
+    }
+  }
+  await walk(packagePath)
+  return { files, bytes }
+}
+
+/**
+ * The size of a jelly call graph file: its files, functions and function-to-function call edges
+ * @returns the counts, or null if there is no readable call graph
+ */
+export async function getCallGraphSize(callGraphFilePath: string) {
+  try {
+    const callGraph = JSON.parse(await promises.readFile(callGraphFilePath, 'utf8'))
+    return {
+      files: (callGraph.files || []).length,
+      functions: Object.keys(callGraph.functions || {}).length,
+      edges: (callGraph.fun2fun || []).length
+    }
+  } catch {
+    return null
+  }
+}
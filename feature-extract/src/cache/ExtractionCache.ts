@@ -0,0 +1,204 @@
+import crypto from 'crypto'
+import fs from 'fs'
+import promises from 'fs/promises'
+import path from 'path'
+import topDomains from '../feature-extract/top-domains.json'
+import domainList from '../feature-extract/domain_list.json'
+import { IP_Pattern, base64_Pattern, byteString_Pattern, Network_Command_Pattern, SensitiveStringPattern } from '../feature-extract/Patterns'
+import { JELLY_OPTIONS, MAX_FILE_SIZE, type CallGraphRunStats } from '../call-graph/generateCallGraph'
+import { callgraphRoundLimit, dfsDepthLimit } from '../index'
+
+/**
+ * Versions of the extraction stages. Bump the version of a stage when a code change alters its
+ * output: the cached results of that stage and of the stages after it are recomputed, while
+ * the stages before it are still served from the cache
+ */
+export const STAGE_VERSIONS = {
+  callGraph: 1,
+  featureExtraction: 1,
+  serialization: 1
+}
+export type CacheStage = keyof typeof STAGE_VERSIONS
+export type CacheKeys = { contentHash: string, keys: { [stage in CacheStage]: string } }
+const STAGES: CacheStage[] = ['callGraph', 'featureExtraction', 'serialization']
+
+// the cached files hold absolute paths into the package, stored relative to this placeholder
+const PACKAGE_PLACEHOLDER = '<package>/'
+
+function sha1(data: string | Buffer) {
+  return crypto.createHash('sha1').update(data).digest('hex')
+}
+
+/**
+ * The configuration hash of every stage: its version and the options and rule data its output depends on
+ */
+export function getStageHashes(): { [stage in CacheStage]: string } {
+  const patterns = [IP_Pattern, base64_Pattern, byteString_Pattern, Network_Command_Pattern, SensitiveStringPattern]
+  return {
+    callGraph: sha1(JSON.stringify({ version: STAGE_VERSIONS.callGraph, jellyOptions: JELLY_OPTIONS, maxFileSize: MAX_FILE_SIZE, callgraphRoundLimit })),
+    featureExtraction: sha1(JSON.stringify({ version: STAGE_VERSIONS.featureExtraction, patterns: patterns.map(pattern => pattern.toString()), topDomains, domainList })),
+    serialization: sha1(JSON.stringify({ version: STAGE_VERSIONS.serialization, dfsDepthLimit }))
+  }
+}
+
+/**
+ * Hash the content of a package: the sorted relative paths of its regular files and the sha1 of
+ * each file. Symbolic links inside the package are ignored
+ * @param packagePath the absolute path to the package directory
+ */
+export async function getPackageContentHash(packagePath: string) {
+  const files: string[] = []
+  async function walk(dirPath: string, relativeDirPath: string) {
+    for (const entry of await promises.readdir(dirPath, { withFileTypes: true })) {
+      const relativePath = relativeDirPath ? `${relativeDirPath}/${entry.name}` : entry.name
+      if (entry.isDirectory()) {
+        await walk(path.join(dirPath, entry.name), relativePath)
+      } else if (entry.isFile()) {
+        files.push(relativePath)
+      }
+    }
+  }
+  await walk(packagePath, '')
+  files.sort()
+  const digest = crypto.createHash('sha1')
+  for (const relativePath of files) {
+    digest.update(relativePath + '\0')
+    digest.update(sha1(await promises.readFile(path.join(packagePath, relativePath))))
+  }
+  return digest.digest('hex')
+}
+
+// the package directory as it appears inside a JSON string
+function escapedPackagePrefix(packagePath: string) {
+  return JSON.stringify(packagePath + path.sep).slice(1, -1)
+}
+
+/**
+ * Content-addressed cache of the call graph, feature positions and feature sequence of the
+ * packages, in the directory named by the EXTRACTION_CACHE_DIR environment variable.
+ * The key of each stage hashes the stage configuration with the key of the stage before it,
+ * starting from the package content hash, so an unchanged package hits every stage and a
+ * version bump only misses from the bumped stage on. Every analyzed package appends its hits
+ * and misses to events.jsonl, which extraction_cache.py reads
+ */
+export class ExtractionCache {
+  private stageHashes = getStageHashes()
+
+  constructor(public readonly cacheDirPath: string) {
+    fs.mkdirSync(path.join(cacheDirPath, 'objects'), { recursive: true })
+    // lets extraction_cache.py compute the keys of a package without running the extractor
+    this.writeFileAtomic(path.join(cacheDirPath, 'versions.json'), JSON.stringify({ versions: STAGE_VERSIONS, stages: this.stageHashes }, null, 2))
+  }
+
+  private objectPath(key: string, suffix: string) {
+    return path.join(this.cacheDirPath, 'objects', key.slice(0, 2), `${key}.${suffix}`)
+  }
+
+  private writeFileAtomic(filePath: string, data: string) {
+    fs.mkdirSync(path.dirname(filePath), { recursive: true })
+    const tmpPath = `${filePath}.${process.pid}.${Math.random().toString(36).slice(2)}.tmp`
+    fs.writeFileSync(tmpPath, data)
+    fs.renameSync(tmpPath, filePath)
+  }
+
+  /**
+   * Compute the content hash and the stage keys of a package
+   * @param packagePath the absolute path to the package directory
+   */
+  async getKeys(packagePath: string): Promise<CacheKeys> {
+    const contentHash = await getPackageContentHash(packagePath)
+    const keys = {} as CacheKeys['keys']
+    let previousKey = contentHash
+    for (const stage of STAGES) {
+      previousKey = keys[stage] = sha1(`${stage}:${this.stageHashes[stage]}:${previousKey}`)
+    }
+    return { contentHash, keys }
+  }
+
+  /**
+   * Copy a cached file to targetPath, pointing its package paths at packagePath
+   * @returns whether the file was cached
+   */
+  async restoreFile(key: string, suffix: string, targetPath: string, packagePath: string) {
+    let data: string
+    try {
+      data = await promises.readFile(this.objectPath(key, suffix), 'utf8')
+    } catch {
+      return false
+    }
+    await promises.writeFile(targetPath, data.split(PACKAGE_PLACEHOLDER).join(escapedPackagePrefix(packagePath)))
+    return true
+  }
+
+  /**
+   * Store sourcePath in the cache, replacing the package paths in it with a placeholder
+   */
+  async storeFile(key: string, suffix: string, sourcePath: string, packagePath: string) {
+    const data = await promises.readFile(sourcePath, 'utf8')
+    this.writeFileAtomic(this.objectPath(key, suffix), data.split(escapedPackagePrefix(packagePath)).join(PACKAGE_PLACEHOLDER))
+  }
+
+  /**
+   * Restore the cached call graph of a package
+   * @returns the cached result of generateCallGraphForPackage, or null on a miss
+   */
+  async restoreCallGraph(key: string, callGraphFilePath: string, packagePath: string): Promise<number | null> {
+    let meta: { ifCallGraphGenerated: number }
+    try {
+      meta = JSON.parse(await promises.readFile(this.objectPath(key, 'meta.json'), 'utf8'))
+    } catch {
+      return null
+    }
+    if (meta.ifCallGraphGenerated !== 1) {
+      // a failed run cached before failures were skipped: generate the call graph again
+      return null
+    }
+    if (!await this.restoreFile(key, 'cg.json', callGraphFilePath, packagePath)) {
+      // jelly wrote no call graph for this package: do not leave the one of an earlier run behind
+      await promises.rm(callGraphFilePath, { force: true })
+    }
+    return meta.ifCallGraphGenerated
+  }
+
+  /**
+   * Store the call graph of a package with the result of generateCallGraphForPackage. A run that
+   * failed, hit the jelly time limit or the job timeout of the pool, or exited abnormally is not stored: the failure may be
+   * transient, and the next run generates the call graph again
+   * @returns whether the call graph was stored
+   */
+  async storeCallGraph(key: string, callGraphFilePath: string, packagePath: string, ifCallGraphGenerated: number, runStats: CallGraphRunStats = {}) {
+    if (ifCallGraphGenerated !== 1 || runStats.timeLimitReached || runStats.jobTimedOut || runStats.exitCode) {
+      return false
+    }
+    try {
+      await this.storeFile(key, 'cg.json', callGraphFilePath, packagePath)
+    } catch {
+      // no call graph was written
+    }
+    // the metadata is written last: its presence marks the stage as cached
+    this.writeFileAtomic(this.objectPath(key, 'meta.json'), JSON.stringify({ ifCallGraphGenerated }))
+    return true
+  }
+
+  /**
+   * Append the cache hits and misses of a package to events.jsonl
+   * @param stages 'hit' or 'miss' for every stage the package reached
+   */
+  recordEvent(packageName: string, cacheKeys: CacheKeys, stages: { [stage: string]: 'hit' | 'miss' }, failedStage?: string) {
+    const event = { package: packageName, contentHash: cacheKeys.contentHash, ...stages, ...(failedStage ? { failedStage } : {}), time: Date.now() }
+    fs.appendFileSync(path.join(this.cacheDirPath, 'events.jsonl'), JSON.stringify(event) + '\n')
+  }
+}
+
+let extractionCache: ExtractionCache | null | undefined
+
+/**
+ * The extraction cache of this process, or null if EXTRACTION_CACHE_DIR is not set
+ */
+export function getExtractionCache() {
+  if (extractionCache === undefined) {
+    const cacheDirPath = process.env.EXTRACTION_CACHE_DIR
+    extractionCache = cacheDirPath ? new ExtractionCache(path.resolve(cacheDirPath)) : null
+  }
+  return extractionCache
+}
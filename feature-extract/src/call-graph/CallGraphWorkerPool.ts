@@ -0,0 +1,407 @@
+import { type ChildProcessWithoutNullStreams, spawn } from 'child_process'
+import fs from 'fs'
+import path from 'path'
+import { Logger } from '../Logger'
+import { getProcessTreeRss } from '../Telemetry'
+
+// how often the resident memory of a busy worker is checked against its share of the memory budget
+const RSS_CHECK_INTERVAL_MS = 200
+// a worker is recycled after a job once its resident memory exceeds this fraction of its share:
+// a warm V8 heap does not shrink back, so it would leave the next package less room
+const RECYCLE_RSS_FRACTION = 0.5
+const DEFAULT_JOBS_PER_WORKER = 50
+const DEFAULT_JOB_TIMEOUT_MS = 120000
+const DEFAULT_WORKER_MEMORY_MB = 14336
+// a jelly server that has not answered by then is taken as not speaking the expected protocol
+const STARTUP_TIMEOUT_MS = 30000
+
+export interface CallGraphPoolConfig {
+  // number of jelly server processes
+  workers: number
+  // memory of all the workers together, split evenly between them
+  memoryBudgetMb: number
+  // a worker is recycled after this many packages
+  jobsPerWorker: number
+  // a package taking longer is abandoned and its worker killed
+  jobTimeoutMs: number
+}
+
+/**
+ * The outcome of a pooled jelly run
+ */
+export interface CallGraphJobResult {
+  // the call graph as jelly writes it with -j, null if jelly failed
+  callGraph: object | null
+  // jelly stopped the analysis at its own time limit
+  timeLimitReached: boolean
+  // the job ran over jobTimeoutMs and its worker was killed
+  jobTimedOut: boolean
+  // exit code of the worker if it died during the job
+  exitCode: number | null
+  peakRssBytes: number
+}
+
+interface JellyResponse {
+  success: boolean
+  message?: string
+  body?: any
+}
+
+/**
+ * A jelly-server process. Requests and responses are JSON messages framed by a Content-Length
+ * header, as in the Debug Adapter Protocol; anything else on its output is jelly's log
+ */
+class JellyServer {
+  readonly process: ChildProcessWithoutNullStreams
+  readonly exited: Promise<number | null>
+  jobs = 0
+  // whether the log of the current job reported jelly's time limit
+  timeLimitReached = false
+  private seq = 0
+  private readonly pending = new Map<number, { resolve: (response: JellyResponse) => void, reject: (error: Error) => void }>()
+  private chunks: Buffer[] = []
+  private buffered = 0
+  // bytes needed before the next message is complete, once its header was read
+  private expected = 0
+
+  constructor(serverPath: string, heapMb: number) {
+    this.process = spawn(process.execPath, [`--max-old-space-size=${heapMb}`, serverPath])
+    this.process.stdout.on('data', (chunk: Buffer) => this.receive(chunk))
+    this.process.stderr.on('data', (chunk: Buffer) => this.log(chunk.toString()))
+    // a request written after the server died fails through the exit below
+    this.process.stdin.on('error', () => {})
+    this.exited = new Promise((resolve) => {
+      this.process.on('exit', (code) => {
+        for (const { reject } of this.pending.values()) {
+          reject(new Error(`jelly server exited with code ${code}`))
+        }
+        this.pending.clear()
+        resolve(code)
+      })
+      this.process.on('error', (error) => {
+        Logger.error(`Failed to start the jelly server: ${error.message}`)
+      })
+    })
+  }
+
+  request(command: string, args?: unknown): Promise<JellyResponse> {
+    const seq = ++this.seq
+    const json = JSON.stringify({ seq, type: 'request', command, arguments: args })
+    return new Promise((resolve, reject) => {
+      if (this.process.exitCode !== null || this.process.signalCode !== null) {
+        reject(new Error(`jelly server exited with code ${this.process.exitCode}`))
+        return
+      }
+      this.pending.set(seq, { resolve, reject })
+      this.process.stdin.write(`Content-Length: ${Buffer.byteLength(json)}\r\n\r\n${json}`)
+    })
+  }
+
+  kill() {
+    this.process.kill('SIGKILL')
+  }
+
+  private log(text: string) {
+    if (text.includes('Time limit reached')) {
+      this.timeLimitReached = true
+    }
+  }
+
+  private receive(chunk: Buffer) {
+    this.chunks.push(chunk)
+    this.buffered += chunk.length
+    // a large call graph arrives in many chunks, they are only joined once it is complete
+    if (this.buffered < this.expected) {
+      return
+    }
+    let buffer = this.chunks.length === 1 ? this.chunks[0] : Buffer.concat(this.chunks)
+    this.expected = 0
+    for (;;) {
+      const header = buffer.indexOf('Content-Length: ')
+      const separator = header === -1 ? -1 : buffer.indexOf('\r\n\r\n', header)
+      if (separator === -1) {
+        // log output, or a header still incomplete
+        const logEnd = header === -1 ? Math.max(0, buffer.length - 16) : header
+        this.log(buffer.toString('utf8', 0, logEnd))
+        buffer = buffer.subarray(logEnd)
+        break
+      }
+      this.log(buffer.toString('utf8', 0, header))
+      const start = separator + 4
+      const end = start + Number(buffer.toString('utf8', header + 16, separator))
+      if (buffer.length < end) {
+        buffer = buffer.subarray(header)
+        this.expected = end - header
+        break
+      }
+      let message: any
+      try {
+        message = JSON.parse(buffer.toString('utf8', start, end))
+      } catch {
+        Logger.error('The jelly server sent a malformed message')
+        this.kill()
+        return
+      }
+      buffer = buffer.subarray(end)
+      const request = message.type === 'response' ? this.pending.get(message.request_seq) : undefined
+      if (request) {
+        this.pending.delete(message.request_seq)
+        request.resolve(message)
+      }
+    }
+    this.chunks = buffer.length > 0 ? [buffer] : []
+    this.buffered = buffer.length
+  }
+}
+
+/**
+ * Whether the body of a callgraph response has the fields and types of a call graph written by
+ * jelly -j, which the feature extraction and serialization read
+ */
+function isJellyCallGraph(body: any): boolean {
+  return typeof body === 'object' && body !== null
+    && Array.isArray(body.files)
+    && typeof body.functions === 'object' && body.functions !== null && !Array.isArray(body.functions)
+    && Array.isArray(body.fun2fun)
+    && Array.isArray(body.entries)
+}
+
+/**
+ * The jelly server script of the installed jelly, looked up in node_modules from the working
+ * directory upwards as npx does
+ * @returns its path, or null if jelly is not installed
+ */
+function findJellyServer(): string | null {
+  for (let dirPath = process.cwd(); ; dirPath = path.dirname(dirPath)) {
+    const serverPath = path.join(dirPath, 'node_modules', '@cs-au-dk', 'jelly', 'lib', 'server.js')
+    if (fs.existsSync(serverPath)) {
+      return serverPath
+    }
+    if (path.dirname(dirPath) === dirPath) {
+      return null
+    }
+  }
+}
+
+/**
+ * A pool of long-lived jelly server processes generating the call graphs of packages, so a
+ * package does not pay for a shell, npx and the startup of node and jelly.
+ *
+ * Each worker gets an even share of the memory budget as its heap limit, and is killed if its
+ * resident memory exceeds the share during a job. It is recycled after jobsPerWorker jobs, or
+ * after a job that left it over RECYCLE_RSS_FRACTION of its share. A job running over
+ * jobTimeoutMs is abandoned and its worker killed.
+ *
+ * A jelly whose server does not answer as expected is not used: if a worker fails before the
+ * pool received its first valid call graph, the pool is disabled and run returns null, so the
+ * caller falls back to the jelly command
+ */
+export class CallGraphWorkerPool {
+  private readonly idle: JellyServer[] = []
+  // callers waiting for a worker, given null once the pool is disabled
+  private readonly waiting: Array<(worker: JellyServer | null) => void> = []
+  private started = 0
+  private verified = false
+  private disabled = false
+  private readonly shareMb: number
+
+  constructor(private readonly serverPath: string, readonly config: CallGraphPoolConfig) {
+    this.shareMb = Math.floor(config.memoryBudgetMb / config.workers)
+  }
+
+  /**
+   * Generate the call graph of a package
+   * @param packagePath the absolute path to the package, which is also the base directory of the call graph
+   * @param options jelly options by name, as in the OptionValues of jelly
+   * @returns the result, or null if the pool cannot be used and the package should be analyzed by the jelly command
+   */
+  async run(packagePath: string, options: { [option: string]: unknown }): Promise<CallGraphJobResult | null> {
+    const worker = this.disabled ? null : await this.acquire()
+    if (worker === null) {
+      return null
+    }
+    const result: CallGraphJobResult = { callGraph: null, timeLimitReached: false, jobTimedOut: false, exitCode: null, peakRssBytes: 0 }
+    let killedFor: string | null = null
+    const kill = (reason: string) => {
+      if (killedFor === null) {
+        killedFor = reason
+        worker.kill()
+      }
+    }
+    const checkRss = () => {
+      const rss = getProcessTreeRss(worker.process.pid!)
+      result.peakRssBytes = Math.max(result.peakRssBytes, rss)
+      if (rss > this.shareMb * 1024 * 1024) {
+        kill(`exceeded its memory share of ${this.shareMb} MB`)
+      }
+    }
+    const rssTimer = setInterval(checkRss, RSS_CHECK_INTERVAL_MS)
+    const timeout = setTimeout(() => {
+      result.jobTimedOut = true
+      kill(`exceeded the job timeout of ${this.config.jobTimeoutMs} ms`)
+    }, this.config.jobTimeoutMs)
+    const startupTimeout = this.verified ? null : setTimeout(() => kill('did not answer'), STARTUP_TIMEOUT_MS)
+    worker.jobs++
+    worker.timeLimitReached = false
+    try {
+      const requests: Array<[string, unknown]> = [['options', options], ['files', [packagePath]], ['analyze', undefined]]
+      for (const [command, args] of requests) {
+        const analyzeStart = Date.now()
+        const response = await worker.request(command, args)
+        if (startupTimeout) {
+          clearTimeout(startupTimeout)
+        }
+        if (!response.success) {
+          return this.fail(packagePath, `The jelly server failed the ${command} request: ${response.message}`, result)
+        }
+        if (command === 'analyze') {
+          // jelly logs its time limit, and stops the analysis at it
+          const timeLimitMs = typeof options.timeout === 'number' ? options.timeout * 1000 : Infinity
+          result.timeLimitReached = worker.timeLimitReached || response.body?.timeout === true || Date.now() - analyzeStart >= timeLimitMs
+        }
+      }
+      const response = await worker.request('callgraph')
+      if (!response.success) {
+        return this.fail(packagePath, `The jelly server returned no call graph${response.message ? `: ${response.message}` : ''}`, result)
+      }
+      if (!isJellyCallGraph(response.body)) {
+        return this.fail(packagePath, 'The jelly server returned a call graph without the files, functions, fun2fun and entries of the jelly command', result)
+      }
+      // a call graph in the format of the jelly command, so the server speaks the protocol
+      this.verified = true
+      result.callGraph = response.body
+      // free the analysis results before the worker waits for the next package; the answer does not matter
+      worker.request('clear').catch(() => {})
+      return result
+    } catch (error) {
+      if (!this.verified && !(killedFor || '').startsWith('exceeded its memory')) {
+        return this.fail(packagePath, `The jelly server ${killedFor || (error as Error).message}`, result)
+      }
+      result.exitCode = await worker.exited
+      Logger.error(`${packagePath}: Failed to generate call graph. The jelly server ${killedFor || `exited with code ${result.exitCode}`}`)
+      return result
+    } finally {
+      clearTimeout(timeout)
+      if (startupTimeout) {
+        clearTimeout(startupTimeout)
+      }
+      clearInterval(rssTimer)
+      if (worker.process.exitCode === null && worker.process.signalCode === null) {
+        checkRss()
+      }
+      this.release(worker)
+    }
+  }
+
+  /**
+   * Stop all workers
+   */
+  async close() {
+    this.disabled = true
+    const workers = this.idle.splice(0)
+    await Promise.all(workers.map(async (worker) => {
+      worker.request('exit').catch(() => {})
+      const timer = setTimeout(() => worker.kill(), 1000)
+      await worker.exited
+      clearTimeout(timer)
+    }))
+  }
+
+  // before the first valid call graph, a failure means the jelly server may speak another protocol
+  private fail(packagePath: string, message: string, result: CallGraphJobResult): CallGraphJobResult | null {
+    if (this.verified) {
+      Logger.error(`${packagePath}: Failed to generate call graph. ${message}`)
+      return result
+    }
+    Logger.error(`${packagePath}: ${message}. The call graph worker pool is disabled, call graphs are generated by the jelly command`)
+    this.disabled = true
+    return null
+  }
+
+  private acquire(): Promise<JellyServer | null> {
+    const worker = this.idle.pop()
+    if (worker) {
+      return Promise.resolve(worker)
+    }
+    if (this.started < this.config.workers) {
+      this.started++
+      return Promise.resolve(new JellyServer(this.serverPath, this.shareMb))
+    }
+    return new Promise((resolve) => this.waiting.push(resolve))
+  }
+
+  private release(worker: JellyServer) {
+    const dead = worker.process.exitCode !== null || worker.process.signalCode !== null || worker.process.killed
+    const rss = dead ? 0 : getProcessTreeRss(worker.process.pid!)
+    if (dead || this.disabled || worker.jobs >= this.config.jobsPerWorker || rss > this.shareMb * RECYCLE_RSS_FRACTION * 1024 * 1024) {
+      if (!dead) {
+        worker.kill()
+      }
+      this.started--
+      if (this.disabled) {
+        for (const next of this.waiting.splice(0)) {
+          next(null)
+        }
+        return
+      }
+      const next = this.waiting.shift()
+      if (next) {
+        this.started++
+        next(new JellyServer(this.serverPath, this.shareMb))
+      }
+      return
+    }
+    const next = this.waiting.shift()
+    if (next) {
+      next(worker)
+    } else {
+      this.idle.push(worker)
+    }
+  }
+}
+
+/**
+ * The configuration of the call graph worker pool, from the environment: CALL_GRAPH_WORKERS jelly
+ * servers sharing CALL_GRAPH_MEMORY_MB, recycled after CALL_GRAPH_JOBS_PER_WORKER packages, with a
+ * timeout of CALL_GRAPH_JOB_TIMEOUT_MS per package
+ * @returns the configuration, or null if CALL_GRAPH_WORKERS is not set and every package runs the jelly command
+ */
+export function getCallGraphPoolConfig(): CallGraphPoolConfig | null {
+  const workers = Number(process.env.CALL_GRAPH_WORKERS) || 0
+  if (workers <= 0) {
+    return null
+  }
+  return {
+    workers,
+    memoryBudgetMb: Number(process.env.CALL_GRAPH_MEMORY_MB) || workers * DEFAULT_WORKER_MEMORY_MB,
+    jobsPerWorker: Number(process.env.CALL_GRAPH_JOBS_PER_WORKER) || DEFAULT_JOBS_PER_WORKER,
+    jobTimeoutMs: Number(process.env.CALL_GRAPH_JOB_TIMEOUT_MS) || DEFAULT_JOB_TIMEOUT_MS
+  }
+}
+
+let callGraphWorkerPool: CallGraphWorkerPool | null | undefined
+
+/**
+ * The call graph worker pool of this process (or worker thread), created on first use
+ * @returns the pool, or null if it is not configured or jelly is not installed
+ */
+export function getCallGraphWorkerPool() {
+  if (callGraphWorkerPool === undefined) {
+    const config = getCallGraphPoolConfig()
+    const serverPath = config && findJellyServer()
+    if (config && !serverPath) {
+      Logger.warn('jelly server not found in node_modules, call graphs are generated by the jelly command')
+    }
+    callGraphWorkerPool = config && serverPath ? new CallGraphWorkerPool(serverPath, config) : null
+  }
+  return callGraphWorkerPool
+}
+
+/**
+ * Stop the workers of the call graph worker pool, if it was started
+ */
+export async function closeCallGraphWorkerPool() {
+  if (callGraphWorkerPool) {
+    await callGraphWorkerPool.close()
+  }
+}
@@ -3,9 +3,32 @@ import fs from 'fs';
 import path from 'path';
 import { Logger } from '../Logger';
 import { callgraphRoundLimit } from '../index';
+import { PeakRssMonitor, isTelemetryEnabled } from '../Telemetry';
+import { getCallGraphWorkerPool } from './CallGraphWorkerPool';
 
-const MAX_FILE_SIZE = 3 * 1024 * 1024; // 2MB in bytes
+export const MAX_FILE_SIZE = 3 * 1024 * 1024; // 2MB in bytes
 const MAX_HEAP = 14336
+// options of every jelly run; they are part of the call graph stage hash of the extraction cache
+export const JELLY_OPTIONS = '--timeout 10 --no-callgraph-external --ignore-unresolved --no-callgraph-implicit --no-callgraph-native'
+// the same options by name, for the pooled jelly servers
+const JELLY_SERVER_OPTIONS = { timeout: 10, callgraphExternal: false, ignoreUnresolved: true, callgraphImplicit: false, callgraphNative: false }
+
+/**
+ * How a jelly run went, filled in by generateCallGraphForPackage for the extraction telemetry
+ */
+export interface CallGraphRunStats {
+    timeLimitReached?: boolean
+    // whether the pooled jelly server ran over the job timeout of the pool and was killed
+    jobTimedOut?: boolean
+    // exit code of the jelly process, or of the pooled jelly server if it died during the run
+    exitCode?: number | null
+    // whether the call graph came from the call graph worker pool
+    pooled?: boolean
+    // peak resident memory of the jelly process tree, sampled only while telemetry is enabled
+    peakRssBytes?: number | null
+    excludedFiles?: number
+}
+
 /**
  * Asynchronously reads a directory and returns an array of large files (larger than MAX_FILE_SIZE) within it.
  * 
@@ -34,15 +57,28 @@ async function findLargeFiles(dir: string): Promise<string[]> {
     return results;
 }
 
+/**
+ * Writes a call graph received from a pooled jelly server the way jelly -j would have.
+ * The file is written to a temporary file and renamed, so a reader never sees half of it.
+ */
+async function writeCallGraph(callGraphFilePath: string, callGraph: object) {
+    const tmpFilePath = `${callGraphFilePath}.${process.pid}.tmp`;
+    await fs.promises.writeFile(tmpFilePath, JSON.stringify(callGraph));
+    await fs.promises.rename(tmpFilePath, callGraphFilePath);
+}
+
 /**
  * Generates a call graph for a specified package directory and saves it to a file.
  * After generation, the call graph data is read from the file and returned.
+ * With CALL_GRAPH_WORKERS set, the call graph is generated by a warm jelly server of the call
+ * graph worker pool, and by a jelly command of its own only if the pool cannot be used.
  * 
  * @param packagePath The path to the package directory for which to generate the call graph.
  * @param callGraphFilePath The file path where the call graph should be saved.
+ * @param stats Filled in with the details of the jelly run, if given.
  * @returns A promise that resolves with an integer representing the result of the call graph generation process.
  */
-export async function generateCallGraphForPackage(packagePath: string, callGraphFilePath: string): Promise<number> {
+export async function generateCallGraphForPackage(packagePath: string, callGraphFilePath: string, stats: CallGraphRunStats = {}): Promise<number> {
     try {
         // Check if the package directory is empty or missing package.json
         await validatePackageDirectory(packagePath);
@@ -50,12 +86,31 @@ export async function generateCallGraphForPackage(packagePath: string, callGraph
         // Find large files in the package directory
         let largeFiles = await findLargeFiles(packagePath);
         let excludeEntries = largeFiles.map(file => `${file}`).join(' ');
+        stats.excludedFiles = largeFiles.length;
+
+        const pool = getCallGraphWorkerPool();
+        const pooled = pool && await pool.run(packagePath, { ...JELLY_SERVER_OPTIONS, basedir: packagePath, excludeEntries: largeFiles });
+        if (pooled) {
+            stats.pooled = true;
+            stats.exitCode = pooled.exitCode;
+            stats.peakRssBytes = pooled.peakRssBytes || null;
+            stats.timeLimitReached = pooled.timeLimitReached;
+            stats.jobTimedOut = pooled.jobTimedOut;
+            if (pooled.callGraph) {
+                await writeCallGraph(callGraphFilePath, pooled.callGraph);
+            }
+            if (pooled.timeLimitReached) {
+                Logger.warn(packagePath + " Time limit reached, analysis aborted");
+            }
+            return pooled.callGraph && !pooled.timeLimitReached ? 1 : -1;
+        }
 
         // Construct the command
-        const command = `node --max-old-space-size=${MAX_HEAP} $(which npx) jelly -j ${callGraphFilePath} ${packagePath} --timeout 10 --no-callgraph-external ${excludeEntries ? '--exclude-entries ' + excludeEntries : ''} --ignore-unresolved --no-callgraph-implicit --no-callgraph-native`;
+        const command = `node --max-old-space-size=${MAX_HEAP} $(which npx) jelly -j ${callGraphFilePath} ${packagePath} ${JELLY_OPTIONS} ${excludeEntries ? '--exclude-entries ' + excludeEntries : ''}`;
 
         // Spawn a child process to execute the command
         const childProcess = spawn(command, { shell: true });
+        const rssMonitor = isTelemetryEnabled() ? new PeakRssMonitor(childProcess.pid) : null;
 
         // Flag to indicate if "Time limit reached" was found
         let timeLimitReached = false;
@@ -75,6 +130,8 @@ export async function generateCallGraphForPackage(packagePath: string, callGraph
         // Create a promise to handle process exit
         const exitPromise = new Promise<number>((resolve) => {
             childProcess.on('exit', (code) => {
+                stats.exitCode = code;
+                stats.peakRssBytes = rssMonitor ? rssMonitor.stop() : null;
                 if (timeLimitReached) {
                     resolve(-1); // Return -1 if time limit was reached
                 } else if (code !== 0) {
@@ -89,6 +146,7 @@ export async function generateCallGraphForPackage(packagePath: string, callGraph
         // Wait for both promises to resolve
         await Promise.all([stdoutPromise, exitPromise]);
 
+        stats.timeLimitReached = timeLimitReached;
         // If the process exits normally, return 1
         return timeLimitReached ? -1 : 1;
     } catch (error) {
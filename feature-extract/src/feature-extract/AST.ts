@@ -4,18 +4,23 @@ import { parse } from "@babel/core";
 import traverse from "@babel/traverse";
 import { Logger } from "../Logger";
 import { isMemberExpression } from "@babel/types";
-import {
-  base64_Pattern,
-  getDomainPattern,
-  IP_Pattern,
-  SensitiveStringPattern,
-  getDomainsType,
-  byteString_Pattern,
-} from "./Patterns";
+import { getDomainsType } from "./Patterns";
+import { StringLiteralMatcher } from "./StringLiteralMatcher";
 import { getFileLogger } from "../FileLogger";
 import { type PositionRecorder, type Record } from "./PositionRecorder";
+import { type FunctionLocationIndex } from "./FunctionLocationIndex";
 const MAX_STRING_LENGTH = 66875;
 
+/**
+ * Counts of the AST pass over a JavaScript file, for the extraction telemetry
+ */
+export interface FileFeatureStats {
+  astNodes: number;
+  // string literals matched against the rule patterns, and those cleared by the screening alone
+  stringLiterals: number;
+  screenedLiterals: number;
+}
+
 /**
  * Analyze the JavaScript code by AST and extract the feature information.
  * @param code JavaScript code
@@ -23,18 +28,18 @@ const MAX_STRING_LENGTH = 66875;
  * @param isInstallScript whether the JavaScript file name is present in install script
  * @param targetJSFilePath current analyzed file path
  * @param positionRecorder feature position recorder
- * @returns feature information
+ * @param functionIndex the call-graph function locations of the package
+ * @returns the numbers of AST nodes visited and string literals matched
  */
 export async function extractFeaturesFromJSFileByAST(
   code: string,
   isInstallScript: boolean,
   targetJSFilePath: string,
   positionRecorder: PositionRecorder,
-  CallGraphFiles: string[],
-  CallGraphFunctions: { [key: string]: string },
+  functionIndex: FunctionLocationIndex,
   actualPackagePath: string,
   ifCallGraphGenerated: number
-): Promise<void> {
+): Promise<FileFeatureStats> {
   function getRecord(path: any, featureName: string) {
     return {
       filePath: targetJSFilePath,
@@ -44,6 +49,9 @@ export async function extractFeaturesFromJSFileByAST(
     } as Record;
   }
 
+  // the functions of this file, looked up once rather than for every feature
+  const fileFunctions = functionIndex.forFile(path.relative(actualPackagePath, targetJSFilePath));
+
   /**
    * Gets the function number from the call graph for a given node path and file path.
    *
@@ -56,37 +64,13 @@ export async function extractFeaturesFromJSFileByAST(
       return "-1";
     }
 
-    const relativePath = path.relative(actualPackagePath, filePath);
-    const fileIndex = CallGraphFiles.findIndex(
-      (PathinGraph) =>
-        path.normalize(PathinGraph) === path.normalize(relativePath)
-    );
-
-    if (fileIndex === -1) {
+    if (fileFunctions === null) {
       // Logger.error(filePath + 'not found in CallGraph JSON data.');
       return null;
     }
 
-    const startLine = nodePath.node.loc.start.line;
-    const startColumn = nodePath.node.loc.start.column + 1;
-    const endLine = nodePath.node.loc.end.line;
-    const endColumn = nodePath.node.loc.end.column + 1;
-
-    for (const [funcNum, loc] of Object.entries(CallGraphFunctions)) {
-      const [fIndex, sLine, sColumn, eLine, eColumn] = loc
-        .split(":")
-        .map(Number);
-      const isSameFile = fIndex === fileIndex;
-      const isWithinLineRange =
-        startLine > sLine || (startLine === sLine && startColumn >= sColumn);
-      const isWithinEndLineRange =
-        endLine < eLine || (endLine === eLine && endColumn <= eColumn);
-      if (isSameFile && isWithinLineRange && isWithinEndLineRange) {
-        return funcNum;
-      }
-    }
-    // Logger.error('Function not found in CallGraph JSON data in' + filePath);
-    return null;
+    // null if no function contains the node
+    return fileFunctions.findNode(nodePath.node.loc);
   }
 
   const logger = await getFileLogger();
@@ -101,8 +85,13 @@ export async function extractFeaturesFromJSFileByAST(
     await logger.log(`ERROR MESSAGE: ${errorObj.name}: ${errorObj.message}`);
     await logger.log("ERROR STACK:" + errorObj.stack);
   }
+  let astNodes = 0;
+  const matcher = new StringLiteralMatcher(code);
   try {
     traverse(ast, {
+      enter: function () {
+        astNodes++;
+      },
       CallExpression: function (path) {
         // @ts-expect-error uselesss lint error
         if (path.node.callee.name === "require") {
@@ -204,26 +193,16 @@ export async function extractFeaturesFromJSFileByAST(
         if (content.length >= MAX_STRING_LENGTH) {
           return;
         }
+        const matches = matcher.match(content);
         {
-          const matchResult = content.match(IP_Pattern);
-          if (matchResult != null) {
+          if (matches.includeIP) {
             // featureSet.includeIP = true
             positionRecorder.addRecord(getRecord(path, "includeIP"));
           }
         }
+        // includeBase64String is not recorded, so base64_Pattern is not matched
         {
-          const matchResult = content.match(base64_Pattern);
-          if (matchResult != null) {
-            // featureSet.includeBase64String = true
-            // positionRecorder.addRecord(getRecord(path, 'includeBase64String' ))
-            if (isInstallScript) {
-              // featureSet.includeBase64StringInScript = true
-              // positionRecorder.addRecord(getRecord(path, 'includeBase64StringInScript' ))
-            }
-          }
-        }
-        {
-          const matchResult = content.match(getDomainPattern());
+          const matchResult = matches.domains;
           if (matchResult != null) {
             const domainType = getDomainsType(matchResult);
             // if (featureSet.includeDomain < domainType) {
@@ -246,8 +225,7 @@ export async function extractFeaturesFromJSFileByAST(
           }
         }
         {
-          const matchResult = content.match(SensitiveStringPattern);
-          if (matchResult != null) {
+          if (matches.includeSensitiveFiles) {
             // featureSet.includeSensitiveFiles = true
             positionRecorder.addRecord(
               getRecord(path, "includeSensitiveFiles")
@@ -255,8 +233,7 @@ export async function extractFeaturesFromJSFileByAST(
           }
         }
         {
-          const matchResult = code.match(byteString_Pattern);
-          if (matchResult != null) {
+          if (matches.includeByteString) {
             // featureSet.includeByteString = true
             positionRecorder.addRecord(getRecord(path, "includeByteString"));
             // positionRecorder.addRecord({
@@ -378,5 +355,9 @@ export async function extractFeaturesFromJSFileByAST(
   }
 
   // return featureSet
-  return;
+  return {
+    astNodes,
+    stringLiterals: matcher.literals,
+    screenedLiterals: matcher.screened,
+  };
 }
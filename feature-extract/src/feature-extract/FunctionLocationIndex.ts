@@ -0,0 +1,174 @@
+import path from "path";
+
+// positions are compared as line * POSITION_BASE + column; analyzed files are at most 1 MB, so columns stay below it
+const POSITION_BASE = 1e9;
+
+export interface SourceLocation {
+  start: { line: number; column: number };
+  end: { line: number; column: number };
+}
+
+/**
+ * The call-graph functions of one file as a forest of nested intervals, sorted by start.
+ * Functions in JavaScript source never partially overlap, so the functions containing a
+ * node form a chain of ancestors of the last function starting at or before it
+ */
+export class FileFunctionIndex {
+  private readonly starts: Float64Array;
+  private readonly ends: Float64Array;
+  // up[k][i]: the 2^k-th ancestor of function i, or -1
+  private readonly up: Int32Array[];
+  // the function of i and its ancestors that comes first in the call graph
+  private readonly firstInChain: Int32Array;
+  private readonly funcNums: string[];
+
+  /**
+   * @param functions [function number, position in the call graph, start, end] of every function of the file,
+   * positions being encoded by encodePosition
+   */
+  constructor(functions: Array<[string, number, number, number]>) {
+    functions.sort((a, b) => a[2] - b[2] || b[3] - a[3] || a[1] - b[1]);
+    const count = functions.length;
+    this.starts = new Float64Array(count);
+    this.ends = new Float64Array(count);
+    this.funcNums = functions.map(([funcNum]) => funcNum);
+    const parents = new Int32Array(count);
+    this.firstInChain = new Int32Array(count);
+    const order = new Int32Array(count);
+    const stack: number[] = [];
+    for (let i = 0; i < count; i++) {
+      const [, position, start, end] = functions[i];
+      this.starts[i] = start;
+      this.ends[i] = end;
+      order[i] = position;
+      while (stack.length > 0 && this.ends[stack[stack.length - 1]] < end) {
+        stack.pop();
+      }
+      const parent = stack.length > 0 ? stack[stack.length - 1] : -1;
+      parents[i] = parent;
+      this.firstInChain[i] =
+        parent !== -1 && order[this.firstInChain[parent]] < position ? this.firstInChain[parent] : i;
+      stack.push(i);
+    }
+    this.up = [parents];
+    for (let k = 1; 1 << k < count; k++) {
+      const previous = this.up[k - 1];
+      const next = new Int32Array(count);
+      for (let i = 0; i < count; i++) {
+        next[i] = previous[i] === -1 ? -1 : previous[previous[i]];
+      }
+      this.up.push(next);
+    }
+  }
+
+  /**
+   * Find the function containing the range [start, end] that comes first in the call graph, the
+   * same function the former linear scan over the call-graph functions returned. Jelly numbers
+   * the functions in source order, so this is the outermost one
+   * @returns the function number, or null if no function contains the range
+   */
+  find(start: number, end: number): string | null {
+    // last function starting at or before start
+    let low = 0;
+    let high = this.starts.length;
+    while (low < high) {
+      const middle = (low + high) >> 1;
+      if (this.starts[middle] <= start) {
+        low = middle + 1;
+      } else {
+        high = middle;
+      }
+    }
+    let current = low - 1;
+    if (current === -1) {
+      return null;
+    }
+    // the ends grow along the chain of ancestors: jump to the innermost one ending at or after end
+    if (this.ends[current] < end) {
+      for (let k = this.up.length - 1; k >= 0; k--) {
+        const ancestor = this.up[k][current];
+        if (ancestor !== -1 && this.ends[ancestor] < end) {
+          current = ancestor;
+        }
+      }
+      current = this.up[0][current];
+      if (current === -1) {
+        return null;
+      }
+    }
+    return this.funcNums[this.firstInChain[current]];
+  }
+
+  /**
+   * Find the function of a node like find
+   * @param loc the babel location of the node, with 0-based columns
+   */
+  findNode(loc: SourceLocation): string | null {
+    return this.find(
+      encodePosition(loc.start.line, loc.start.column + 1),
+      encodePosition(loc.end.line, loc.end.column + 1)
+    );
+  }
+}
+
+/**
+ * Encode a 1-based line and column as a number ordered like the positions
+ */
+export function encodePosition(line: number, column: number) {
+  return line * POSITION_BASE + column;
+}
+
+/**
+ * Index of the call-graph function locations of a package, parsed once instead of at every
+ * recorded feature: maps a file to its FileFunctionIndex
+ */
+export class FunctionLocationIndex {
+  private readonly fileIndexes = new Map<number, FileFunctionIndex>();
+  private readonly fileNumbers = new Map<string, number>();
+
+  /**
+   * @param CallGraphFiles the files of the call graph, whose positions the function locations refer to
+   * @param CallGraphFunctions function number -> "file:startLine:startColumn:endLine:endColumn"
+   */
+  constructor(CallGraphFiles: string[], CallGraphFunctions: { [key: string]: string }) {
+    CallGraphFiles.forEach((file, index) => {
+      const normalized = path.normalize(file);
+      if (!this.fileNumbers.has(normalized)) {
+        this.fileNumbers.set(normalized, index);
+      }
+    });
+    const functionsByFile = new Map<number, Array<[string, number, number, number]>>();
+    let position = 0;
+    for (const [funcNum, loc] of Object.entries(CallGraphFunctions)) {
+      const numbers = loc.split(":").map(Number);
+      const [fIndex, sLine, sColumn, eLine, eColumn] = numbers;
+      position++;
+      if (numbers.length < 5 || numbers.some(isNaN)) {
+        // a malformed location never contains a node
+        continue;
+      }
+      let functions = functionsByFile.get(fIndex);
+      if (!functions) {
+        functions = [];
+        functionsByFile.set(fIndex, functions);
+      }
+      functions.push([funcNum, position, encodePosition(sLine, sColumn), encodePosition(eLine, eColumn)]);
+    }
+    for (const [fIndex, functions] of functionsByFile) {
+      this.fileIndexes.set(fIndex, new FileFunctionIndex(functions));
+    }
+  }
+
+  /**
+   * Get the function index of a file
+   * @param relativePath the path of the file relative to the package
+   * @returns the index, or null if the file is not in the call graph
+   */
+  forFile(relativePath: string): FileFunctionIndex | null {
+    const fileIndex = this.fileNumbers.get(path.normalize(relativePath));
+    if (fileIndex === undefined) {
+      return null;
+    }
+    return this.fileIndexes.get(fileIndex) || new FileFunctionIndex([]);
+  }
+}
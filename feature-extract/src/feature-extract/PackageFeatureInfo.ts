@@ -11,15 +11,30 @@ import {
 import { getAllJSFilesInInstallScript } from "./GetInstallScripts";
 import { extractFeaturesFromJSFileByAST } from "./AST";
 import { PositionRecorder } from "./PositionRecorder";
+import { FunctionLocationIndex } from "./FunctionLocationIndex";
 import { setPositionRecorder } from "../config";
 import { Logger } from "../Logger";
 
 // <= 2 MB
 const ALLOWED_MAX_JS_SIZE = 1* 1024 * 1024;
 
+/**
+ * Counts of the JavaScript files analyzed by getPackageFeatureInfo, for the extraction telemetry
+ */
+export interface FeatureExtractionStats {
+  jsFiles: number;
+  // files over ALLOWED_MAX_JS_SIZE, which are not analyzed
+  skippedJsFiles: number;
+  astNodes: number;
+  // string literals matched against the rule patterns, and those cleared by the screening alone
+  stringLiterals: number;
+  screenedLiterals: number;
+}
+
 /**
  * Extract features from the npm package
  * @param packagePath the directory of the npm package, where there should be a package.json file
+ * @returns the counts of the analyzed JavaScript files, AST nodes and string literals
  */
 export async function getPackageFeatureInfo(
   packagePath: string,
@@ -27,8 +42,9 @@ export async function getPackageFeatureInfo(
   CallGraphFunctions: { [key: string]: string },
   actualPackagePath: string,
   ifCallGraphGenerated: number
-): Promise<void> {
+): Promise<FeatureExtractionStats> {
   const positionRecorder = new PositionRecorder();
+  const stats: FeatureExtractionStats = { jsFiles: 0, skippedJsFiles: 0, astNodes: 0, stringLiterals: 0, screenedLiterals: 0 };
   const result: PackageJSONInfo = {
     dependencyNumber: 0,
     devDependencyNumber: 0,
@@ -121,6 +137,9 @@ export async function getPackageFeatureInfo(
   // analyze JavaScript files in the install script
   await getAllJSFilesInInstallScript(result.executeJSFiles);
 
+  // parse the call-graph function locations once for all files
+  const functionIndex = new FunctionLocationIndex(CallGraphFiles, CallGraphFunctions);
+
   async function traverseDir(baseDirPath: string, callGraphFiles: string[]) {
     for (const file of callGraphFiles) {
       const targetJSFilePath = path.join(baseDirPath, file);
@@ -133,17 +152,22 @@ export async function getPackageFeatureInfo(
       if (fileInfo.size <= ALLOWED_MAX_JS_SIZE) {
         const jsFileContent = await promises.readFile(targetJSFilePath, { encoding: "utf-8" });
         // console.log(`2222222222Extracting features from file: ${targetJSFilePath}`);
-        await extractFeaturesFromJSFileByAST(
+        stats.jsFiles++;
+        const fileStats = await extractFeaturesFromJSFileByAST(
           jsFileContent,
           isInstallScriptFile,
           targetJSFilePath,
           positionRecorder,
-          CallGraphFiles,
-          CallGraphFunctions,
+          functionIndex,
           actualPackagePath,
           ifCallGraphGenerated
         );
+        stats.astNodes += fileStats.astNodes;
+        stats.stringLiterals += fileStats.stringLiterals;
+        stats.screenedLiterals += fileStats.screenedLiterals;
         // console.log('33333333Completed AST for '+ targetJSFilePath);
+      } else {
+        stats.skippedJsFiles++;
       }
     }
     // console.log('Completed traverseDir11111111111111111111111111111111111111111111');
@@ -152,5 +176,5 @@ export async function getPackageFeatureInfo(
   // Call the traverseDir function and handle the rest of the logic
   await traverseDir(actualPackagePath, CallGraphFiles);
   setPositionRecorder(positionRecorder);
-  return;
+  return stats;
 }
@@ -36,13 +36,18 @@ export const Network_Command_Pattern = /(curl)|(wget)|(host)|(ping)|(\/dev\/tcp)
 
 export const SensitiveStringPattern = /(\/etc\/shadow)|(\.bashrc)|(.zshrc)|(\/etc\/hosts)|(\/etc\/passwd)|(\/bin\/sh)/
 
+// the domain lists as sets, so classifying a domain is a lookup rather than a scan of every list
+const white_domains = new Set<string>(domainList.white_domain_list)
+const black_domains = new Set<string>(domainList.black_domain_list)
+const common_domains = new Set<string>(domainList.common_domain_list)
+
 export function getDomainType(domain: string) {
   domain = domain.substring(domain.indexOf('://') + 3)
-  if(domainList.white_domain_list.includes(domain)) {
+  if(white_domains.has(domain)) {
     return 1
-  } else if (domainList.black_domain_list.includes(domain)) {
+  } else if (black_domains.has(domain)) {
     return 4
-  } else if (domainList.common_domain_list.includes(domain)) {
+  } else if (common_domains.has(domain)) {
     return 2
   } else {
     return 3
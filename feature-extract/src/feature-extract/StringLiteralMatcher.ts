@@ -0,0 +1,115 @@
+import topDomains from './top-domains.json'
+import { IP_Pattern, byteString_Pattern, getDomainPattern, SensitiveStringPattern } from './Patterns'
+
+export interface StringLiteralMatches {
+  includeIP: boolean;
+  // the match of getDomainPattern(), or null
+  domains: RegExpMatchArray | null;
+  includeSensitiveFiles: boolean;
+  includeByteString: boolean;
+}
+
+interface TrieNode {
+  end: boolean;
+  next: Map<number, TrieNode>;
+}
+
+let tld_trie: TrieNode
+
+// the top-level domains of getDomainPattern() as a trie of their character codes, built once
+function getTLDTrie () {
+  if (tld_trie) {
+    return tld_trie
+  }
+  tld_trie = { end: false, next: new Map() }
+  for (const tld of topDomains['most-used-tlds']) {
+    let node = tld_trie
+    for (const char of tld.substring(1)) {
+      const code = char.charCodeAt(0)
+      let child = node.next.get(code)
+      if (!child) {
+        child = { end: false, next: new Map() }
+        node.next.set(code, child)
+      }
+      node = child
+    }
+    node.end = true
+  }
+  return tld_trie
+}
+
+// [a-zA-Z0-9-], the characters of a domain label in getDomainPattern()
+function isLabelChar (code: number) {
+  return (code >= 97 && code <= 122) || (code >= 65 && code <= 90) || (code >= 48 && code <= 57) || code === 45
+}
+
+/**
+ * Whether getDomainPattern() matches the string, without running it: the pattern matches exactly
+ * when a dot preceded by a label character is followed by one of the top-level domains, which is
+ * unanchored at its end
+ */
+export function containsDomain (content: string) {
+  const trie = getTLDTrie()
+  for (let dot = content.indexOf('.'); dot !== -1; dot = content.indexOf('.', dot + 1)) {
+    if (dot === 0 || !isLabelChar(content.charCodeAt(dot - 1))) {
+      continue
+    }
+    let node: TrieNode | undefined = trie
+    for (let i = dot + 1; node && !node.end; i++) {
+      node = i < content.length ? node.next.get(content.charCodeAt(i)) : undefined
+    }
+    if (node) {
+      return true
+    }
+  }
+  return false
+}
+
+/**
+ * Matches the string literals of one JavaScript file against the rule patterns of the AST pass.
+ * A literal is screened first: the IP and domain patterns need a dot and the sensitive file
+ * pattern a slash or "shrc", so most literals of a bundle never reach a regular expression, and
+ * the domain pattern only runs to report the domain once the TLD trie found one.
+ * byteString_Pattern is matched against the whole file, so it runs once per file
+ */
+export class StringLiteralMatcher {
+  // literals matched
+  literals = 0
+  // literals the screening cleared without running any pattern
+  screened = 0
+  private includesByteString: boolean | null = null
+
+  /**
+   * @param code the JavaScript code of the file
+   */
+  constructor (private readonly code: string) {}
+
+  match (content: string): StringLiteralMatches {
+    this.literals++
+    if (this.includesByteString === null) {
+      this.includesByteString = byteString_Pattern.test(this.code)
+    }
+    const matches: StringLiteralMatches = {
+      includeIP: false,
+      domains: null,
+      includeSensitiveFiles: false,
+      includeByteString: this.includesByteString
+    }
+    const hasDot = content.includes('.')
+    const mayBeSensitive = content.includes('/') || content.includes('shrc')
+    if (!hasDot && !mayBeSensitive) {
+      this.screened++
+      return matches
+    }
+    if (hasDot) {
+      matches.includeIP = content.match(IP_Pattern) != null
+      if (containsDomain(content)) {
+        matches.domains = content.match(getDomainPattern())
+      }
+    }
+    if (mayBeSensitive) {
+      matches.includeSensitiveFiles = SensitiveStringPattern.test(content)
+    }
+    return matches
+  }
+}
@@ -4,7 +4,7 @@ import { getPackageFeatureInfo } from './PackageFeatureInfo'
 /**
  * Extract features from the npm package and save the features to the feature file
  * @param packagePath the directory of the npm package, where there should be a package.json file
- * @returns the path of the feature file and feature information
+ * @returns the counts of the analyzed JavaScript files, AST nodes and string literals
  */
 export async function extractFeatureFromPackage(packagePath: string, CallGraphFilePath: string, actualPackagePath: string, ifCallGraphGenerated: number) {
   let CallGraphFiles: string[] = []
@@ -31,6 +31,5 @@ export async function extractFeatureFromPackage(packagePath: string, CallGraphFi
   if (ifCallGraphGenerated === -1) {
     const n = 1 + 1
   }
-  await getPackageFeatureInfo(packagePath, CallGraphFiles, CallGraphFunctions, actualPackagePath, ifCallGraphGenerated)
-  return
+  return await getPackageFeatureInfo(packagePath, CallGraphFiles, CallGraphFunctions, actualPackagePath, ifCallGraphGenerated)
 }
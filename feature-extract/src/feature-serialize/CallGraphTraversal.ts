@@ -0,0 +1,136 @@
+export interface CallQueueMap {
+  [fileName: string]: string[]; // Maps file name to a list of function call indices
+}
+
+export interface JellyCallGraph {
+  files?: string[];
+  functions?: { [funcNum: string]: string };
+  fun2fun?: [number, number][];
+  entries?: string[];
+}
+
+// a node already on the path is visited again only within this many calls of its first visit
+const CYCLE_DISTANCE = 3;
+
+/**
+ * Depth-first traversal of a call graph over an adjacency index built once per package. The
+ * path is a shared stack whose nodes are tracked in a map to their first position, so the
+ * cycle check is a lookup rather than a scan of the path.
+ *
+ * While the depth limit is at most CYCLE_DISTANCE the cycle check can never cut a path short,
+ * so the sequence below a node only depends on the node and its depth and is memoized
+ */
+class CallGraphTraversal {
+  private readonly adjacency = new Map<number, number[]>();
+  // first position of every node on the current path
+  private readonly pathPositions = new Map<number, number>();
+  private pathLength = 0;
+  // memo[depth]: node -> sequence of the subtree below the node at that depth
+  private readonly memo: Map<number, string[]>[] | null;
+
+  constructor(fun2fun: [number, number][], private readonly depthLimit: number) {
+    // the callees keep the order and the duplicates of the edge list
+    for (const [caller, callee] of fun2fun) {
+      let callees = this.adjacency.get(caller);
+      if (!callees) {
+        callees = [];
+        this.adjacency.set(caller, callees);
+      }
+      callees.push(callee);
+    }
+    this.memo = depthLimit <= CYCLE_DISTANCE ? Array.from({ length: depthLimit + 1 }, () => new Map<number, string[]>()) : null;
+  }
+
+  /**
+   * Append the sequence of function calls from nodeIndex to sequence
+   * @returns whether nodeIndex was visited
+   */
+  visit(nodeIndex: number, sequence: string[]): boolean {
+    const depth = this.pathLength;
+    if (depth > this.depthLimit) {
+      return false;
+    }
+    const firstPosition = this.pathPositions.get(nodeIndex);
+    if (firstPosition !== undefined && depth - firstPosition > CYCLE_DISTANCE) {
+      return false;
+    }
+    // the subtrees of the entry functions (depth 0) and the leaves are not worth keeping
+    const memo = this.memo && depth > 0 && depth < this.depthLimit ? this.memo[depth] : null;
+    const cached = memo && memo.get(nodeIndex);
+    if (cached) {
+      for (const funcNum of cached) {
+        sequence.push(funcNum);
+      }
+      return true;
+    }
+
+    const start = sequence.length;
+    sequence.push(nodeIndex.toString());
+    if (firstPosition === undefined) {
+      this.pathPositions.set(nodeIndex, depth);
+    }
+    this.pathLength++;
+    for (const callee of this.adjacency.get(nodeIndex) || []) {
+      this.visit(callee, sequence);
+    }
+    this.pathLength--;
+    if (firstPosition === undefined) {
+      this.pathPositions.delete(nodeIndex);
+    }
+    if (memo) {
+      memo.set(nodeIndex, sequence.slice(start));
+    }
+    return true;
+  }
+}
+
+/**
+ * Traverse a jelly call graph from the functions of every entry file, in the order of the
+ * former per-node scan of the whole edge list: the functions of an entry in reverse order of
+ * the call graph, their callees in edge list order
+ *
+ * @param callGraph The parsed jelly call graph.
+ * @param depthLimit The number of calls followed from an entry function.
+ * @returns The sequence of function calls of every entry file.
+ */
+export function traverseCallGraph(callGraph: JellyCallGraph, depthLimit: number): CallQueueMap {
+  const { files: CallGraphFiles = [], functions: CallGraphFunctions = {}, fun2fun: CallGraphFun2Fun = [], entries: CallGraphEntries = [] } = callGraph;
+  const callQueueMap: CallQueueMap = {};
+  const traversal = new CallGraphTraversal(CallGraphFun2Fun, depthLimit);
+
+  const fileIndexes = new Map<string, number>();
+  CallGraphFiles.forEach((file, index) => {
+    if (!fileIndexes.has(file)) {
+      fileIndexes.set(file, index);
+    }
+  });
+  // the functions whose location starts with each prefix of their file index, as matched by
+  // startsWith: the functions of file 1 also include those of files 10-19, 100-199...
+  const functionsByPrefix = new Map<string, number[]>();
+  for (const func of Object.keys(CallGraphFunctions).reverse()) {
+    const location = CallGraphFunctions[func];
+    const fileIndex = location.slice(0, location.indexOf(':') === -1 ? location.length : location.indexOf(':'));
+    for (let length = 1; length <= fileIndex.length; length++) {
+      const prefix = fileIndex.slice(0, length);
+      let functions = functionsByPrefix.get(prefix);
+      if (!functions) {
+        functions = [];
+        functionsByPrefix.set(prefix, functions);
+      }
+      functions.push(parseInt(func));
+    }
+  }
+
+  CallGraphEntries.forEach(entry => {
+    const startNodeIndex = fileIndexes.get(entry);
+    if (startNodeIndex !== undefined) {
+      const sequence = callQueueMap[entry] || [];
+      for (const func of functionsByPrefix.get(startNodeIndex.toString()) || []) {
+        if (traversal.visit(func, sequence)) {
+          callQueueMap[entry] = sequence;
+        }
+      }
+    }
+  });
+  return callQueueMap;
+}
@@ -1,7 +1,8 @@
 import { accessSync, constants, writeFileSync } from 'fs'
 import { Worker, isMainThread, parentPort, workerData } from 'worker_threads'
 import { Logger } from './Logger'
-import { analyzeSinglePackage, analyzePackages, analyzePackagesMaster, analyzePackagesWorker } from './programs/AnalyzePackage/PackageAnalyzer'
+import { analyzeSinglePackage, analyzePackages, analyzePackagesMaster, analyzePackagesWorker, analyzePackagesFromStdin } from './programs/AnalyzePackage/PackageAnalyzer'
+import { closeCallGraphWorkerPool } from './call-graph/CallGraphWorkerPool'
 
 function showUsage() {
   Logger.info(
@@ -10,7 +11,9 @@ function showUsage() {
 \t$package_dir_path is absolute path to the parent directory of the npm package which should have a file named package.json.
 \t$call_graph_dir_path is absolute path to the parent directory of the call graph files.
 \t$feature_pos_dir_path is absolute path to the parent directory of the feature position files.
-\t$sequential_feature_dir_path is absolute path to the parent directory of the sequential feature files. `
+\t$sequential_feature_dir_path is absolute path to the parent directory of the sequential feature files.
+node main.js -q $call_graph_dir_path $feature_pos_dir_path $sequential_feature_dir_path
+\treads package paths from stdin, one per line, and writes the result of each as one JSON line to stdout. `
   )
 }
 export const callgraphRoundLimit = 5
@@ -48,9 +51,19 @@ async function main() {
       Logger.error(`Stack: ${(error as Error).stack}`)
     }
   }
+  else if (process.argv.length === 6 && process.argv[2] === '-q') {
+    try {
+      await analyzePackagesFromStdin(process.argv[4], process.argv[3], process.argv[5])
+    } catch (error) {
+      Logger.error(`Error: ${(error as Error).message}`)
+      Logger.error(`Stack: ${(error as Error).stack}`)
+    }
+  }
   else {
     showUsage()
   }
+  // the jelly servers of the call graph worker pool would keep the process alive
+  await closeCallGraphWorkerPool()
 }
 
 if (isMainThread) {
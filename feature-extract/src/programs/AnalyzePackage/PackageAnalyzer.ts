@@ -1,79 +1,197 @@
 import path from 'path'
-import fs from 'fs'
 import promises from 'fs/promises'
 import { Worker, parentPort, workerData } from 'worker_threads'
 import { extractFeatureFromPackage } from '../../feature-extract'
-import { generateCallGraphForPackage } from '../../call-graph/generateCallGraph'
+import { CallGraphRunStats, generateCallGraphForPackage } from '../../call-graph/generateCallGraph'
+import { closeCallGraphWorkerPool, getCallGraphPoolConfig } from '../../call-graph/CallGraphWorkerPool'
 import { serializeFeatures } from '../../feature-serialize/SerializeFeatures'
 import { getErrorInfo, getPackageFromDir } from '../../util'
 import { getConfig } from '../../config'
 import { Logger } from '../../Logger'
+import { CacheKeys, getExtractionCache } from '../../cache/ExtractionCache'
+import { PeakRssMonitor, getCallGraphSize, getPackageSize, isTelemetryEnabled, recordTelemetry } from '../../Telemetry'
 import { readdirSync } from 'fs'
+import os from 'os'
+import readline from 'readline'
 
+type StageTimings = { [stage: string]: number }
+type StageTelemetry = { [metric: string]: number | boolean | string | null }
+export type PackageStatus = 'extracted' | 'cached' | 'skipped' | 'empty' | 'failed'
+
+function elapsedMs(start: [number, number]) {
+  const [seconds, nanoseconds] = process.hrtime(start)
+  return seconds * 1000 + nanoseconds / 1000000
+}
 
 /**
  * Extract the features of a single npm package
+ *
+ * With EXTRACTION_CACHE_DIR set, every stage is restored from the extraction cache when the package
+ * content and the stage configuration are unchanged, and computed and stored otherwise.
+ * With STAGE_TIMINGS_FILE set, a telemetry record of the package is appended to that file: the wall
+ * time of every stage at the top level (callGraphMs, featureExtractionMs, serializationMs, totalMs,
+ * and failedStage if a stage failed), the package file count and size, and per stage its peak RSS,
+ * cache result and sizes (call graph files, functions and edges and whether jelly hit its time limit,
+ * analyzed JavaScript files, AST nodes and string literals, features and sequence length)
  * @param packagePath the absolute path to npm package
  * @param featurePosDirPath the absolute directory path to save feature position files
- * @returns the result of extracting features
+ * @returns 'extracted', 'cached' if every stage was restored from the extraction cache, 'skipped' if the
+ * features already exist and there is no cache, 'empty' if there is no package.json, or 'failed'
  */
 export async function analyzeSinglePackage(
   packagePath: string,
   featurePosDirPath: string,
   CallGraphDirPath: string,
-  SequentialFeatureDirPath: string) {
+  SequentialFeatureDirPath: string): Promise<PackageStatus> {
   const packageName = path.basename(packagePath)
   const actualPackagePath = await getPackageFromDir(packagePath)
   if (!actualPackagePath) {
     Logger.warn("Package " + packageName + " is empty or without package.json");
-    return null;
+    return 'empty';
   }
   const startTime = process.hrtime(); // 记录程序开始时间
+  const stageTimings: StageTimings = {}
+  const telemetry = isTelemetryEnabled()
+  const stages: { [stage: string]: StageTelemetry } = { callGraph: {}, featureExtraction: {}, serialization: {} }
 
-  // temp修改
-  const resultFilePath1 = path.join(SequentialFeatureDirPath, `${packageName}_rst.json`);
-  try {
-    await promises.access(resultFilePath1);
-    // Logger.info(`${packageName} already analyzed. Skipping analysis.`);
-    return;
-  } catch {
+  const cache = getExtractionCache()
+  let cacheKeys: CacheKeys | null = null
+  const cacheStages: { [stage: string]: 'hit' | 'miss' } = {}
+  if (cache) {
+    // the cache notices changed packages, so packages are not skipped by name
+    try {
+      cacheKeys = await cache.getKeys(packagePath)
+    } catch (error) {
+      Logger.error(getErrorInfo(error))
+    }
+  } else {
+    // temp修改
+    const resultFilePath1 = path.join(SequentialFeatureDirPath, `${packageName}_rst.json`);
+    try {
+      await promises.access(resultFilePath1);
+      // Logger.info(`${packageName} already analyzed. Skipping analysis.`);
+      return 'skipped';
+    } catch {
+    }
+  }
+  const finish = async (failedStage?: string) => {
+    if (cache && cacheKeys) {
+      cache.recordEvent(packageName, cacheKeys, cacheStages, failedStage)
+    }
+    if (telemetry) {
+      for (const [stage, result] of Object.entries(cacheStages)) {
+        stages[stage].cache = result
+      }
+      const packageSize = await getPackageSize(actualPackagePath).catch(() => ({ files: null, bytes: null }))
+      recordTelemetry({
+        package: packageName,
+        ...stageTimings,
+        ...(failedStage ? { failedStage } : {}),
+        time: Date.now(),
+        packageFiles: packageSize.files,
+        packageBytes: packageSize.bytes,
+        stages
+      })
+    }
   }
 
   //generate call graph
   const CallGraphFilePath = path.join(CallGraphDirPath, `${packageName}_cg.json`)
   let ifCallGraphGenerated = -1
+  // the later stages depend on the call graph, so they are only cached along with it
+  let cacheLaterStages = true
+  let stageStart = process.hrtime()
   try {
-    ifCallGraphGenerated = await generateCallGraphForPackage(actualPackagePath, CallGraphFilePath)
+    const cached = cacheKeys ? await cache!.restoreCallGraph(cacheKeys.keys.callGraph, CallGraphFilePath, packagePath) : null
+    if (cached !== null) {
+      ifCallGraphGenerated = cached
+      cacheStages.callGraph = 'hit'
+    } else {
+      const runStats: CallGraphRunStats = {}
+      ifCallGraphGenerated = await generateCallGraphForPackage(actualPackagePath, CallGraphFilePath, runStats)
+      Object.assign(stages.callGraph, runStats)
+      if (cacheKeys) {
+        cacheLaterStages = await cache!.storeCallGraph(cacheKeys.keys.callGraph, CallGraphFilePath, packagePath, ifCallGraphGenerated, runStats)
+        cacheStages.callGraph = 'miss'
+      }
+    }
+    stages.callGraph.generated = ifCallGraphGenerated === 1
     Logger.info(`Finished generating call graphs of ${packageName}, recorded at ${CallGraphFilePath}`)
   } catch (error) {
     Logger.error(getErrorInfo(error))
-    return null
+    stageTimings.callGraphMs = elapsedMs(stageStart)
+    await finish('callGraph')
+    return 'failed'
+  }
+  stageTimings.callGraphMs = elapsedMs(stageStart)
+  if (telemetry) {
+    Object.assign(stages.callGraph, await getCallGraphSize(CallGraphFilePath))
   }
 
   //extract feature
   const featurePosPath = path.join(featurePosDirPath, `${packageName}_fp.json`)
+  stageStart = process.hrtime()
+  let rssMonitor = telemetry ? new PeakRssMonitor() : null
   try {
-    await extractFeatureFromPackage(packagePath, CallGraphFilePath, actualPackagePath, ifCallGraphGenerated)
+    if (cacheKeys && cacheLaterStages && await cache!.restoreFile(cacheKeys.keys.featureExtraction, 'fp.json', featurePosPath, packagePath)) {
+      cacheStages.featureExtraction = 'hit'
+    } else {
+      Object.assign(stages.featureExtraction, await extractFeatureFromPackage(packagePath, CallGraphFilePath, actualPackagePath, ifCallGraphGenerated))
+      const positionRecorder = getConfig().positionRecorder!
+      stages.featureExtraction.features = positionRecorder.featurePosSet.reduce(
+        (count, file) => count + file.functions.reduce((fileCount, func) => fileCount + func.features.length, 0), 0)
+      await promises.writeFile(featurePosPath, positionRecorder.serializeRecord())
+      if (cacheKeys) {
+        if (cacheLaterStages) {
+          await cache!.storeFile(cacheKeys.keys.featureExtraction, 'fp.json', featurePosPath, packagePath)
+        }
+        cacheStages.featureExtraction = 'miss'
+      }
+    }
     Logger.info(`Finished extracting features of ${packageName}, recorded at ${featurePosPath}`)
-    await promises.writeFile(featurePosPath, getConfig().positionRecorder!.serializeRecord())
   } catch (error) {
     Logger.error(getErrorInfo(error))
-    return null
+    stageTimings.featureExtractionMs = elapsedMs(stageStart)
+    stages.featureExtraction.peakRssBytes = rssMonitor && rssMonitor.stop()
+    await finish('featureExtraction')
+    return 'failed'
   }
+  stageTimings.featureExtractionMs = elapsedMs(stageStart)
+  stages.featureExtraction.peakRssBytes = rssMonitor && rssMonitor.stop()
 
   //serialize features
   const resultFilePath = path.join(SequentialFeatureDirPath, `${packageName}_rst.json`)
+  stageStart = process.hrtime()
+  rssMonitor = telemetry ? new PeakRssMonitor() : null
   try {
-    await serializeFeatures(featurePosPath, CallGraphFilePath, resultFilePath, ifCallGraphGenerated)
+    if (cacheKeys && cacheLaterStages && await cache!.restoreFile(cacheKeys.keys.serialization, 'rst.json', resultFilePath, packagePath)) {
+      cacheStages.serialization = 'hit'
+    } else {
+      const sequence = await serializeFeatures(featurePosPath, CallGraphFilePath, resultFilePath, ifCallGraphGenerated)
+      stages.serialization.sequenceLength = sequence.length
+      if (cacheKeys) {
+        if (cacheLaterStages) {
+          await cache!.storeFile(cacheKeys.keys.serialization, 'rst.json', resultFilePath, packagePath)
+        }
+        cacheStages.serialization = 'miss'
+      }
+    }
     Logger.info(`${packageName} finished, recorded at ${resultFilePath}`)
   } catch (error) {
     Logger.error(getErrorInfo(error))
-    return null
+    stageTimings.serializationMs = elapsedMs(stageStart)
+    stages.serialization.peakRssBytes = rssMonitor && rssMonitor.stop()
+    await finish('serialization')
+    return 'failed'
   }
+  stageTimings.serializationMs = elapsedMs(stageStart)
+  stages.serialization.peakRssBytes = rssMonitor && rssMonitor.stop()
 
   const endTime = process.hrtime(startTime);
   Logger.info(`Execution time: ${endTime[0]}s ${endTime[1] / 1000000}ms`);
-
+  stageTimings.totalMs = elapsedMs(startTime)
+  await finish()
+  return cacheKeys && Object.values(cacheStages).every(result => result === 'hit') ? 'cached' : 'extracted'
 }
 
 /**
@@ -95,27 +213,34 @@ export async function analyzePackages(packageDirPath: string, featurePosDirPath:
   return packagesPath
 }
 
+/**
+ * Extract the features of the packages with worker threads pulling them from a shared queue,
+ * so a worker that draws large packages does not hold up the others
+ * @param packagesPath the absolute paths to the npm packages
+ */
 export async function analyzePackagesMaster(packagesPath: string[], featurePosDirPath: string, CallGraphDirPath: string, SequentialFeatureDirPath: string) {
-  // const workersCount = os.cpus().length
-  // FIXME: use 8 workers for now because of the memory limit, or the program will be killed
-  const workersCount = 8
-  const workload = Math.ceil(packagesPath.length / workersCount)
-  const workers: Worker[] = []
+  // every worker has a call graph worker pool of its own, so by default as many workers run as
+  // there is memory for their pools' budgets.
+  // FIXME: without a pool, use 8 workers by default because of the memory limit of the jelly
+  // commands, or the program will be killed;
+  // extract.py schedules the packages itself and sizes its worker count by the available memory
+  const poolConfig = getCallGraphPoolConfig()
+  const defaultWorkersCount = poolConfig ? Math.floor(os.totalmem() / 1024 / 1024 / poolConfig.memoryBudgetMb) : 8
+  const workersCount = Math.max(1, Math.min(Number(process.env.EXTRACT_WORKERS) || defaultWorkersCount, os.cpus().length, packagesPath.length))
+  let next = 0
   for (let i = 0; i < workersCount; i++) {
-    const start = i * workload
-    const end = start + workload
     const worker = new Worker(__filename, {
       workerData: {
         workerId: i,
-        packagesPath: packagesPath.slice(start, end),
         featurePosDirPath,
         CallGraphDirPath,
         SequentialFeatureDirPath
       }
     })
-    workers.push(worker)
-  }
-  for (const worker of workers) {
+    // every 'ready' message of a worker is answered with the next package, or null when the queue is empty
+    worker.on('message', () => {
+      worker.postMessage(next < packagesPath.length ? packagesPath[next++] : null)
+    })
     worker.on('exit', (exitCode: number) => {
       Logger.info(`Worker stopped with exit code ${exitCode}`)
     })
@@ -123,13 +248,44 @@ export async function analyzePackagesMaster(packagesPath: string[], featurePosDi
 }
 
 export async function analyzePackagesWorker() {
-  const { workerId, packagesPath, featurePosDirPath, CallGraphDirPath, SequentialFeatureDirPath } = workerData
+  const { workerId, featurePosDirPath, CallGraphDirPath, SequentialFeatureDirPath } = workerData
   // Logger.info(`Worker ${workerId} started`)
-  for (const packagePath of packagesPath) {
+  const nextPackage = () => new Promise<string | null>((resolve) => {
+    parentPort!.once('message', resolve)
+    parentPort!.postMessage('ready')
+  })
+  for (let packagePath = await nextPackage(); packagePath !== null; packagePath = await nextPackage()) {
     await analyzeSinglePackage(packagePath, featurePosDirPath, CallGraphDirPath, SequentialFeatureDirPath)
   }
+  await closeCallGraphWorkerPool()
   Logger.info(`Worker ${workerId} finished`)
-  if (parentPort) {
-    parentPort.postMessage(`Worker ${workerId} finished`)
+  parentPort!.close()
+}
+
+/**
+ * Extract the features of the packages whose paths are written to stdin, one per line and one
+ * at a time, and write the result of each as one JSON line to stdout. The extraction
+ * orchestrator of extract.py runs several of these processes and feeds them from its queue
+ */
+export async function analyzePackagesFromStdin(featurePosDirPath: string, CallGraphDirPath: string, SequentialFeatureDirPath: string) {
+  for (const dirPath of [featurePosDirPath, CallGraphDirPath, SequentialFeatureDirPath]) {
+    await promises.mkdir(dirPath, { recursive: true })
   }
-}
\ No newline at end of file
+  const lines = readline.createInterface({ input: process.stdin, crlfDelay: Infinity })
+  for await (const line of lines) {
+    const packagePath = line.trim()
+    if (!packagePath) {
+      continue
+    }
+    const startTime = process.hrtime()
+    let status: PackageStatus
+    try {
+      status = await analyzeSinglePackage(packagePath, featurePosDirPath, CallGraphDirPath, SequentialFeatureDirPath)
+    } catch (error) {
+      Logger.error(getErrorInfo(error))
+      status = 'failed'
+    }
+    process.stdout.write(JSON.stringify({ package: packagePath, status, totalMs: elapsedMs(startTime), rssBytes: process.memoryUsage().rss }) + '\n')
+  }
+  await closeCallGraphWorkerPool()
+}
@@ -5,15 +5,24 @@ from gensim.models import Word2Vec
 import tensorflow as tf
 from tensorflow.keras.models import load_model
 from sklearn.metrics import f1_score, precision_score, recall_score, accuracy_score
+from vectorize import SequenceVectorizer, bucket_boundaries, bucket_batches
+from corpus import PackedCorpus
+from pipeline import list_feature_files
+from vector_cache import VectorCache
 
 # 路径设置
 model_save_path = '/home/wwy/SerMalDetector/training/malware_detection_model.keras'
 w2v_model_path = '/home/wwy/SerMalDetector/training/word2vec_window10.model'
 test_data_dir = '/home/wwy/SerMalDetector/data/result/testb'  # 恶意数据集目录
+test_corpus_dir = None  # 打包语料路径（由corpus.py pack生成），设置后代替test_data_dir
 # /home/wwy/detect-malicious-npm-package-with-machine-learning/datasets/preprocessed-datasets/benign/testb
 # 可调参数
 vector_size = 100
 max_sequence_length = 800
+bucketing = False  # 按长度分桶推理，只适用于lstmTrain.py中bucketing=True训练出的带Masking层的模型
+BatchSize = 32
+vector_cache_dir = None  # 向量缓存路径，设置后重复评估直接读取已向量化的序列，跳过JSON解析和向量化
+vector_cache_max_bytes = 16 << 30  # 向量缓存的最大容量，超出时淘汰最久未使用的条目
 
 # 加载Word2Vec模型
 w2v_model = Word2Vec.load(w2v_model_path)
@@ -28,28 +37,38 @@ def load_api_sequences(directory):
                 api_sequences.append(api_sequence)
     return api_sequences
 
-# 将API序列转换为向量序列，并填充到相同长度
-def vectorize_sequences(sequences, model, max_length):
-    vectorized_sequences = []
-    for seq in sequences:
-        vectorized_seq = [model.wv[api] if api in model.wv else np.zeros(model.vector_size) for api in seq]
-        # 填充或截断序列
-        if len(vectorized_seq) < max_length:
-            vectorized_seq.extend([np.zeros(model.vector_size)] * (max_length - len(vectorized_seq)))
-        else:
-            vectorized_seq = vectorized_seq[:max_length]
-        vectorized_sequences.append(vectorized_seq)
-    return np.array(vectorized_sequences)
-
 # 加载测试数据
-test_sequences = load_api_sequences(test_data_dir)
-vectorized_test_sequences = vectorize_sequences(test_sequences, w2v_model, max_sequence_length)
+vectorizer = SequenceVectorizer(w2v_model, max_sequence_length)
+if test_corpus_dir:
+    corpus = PackedCorpus(test_corpus_dir)
+    vocabulary_map = corpus.vocabulary_map(vectorizer)
+    test_lengths = corpus.lengths(max_sequence_length)
+    embed_batch = lambda indices, width: vectorizer.embed(corpus.encode(vectorizer, indices, width, vocabulary_map))
+elif vector_cache_dir:
+    # 从向量缓存读取float32向量，未命中的文件向量化一次后写入缓存
+    cache = VectorCache(vector_cache_dir, vectorizer, vector_cache_max_bytes)
+    test_files = list_feature_files(test_data_dir)
+    test_lengths = cache.lengths(test_files)
+    cache.save()
+    print(f'Vector cache: {cache.hits} hits, {cache.misses} misses')
+    embed_batch = lambda indices, width: cache.pad([test_files[i] for i in indices], width)
+else:
+    test_sequences = load_api_sequences(test_data_dir)
+    test_lengths = vectorizer.sequence_lengths(test_sequences)
+    embed_batch = lambda indices, width: vectorizer.vectorize([test_sequences[i] for i in indices], width)
 
 # 加载训练好的模型
 model = load_model(model_save_path)
 
 # 进行预测
-predictions = model.predict(vectorized_test_sequences)
+if bucketing:
+    # 每个batch只填充到所在桶的长度
+    predictions = np.zeros((len(test_lengths), 1), dtype=np.float32)
+    for indices, width in bucket_batches(test_lengths, BatchSize, bucket_boundaries(max_sequence_length)):
+        predictions[indices] = model.predict_on_batch(embed_batch(indices, width))
+else:
+    vectorized_test_sequences = embed_batch(np.arange(len(test_lengths)), max_sequence_length)
+    predictions = model.predict(vectorized_test_sequences)
 
 # 预测结果阈值设置
 threshold = 0.5
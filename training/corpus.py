@@ -0,0 +1,283 @@
+"""
+Packed feature-sequence corpus.
+
+A corpus shard is a directory holding four append-only parts:
+    vocab.txt   one API name per line; line i (0-based) is token id i + 1, id 0 is padding
+    tokens.i32  every package's token ids concatenated as raw little-endian int32
+    ends.i64    for package i, the end offset of its tokens in tokens.i32 (raw int64)
+    meta.jsonl  one {"name", "label", "sha1"} record per package
+
+Packing more packages only appends to these files, so an existing shard is never
+rewritten. A package packed again with changed content gets a new record, and
+readers only see the latest record of every (label, name). Readers memory-map
+tokens.i32 and ends.i64, and slicing a package's ids does not copy.
+
+Usage:
+    python corpus.py pack <feature_dir> <shard_dir> --label {0,1}
+    python corpus.py info <shard_dir>
+"""
+import os
+import json
+import hashlib
+import argparse
+import numpy as np
+from vectorize import PAD_ID
+
+VOCAB_FILE = 'vocab.txt'
+TOKENS_FILE = 'tokens.i32'
+ENDS_FILE = 'ends.i64'
+META_FILE = 'meta.jsonl'
+
+
+def _memmap(path, dtype):
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def _read_vocab(shard_dir):
+    path = os.path.join(shard_dir, VOCAB_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read().splitlines()
+
+
+def _read_meta(shard_dir):
+    path = os.path.join(shard_dir, META_FILE)
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class PackedCorpus:
+    """
+    Read-only view of a packed corpus shard.
+
+    Args:
+    shard_dir (str): Path to the shard directory written by pack_directory.
+    """
+
+    def __init__(self, shard_dir: str):
+        self.shard_dir = shard_dir
+        self.vocab = _read_vocab(shard_dir)
+        self.tokens = _memmap(os.path.join(shard_dir, TOKENS_FILE), np.int32)
+        ends = _memmap(os.path.join(shard_dir, ENDS_FILE), np.int64)
+        meta = _read_meta(shard_dir)
+        # An interrupted append may leave one part longer than the others; only complete packages count.
+        count = min(len(ends), len(meta))
+        meta = meta[:count]
+        # A package packed again after its content changed is read from its latest record.
+        latest = {}
+        for row, record in enumerate(meta):
+            latest[(record['label'], record['name'])] = row
+        rows = np.array(sorted(latest.values()), dtype=np.int64)
+        starts = np.concatenate([np.zeros(1, dtype=np.int64), ends[:count - 1]]) if count else np.empty(0, dtype=np.int64)
+        self.starts = starts[rows]
+        self.ends = np.asarray(ends[:count])[rows]
+        self.meta = [meta[row] for row in rows]
+        self.names = [record['name'] for record in self.meta]
+        self.labels = np.array([record['label'] for record in self.meta], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.meta)
+
+    def ids(self, index: int) -> np.ndarray:
+        """
+        Returns the corpus token ids of one package as a zero-copy view.
+        """
+        return self.tokens[self.starts[index]:self.ends[index]]
+
+    def lengths(self, max_length: int = None) -> np.ndarray:
+        """
+        Returns the number of tokens of every package, optionally capped at max_length.
+        """
+        lengths = (self.ends - self.starts).astype(np.int32)
+        return lengths if max_length is None else np.minimum(lengths, max_length)
+
+    def sequence(self, index: int):
+        """
+        Returns the API sequence of one package as a list of names.
+        """
+        vocab = self.vocab
+        return [vocab[token - 1] for token in self.ids(index).tolist()]
+
+    def sequences(self, indices=None):
+        """
+        Iterates over API sequences, in the same shape json.load gave for *_rst.json files.
+        """
+        for index in (range(len(self)) if indices is None else indices):
+            yield self.sequence(index)
+
+    def vocabulary_map(self, vectorizer) -> np.ndarray:
+        """
+        Maps every corpus token id to the matching id of a SequenceVectorizer.
+        """
+        return np.array([PAD_ID] + [vectorizer.token_to_id.get(token, PAD_ID) for token in self.vocab], dtype=np.int32)
+
+    def encode(self, vectorizer, indices=None, max_length: int = None, vocabulary_map: np.ndarray = None) -> np.ndarray:
+        """
+        Encodes packages straight into a padded int32 id matrix for a SequenceVectorizer,
+        without going through API name strings.
+        """
+        indices = range(len(self)) if indices is None else indices
+        max_length = vectorizer.max_length if max_length is None else max_length
+        if vocabulary_map is None:
+            vocabulary_map = self.vocabulary_map(vectorizer)
+        encoded = np.full((len(indices), max_length), PAD_ID, dtype=np.int32)
+        for row, index in enumerate(indices):
+            ids = self.ids(index)[:max_length]
+            encoded[row, :len(ids)] = vocabulary_map[ids]
+        return encoded
+
+    def select(self, label: int):
+        """
+        Returns the indices of all packages with the given label.
+        """
+        return np.flatnonzero(self.labels == label)
+
+
+def load_api_sequences(shard_dir: str, label: int = None):
+    """
+    Loads API sequences from a packed corpus, optionally only those with the given label.
+    """
+    corpus = PackedCorpus(shard_dir)
+    indices = None if label is None else corpus.select(label)
+    return list(corpus.sequences(indices))
+
+
+def _truncate_lines(path):
+    """
+    Drops a last line left without its newline by an interrupted append.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, 'rb+') as file:
+        content = file.read()
+        if not content.endswith(b'\n'):
+            file.truncate(content.rfind(b'\n') + 1)
+
+
+def _recover(shard_dir):
+    """
+    Truncates every part of the shard to the packages an interrupted append left complete.
+
+    Packages are flushed part by part in the order tokens, ends, vocab, meta, so a package
+    counts once its meta record and its end offset are written and its tokens are in tokens.i32.
+
+    Returns:
+    tuple: The vocabulary, the meta records and the end offset of the last package.
+    """
+    vocab_path = os.path.join(shard_dir, VOCAB_FILE)
+    meta_path = os.path.join(shard_dir, META_FILE)
+    ends_path = os.path.join(shard_dir, ENDS_FILE)
+    tokens_path = os.path.join(shard_dir, TOKENS_FILE)
+    _truncate_lines(vocab_path)
+    _truncate_lines(meta_path)
+    if os.path.exists(ends_path) and os.path.getsize(ends_path) % 8:
+        os.truncate(ends_path, os.path.getsize(ends_path) // 8 * 8)
+
+    meta = _read_meta(shard_dir)
+    ends = _memmap(ends_path, np.int64)
+    tokens_size = os.path.getsize(tokens_path) if os.path.exists(tokens_path) else 0
+    count = min(len(meta), len(ends))
+    while count and int(ends[count - 1]) * 4 > tokens_size:
+        count -= 1
+    end = int(ends[count - 1]) if count else 0
+    del ends
+
+    if len(meta) > count:
+        meta = meta[:count]
+        with open(meta_path, 'w', encoding='utf-8') as file:
+            file.writelines(json.dumps(record) + '\n' for record in meta)
+    for path, size in ((ends_path, count * 8), (tokens_path, end * 4)):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+    return _read_vocab(shard_dir), meta, end
+
+
+def pack_directory(feature_dir: str, shard_dir: str, label: int):
+    """
+    Appends every feature sequence file of a directory to a corpus shard.
+
+    Files already packed with the same label, package name and content (SHA-1) are skipped,
+    so re-running after new packages were extracted only appends the new ones. A package whose
+    content changed is appended again, and readers take its latest record.
+
+    Args:
+    feature_dir (str): Directory containing *_rst.json files.
+    shard_dir (str): Shard directory, created if it does not exist.
+    label (int): Label of every package in the directory (1 for malicious, 0 for benign).
+
+    Returns:
+    int: The number of packages appended.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    vocab, meta, end = _recover(shard_dir)
+    token_to_id = {token: i + 1 for i, token in enumerate(vocab)}
+    # the SHA-1 of the latest record of every package
+    known_packages = {(record['label'], record['name']): record['sha1'] for record in meta}
+
+    appended = 0
+    with open(os.path.join(shard_dir, VOCAB_FILE), 'a', encoding='utf-8') as vocab_file, \
+            open(os.path.join(shard_dir, TOKENS_FILE), 'ab') as tokens_file, \
+            open(os.path.join(shard_dir, ENDS_FILE), 'ab') as ends_file, \
+            open(os.path.join(shard_dir, META_FILE), 'a', encoding='utf-8') as meta_file:
+        for filename in sorted(os.listdir(feature_dir)):
+            if not filename.endswith('.json'):
+                continue
+            name = filename[:-len('_rst.json')] if filename.endswith('_rst.json') else filename[:-len('.json')]
+            with open(os.path.join(feature_dir, filename), 'rb') as file:
+                content = file.read()
+            sha1 = hashlib.sha1(content).hexdigest()
+            if known_packages.get((label, name)) == sha1:
+                continue
+            try:
+                sequence = json.loads(content)
+            except ValueError as e:
+                print(f'Error reading {filename}: {e}')
+                continue
+
+            ids = []
+            new_tokens = []
+            for api in sequence:
+                if api not in token_to_id:
+                    token_to_id[api] = len(token_to_id) + 1
+                    new_tokens.append(api)
+                ids.append(token_to_id[api])
+            end += len(ids)
+            # A package only counts once its meta record is written, so that is flushed last.
+            for part, data in ((tokens_file, np.asarray(ids, dtype='<i4').tobytes()),
+                               (ends_file, np.asarray([end], dtype='<i8').tobytes()),
+                               (vocab_file, ''.join(api + '\n' for api in new_tokens)),
+                               (meta_file, json.dumps({'name': name, 'label': label, 'sha1': sha1}) + '\n')):
+                part.write(data)
+                part.flush()
+            known_packages[(label, name)] = sha1
+            appended += 1
+    return appended
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack feature sequence files into a memory-mapped corpus shard.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    pack_parser = subparsers.add_parser('pack')
+    pack_parser.add_argument('feature_dir')
+    pack_parser.add_argument('shard_dir')
+    pack_parser.add_argument('--label', type=int, choices=[0, 1], required=True)
+    info_parser = subparsers.add_parser('info')
+    info_parser.add_argument('shard_dir')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        appended = pack_directory(args.feature_dir, args.shard_dir, args.label)
+        print(f'Appended {appended} packages to {args.shard_dir}')
+    else:
+        corpus = PackedCorpus(args.shard_dir)
+        print(f'Packages: {len(corpus)} (malicious {int(corpus.labels.sum())}, benign {len(corpus) - int(corpus.labels.sum())})')
+        print(f'Tokens: {len(corpus.tokens)}, vocabulary: {len(corpus.vocab)}')
+
+
+if __name__ == '__main__':
+    main()
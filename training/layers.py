@@ -0,0 +1,31 @@
+import tensorflow as tf
+from tensorflow.keras.layers import Layer
+
+
+# 自定义注意力层
+class AttentionLayer(Layer):
+    def __init__(self, **kwargs):
+        super(AttentionLayer, self).__init__(**kwargs)
+        self.supports_masking = True
+
+    def build(self, input_shape):
+        self.W = self.add_weight(name='att_weight', shape=(input_shape[-1], input_shape[-1]), initializer='uniform', trainable=True)
+        self.b = self.add_weight(name='att_bias', shape=(input_shape[-1],), initializer='uniform', trainable=True)
+        super(AttentionLayer, self).build(input_shape)
+
+    # 每个时间步、每个特征维的注意力权重，在时间维上做softmax
+    def attention_weights(self, x, mask=None):
+        et = tf.nn.tanh(tf.tensordot(x, self.W, axes=1) + self.b)
+        if mask is not None:
+            # Masking层跳过的填充步不参与softmax
+            et += (1.0 - tf.cast(mask, et.dtype))[:, :, tf.newaxis] * -1e9
+        return tf.nn.softmax(et, axis=1)
+
+    def call(self, x, mask=None):
+        at = self.attention_weights(x, mask)
+        output = x * at
+        return tf.reduce_sum(output, axis=1)
+
+    def compute_mask(self, inputs, mask=None):
+        # 输出已在时间维上求和，不再向后传递mask
+        return None
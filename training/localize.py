@@ -0,0 +1,267 @@
+"""
+Batched localization of malicious code with the attention model trained by location.py.
+
+For every package of a feature directory, the attention weights of the Bi-LSTM attention
+model are computed in large length-bucketed batches, and the top-k attended API calls are
+mapped back to the file, line and column they were extracted from.
+
+The position of each entry of a *_rst.json sequence is recovered by replaying how the
+extractor serialized it (feature-serialize/SerializeFeatures.ts): the depth-limited DFS over
+the call graph in *_cg.json gives the order of the functions of every entry file, and
+*_fp.json gives the features of every function with their source locations. The replayed
+sequence is compared with the *_rst.json sequence, and a package whose replay differs is
+reported without positions.
+
+Usage:
+    python localize.py --features <rst_dir> --positions <fp_dir> --call-graphs <cg_dir> --out locations.jsonl
+                       [--model malware_location_model.keras] [--w2v word2vec_window8.model] [--top-k 10] [--all]
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+from vectorize import SequenceVectorizer, bucket_boundaries, bucket_batches
+from pipeline import list_feature_files
+
+TRAINING_DIR = os.path.dirname(os.path.abspath(__file__))
+THRESHOLD = 0.5
+# dfsDepthLimit in feature-extract/src/index.ts
+DFS_DEPTH_LIMIT = 3
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+
+def _dfs(node, callees, calls, path):
+    # same pruning as dfsTraversal in feature-serialize/dfsTraversal.ts
+    if len(path) > DFS_DEPTH_LIMIT or (node in path and len(path) - path.index(node) > 3):
+        return
+    path = path + [node]
+    calls.append(str(node))
+    for callee in callees.get(node, ()):
+        _dfs(callee, callees, calls, path)
+
+
+def _object_keys(obj):
+    # JavaScript orders integer-like keys ascending, then the other keys by insertion
+    integer_keys = sorted((key for key in obj if key.isdigit()), key=int)
+    return integer_keys + [key for key in obj if not key.isdigit()]
+
+
+def replay_call_order(call_graph, call_graph_generated: bool = True):
+    """
+    Replays initiateTraversal: returns the functions visited from every entry file, in serialization order.
+    """
+    if call_graph is None:
+        return {}
+    entries = call_graph.get('entries') or []
+    if not call_graph_generated:
+        return {entry: ['-1'] for entry in entries}
+
+    files = call_graph.get('files') or []
+    functions = call_graph.get('functions') or {}
+    callees = {}
+    for caller, callee in call_graph.get('fun2fun') or []:
+        callees.setdefault(caller, []).append(callee)
+
+    order = {}
+    for entry in entries:
+        if entry not in files:
+            continue
+        start = str(files.index(entry))
+        for func in reversed(_object_keys(functions)):
+            if functions[func].startswith(start):
+                _dfs(int(func), callees, order.setdefault(entry, []), [])
+    return order
+
+
+def feature_positions(feature_positions, call_graph):
+    """
+    Rebuilds the *_rst.json sequence of a package with the source location of every entry.
+
+    Args:
+    feature_positions (list): Parsed *_fp.json file.
+    call_graph (dict): Parsed *_cg.json file, or None if it is missing.
+
+    Returns:
+    list: One {"api", "file", "function", "content"} record per sequence entry.
+    """
+    function_features = {}
+    call_graph_generated = True
+    for file_record in feature_positions:
+        for function in file_record['functions']:
+            name = function['functionName']
+            call_graph_generated &= name != '-1'
+            # a later function with the same name replaces the earlier one, as in preProcessFeaturePositions
+            function_features[str(name)] = [
+                {'api': feature['featureName'], 'file': file_record['filePath'], 'function': name, 'content': feature['content']}
+                for feature in function['features']]
+
+    file_features = {}
+    if 'packageJSON' in function_features:
+        file_features['package.json'] = function_features['packageJSON']
+    for file_path, functions in replay_call_order(call_graph, call_graph_generated).items():
+        file_features[file_path] = [record for name in functions for record in function_features.get(name, [])]
+    return [record for records in file_features.values() for record in records]
+
+
+def _location(record, indices, attention):
+    location = {'api': record['api'], 'attention': attention, 'indices': indices}
+    if 'file' in record:
+        location['file'] = record['file']
+        content = record['content']
+        if isinstance(content, dict):
+            location['start'] = {'line': content['start']['line'], 'column': content['start']['column']}
+            location['end'] = {'line': content['end']['line'], 'column': content['end']['column']}
+        else:
+            # install script features of package.json record the script itself
+            location['script'] = content
+    return location
+
+
+def top_locations(sequence, attention, positions, top_k: int):
+    """
+    Sums the attention of sequence entries sharing a source location and returns the top_k locations.
+    """
+    if positions is None:
+        positions = [{'api': api} for api in sequence]
+    grouped = {}
+    for index, weight in enumerate(attention):
+        record = positions[index]
+        content = record.get('content')
+        key = (record['api'], record.get('file'), json.dumps(content, sort_keys=True) if content is not None else index)
+        if key not in grouped:
+            grouped[key] = [record, [], 0.0]
+        grouped[key][1].append(index)
+        grouped[key][2] += float(weight)
+    ranked = sorted(grouped.values(), key=lambda group: group[2], reverse=True)[:top_k]
+    return [_location(record, indices, attention) for record, indices, attention in ranked]
+
+
+class AttentionLocalizer:
+    """
+    Scores packages with an attention model and returns the per-step attention of every sequence.
+
+    The extraction model returning the attention layer input and the prediction is built once.
+    Models trained with bucketing (variable-length input) are scored in length buckets.
+
+    Args:
+    model_path (str): Attention model saved by location.py.
+    vectorizer (SequenceVectorizer): Vectorizer of the Word2Vec model the model was trained with.
+    batch_size (int): Number of packages per batch.
+    """
+
+    def __init__(self, model_path: str, vectorizer, batch_size: int = 256):
+        from tensorflow.keras.models import Model, load_model
+        from tensorflow.keras.layers import Masking
+        from layers import AttentionLayer
+
+        model = load_model(model_path, custom_objects={'AttentionLayer': AttentionLayer})
+        self.attention_layer = next(layer for layer in model.layers if isinstance(layer, AttentionLayer))
+        self.extractor = Model(model.inputs, [self.attention_layer.input, model.output])
+        self.masking = any(isinstance(layer, Masking) for layer in model.layers)
+        self.variable_length = model.input_shape[1] is None
+        self.vectorizer = vectorizer
+        self.batch_size = batch_size
+
+    def score(self, sequences):
+        """
+        Returns the probability of every sequence and, for each, the attention of its first
+        min(len(sequence), max_length) steps averaged over the feature dimensions.
+        """
+        max_length = self.vectorizer.max_length
+        lengths = self.vectorizer.sequence_lengths(sequences)
+        boundaries = bucket_boundaries(max_length) if self.variable_length else [max_length]
+        probabilities = np.zeros(len(sequences), dtype=np.float32)
+        attention = [None] * len(sequences)
+        for indices, width in bucket_batches(lengths, self.batch_size, boundaries):
+            x = self.vectorizer.vectorize([sequences[i] for i in indices], width)
+            hidden, predictions = self.extractor.predict_on_batch(x)
+            mask = np.any(x != 0.0, axis=-1) if self.masking else None
+            weights = np.asarray(self.attention_layer.attention_weights(hidden, mask)).mean(axis=-1)
+            probabilities[indices] = np.asarray(predictions).reshape(-1)
+            for row, index in enumerate(indices):
+                attention[index] = weights[row, :lengths[index]]
+        return probabilities, attention
+
+
+def _package_name(feature_file):
+    name = os.path.basename(feature_file)
+    return name[:-len('_rst.json')] if name.endswith('_rst.json') else name[:-len('.json')]
+
+
+def localize_directory(localizer, features_dir, positions_dir, call_graphs_dir, out, top_k: int = 10,
+                       threshold: float = THRESHOLD, only_malicious: bool = True, chunk_size: int = 4096):
+    """
+    Localizes every package of a feature directory and writes one JSON line per package to out.
+
+    Packages are read and scored chunk by chunk, so memory stays bounded and results are
+    streamed while the directory is processed.
+
+    Returns:
+    (int, int): The number of packages scored and the number written.
+    """
+    files = list_feature_files(features_dir)
+    scored = written = 0
+    for start in range(0, len(files), chunk_size):
+        chunk = files[start:start + chunk_size]
+        sequences = [_read_json(path) or [] for path in chunk]
+        probabilities, attention = localizer.score(sequences)
+        for path, sequence, probability, weights in zip(chunk, sequences, probabilities, attention):
+            scored += 1
+            malicious = bool(probability > threshold)
+            if only_malicious and not malicious:
+                continue
+            name = _package_name(path)
+            fp = _read_json(os.path.join(positions_dir, f'{name}_fp.json')) if positions_dir else None
+            cg = _read_json(os.path.join(call_graphs_dir, f'{name}_cg.json')) if call_graphs_dir else None
+            positions = feature_positions(fp, cg) if fp is not None else None
+            resolved = positions is not None and [record['api'] for record in positions] == sequence
+            out.write(json.dumps({
+                'package': name,
+                'probability': float(probability),
+                'class': 'malicious' if malicious else 'benign',
+                'positions_resolved': resolved,
+                'locations': top_locations(sequence, weights, positions if resolved else None, top_k),
+            }) + '\n')
+            written += 1
+        out.flush()
+    return scored, written
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Locate malicious code in packages with the attention model.')
+    parser.add_argument('--features', required=True, help='directory of *_rst.json feature sequence files')
+    parser.add_argument('--positions', default=None, help='directory of *_fp.json feature position files')
+    parser.add_argument('--call-graphs', default=None, help='directory of *_cg.json call graph files')
+    parser.add_argument('--model', default=os.path.join(TRAINING_DIR, 'malware_location_model.keras'))
+    parser.add_argument('--w2v', default=os.path.join(TRAINING_DIR, 'word2vec_window8.model'))
+    parser.add_argument('--max-sequence-length', type=int, default=800)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--all', action='store_true', help='also write packages classified as benign')
+    parser.add_argument('--out', default='-', help='JSONL output file (stdout by default)')
+    args = parser.parse_args()
+
+    from gensim.models import Word2Vec
+    vectorizer = SequenceVectorizer(Word2Vec.load(args.w2v), args.max_sequence_length)
+    localizer = AttentionLocalizer(args.model, vectorizer, args.batch_size)
+    out = sys.stdout if args.out == '-' else open(args.out, 'w')
+    try:
+        scored, written = localize_directory(localizer, args.features, args.positions, args.call_graphs, out,
+                                             args.top_k, args.threshold, only_malicious=not args.all)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f'Scored {scored} packages, wrote {written}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,21 @@ import numpy as np
 from gensim.models import Word2Vec
 import tensorflow as tf
 from tensorflow.keras.models import Model
-from tensorflow.keras.layers import Input, LSTM, Dense, Bidirectional, Layer, Concatenate
+from tensorflow.keras.layers import Input, LSTM, Dense, Bidirectional, Masking
 from tensorflow.keras.callbacks import Callback
 from sklearn.metrics import f1_score, precision_score, recall_score, confusion_matrix, accuracy_score
 from sklearn.model_selection import train_test_split
+from vectorize import SequenceVectorizer, bucket_boundaries
+from corpus import PackedCorpus
+from pipeline import list_feature_files, catalog_feature_files, make_bucketed_dataset, make_cached_dataset
+from vector_cache import VectorCache
+from layers import AttentionLayer
 
 # 可调参数
 mal_dir = '/home/wwy/datasets/MalinBenPac/features'  # 恶意API序列的文件夹路径
 ben_dir = '/home/wwy/datasets/BenPac/features'  # 正常API序列的文件夹路径
+corpus_dir = None  # 打包语料路径（由corpus.py pack生成），设置后代替mal_dir和ben_dir
+catalog_path = None  # 数据集目录库（create-data/catalog.py生成），设置后按标签查询已提取包的特征文件，代替列出mal_dir和ben_dir
 vector_size = 100  # 嵌入向量的维度 已ok
 max_sequence_length = 800  # 最大序列长度，所有序列将会被填充到这个长度 已ok
 model_save_path = '/home/wwy/SerMalDetector/training/word2vec_window8.model'  # 训练好模型的保存路径
@@ -25,71 +32,69 @@ lstm_dropout = 0.1  # LSTM层输入数据的丢弃比率
 lstm_recurrent_dropout = 0.1  # LSTM层循环连接的丢弃比率
 epochs_times = 10
 BatchSize = 32
+bucketing = False  # 按长度分桶组batch，每个batch只填充到所在桶的长度，配合Masking层跳过填充步（未登录API与填充同为全零向量，也会被跳过，模型结构随之改变）
+vector_cache_dir = None  # 向量缓存路径，设置后重复运行直接读取已向量化的序列，跳过JSON解析和向量化
+vector_cache_max_bytes = 16 << 30  # 向量缓存的最大容量，超出时淘汰最久未使用的条目
 
 # 加载API序列
-def load_api_sequences(directory):
+def load_api_sequences(files):
     api_sequences = []
-    for filename in os.listdir(directory):
-        if filename.endswith('.json'):
-            with open(os.path.join(directory, filename), 'r') as file:
-                api_sequence = json.load(file)
-                api_sequences.append(api_sequence)
+    for file_path in files:
+        with open(file_path, 'r') as file:
+            api_sequences.append(json.load(file))
     return api_sequences
 
-# 将API序列加载到两个文件夹中
-malicious_sequences = load_api_sequences(mal_dir)
-benign_sequences = load_api_sequences(ben_dir)
-
-# 合并所有序列以便于训练
-all_sequences = malicious_sequences + benign_sequences
-labels = [1] * len(malicious_sequences) + [0] * len(benign_sequences)  # 1表示恶意，0表示正常
+# 列出恶意（含增强）和正常包的特征文件
+def list_dataset_files():
+    if catalog_path:
+        return catalog_feature_files(catalog_path, ('malicious', 'augmented')), catalog_feature_files(catalog_path, 'benign')
+    return list_feature_files(mal_dir), list_feature_files(ben_dir)
 
 # 加载Word2Vec模型
 w2v_model = Word2Vec.load(model_save_path)
-
-# 将API序列转换为向量序列，并填充到相同长度
-def vectorize_sequences(sequences, model, max_length):
-    vectorized_sequences = []
-    for seq in sequences:
-        vectorized_seq = [model.wv[api] if api in model.wv else np.zeros(model.vector_size) for api in seq]
-        # 填充或截断序列
-        if len(vectorized_seq) < max_length:
-            vectorized_seq.extend([np.zeros(model.vector_size)] * (max_length - len(vectorized_seq)))
-        else:
-            vectorized_seq = vectorized_seq[:max_length]
-        vectorized_sequences.append(vectorized_seq)
-    return np.array(vectorized_sequences)
-
-vectorized_sequences = vectorize_sequences(all_sequences, w2v_model, max_sequence_length)
+vectorizer = SequenceVectorizer(w2v_model, max_sequence_length)
+cache = VectorCache(vector_cache_dir, vectorizer, vector_cache_max_bytes) if vector_cache_dir and not corpus_dir else None
+
+if corpus_dir:
+    corpus = PackedCorpus(corpus_dir)
+    labels = corpus.labels.tolist()
+    encoded_sequences = corpus.encode(vectorizer)
+    sequence_lengths = corpus.lengths(max_sequence_length)
+elif cache:
+    # 只加载文件列表，训练时按batch从向量缓存读取float32向量，未命中的文件向量化一次后写入缓存
+    malicious_files, benign_files = list_dataset_files()
+    all_files = malicious_files + benign_files
+    labels = [1] * len(malicious_files) + [0] * len(benign_files)  # 1表示恶意，0表示正常
+else:
+    # 将API序列加载到两个列表中
+    malicious_files, benign_files = list_dataset_files()
+    malicious_sequences = load_api_sequences(malicious_files)
+    benign_sequences = load_api_sequences(benign_files)
+
+    # 合并所有序列以便于训练
+    all_sequences = malicious_sequences + benign_sequences
+    labels = [1] * len(malicious_sequences) + [0] * len(benign_sequences)  # 1表示恶意，0表示正常
+
+    encoded_sequences = vectorizer.encode(all_sequences)
+    sequence_lengths = vectorizer.sequence_lengths(all_sequences)
 
 # 数据集划分
-X_train, X_test, y_train, y_test = train_test_split(vectorized_sequences, labels, test_size=0.2, random_state=42, stratify=labels)
-
-# 自定义注意力层
-class AttentionLayer(Layer):
-    def __init__(self, **kwargs):
-        super(AttentionLayer, self).__init__(**kwargs)
-
-    def build(self, input_shape):
-        self.W = self.add_weight(name='att_weight', shape=(input_shape[-1], input_shape[-1]), initializer='uniform', trainable=True)
-        self.b = self.add_weight(name='att_bias', shape=(input_shape[-1],), initializer='uniform', trainable=True)
-        super(AttentionLayer, self).build(input_shape)
-
-    def call(self, x):
-        et = tf.nn.tanh(tf.tensordot(x, self.W, axes=1) + self.b)
-        at = tf.nn.softmax(et, axis=1)
-        output = x * at
-        return tf.reduce_sum(output, axis=1)
+if cache:
+    X_train, X_test, y_train, y_test = train_test_split(all_files, labels, test_size=0.2, random_state=42, stratify=labels)
+else:
+    X_train, X_test, len_train, len_test, y_train, y_test = train_test_split(encoded_sequences, sequence_lengths, labels, test_size=0.2, random_state=42, stratify=labels)
 
 # 构建带注意力机制的Bi-LSTM模型
 def create_model(input_shape):
     inputs = Input(shape=input_shape)
+    # 分桶模式下序列长度可变，全零的填充步由Masking层跳过，mask一直传到注意力层
+    masked = Masking(mask_value=0.0)(inputs) if bucketing else inputs
     lstm_out = Bidirectional(LSTM(units=lstm_units, 
                                   return_sequences=True,
                                   activation=lstm_activation,
                                   recurrent_activation=lstm_recurrent_activation,
                                   dropout=lstm_dropout,
-                                  recurrent_dropout=lstm_recurrent_dropout))(inputs)
+                                  recurrent_dropout=lstm_recurrent_dropout))(masked)
     attention_out = AttentionLayer()(lstm_out)
     outputs = Dense(1, activation='sigmoid')(attention_out)
     
@@ -97,7 +102,7 @@ def create_model(input_shape):
     model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
     return model
 
-input_shape = (max_sequence_length, vector_size)
+input_shape = (None, vector_size) if bucketing else (max_sequence_length, vector_size)
 model = create_model(input_shape)
 
 # 自定义回调函数计算F1分数等指标
@@ -112,9 +117,15 @@ class Metrics(Callback):
         self.val_tp = []
         self.val_fp = []
 
+    def predict_validation_data(self):
+        if isinstance(self.validation_data, tf.data.Dataset):
+            # 分桶后验证集的顺序与y_test不同，标签随batch一起取出
+            batches = [(self.model.predict_on_batch(x), y.numpy()) for x, y in self.validation_data]
+            return np.concatenate([p for p, _ in batches]).round(), np.concatenate([y for _, y in batches])
+        return (np.asarray(self.model.predict(self.validation_data[0]))).round(), self.validation_data[1]
+
     def on_epoch_end(self, epoch, logs=None):
-        val_predict = (np.asarray(self.model.predict(self.validation_data[0]))).round()
-        val_targ = self.validation_data[1]
+        val_predict, val_targ = self.predict_validation_data()
         _val_f1 = f1_score(val_targ, val_predict)
         _val_recall = recall_score(val_targ, val_predict)
         _val_precision = precision_score(val_targ, val_predict)
@@ -143,26 +154,26 @@ class Metrics(Callback):
 
 
 # 训练模型
-metrics = Metrics(validation_data=(X_test, np.array(y_test)))
-model.fit(X_train, np.array(y_train), epochs=epochs_times, batch_size=BatchSize, validation_data=(X_test, np.array(y_test)), callbacks=[metrics])
+if cache:
+    boundaries = bucket_boundaries(max_sequence_length) if bucketing else None
+    train_dataset = make_cached_dataset(cache, X_train, y_train, BatchSize, bucket_boundaries=boundaries)
+    val_dataset = make_cached_dataset(cache, X_test, y_test, BatchSize, shuffle=False, bucket_boundaries=boundaries)
+    metrics = Metrics(validation_data=val_dataset)
+    model.fit(train_dataset, epochs=epochs_times, validation_data=val_dataset, callbacks=[metrics])
+    cache.save()
+    print(f'Vector cache: {cache.hits} hits, {cache.misses} misses')
+elif bucketing:
+    boundaries = bucket_boundaries(max_sequence_length)
+    train_dataset = make_bucketed_dataset(X_train, len_train, np.array(y_train), vectorizer, BatchSize, boundaries)
+    val_dataset = make_bucketed_dataset(X_test, len_test, np.array(y_test), vectorizer, BatchSize, boundaries, shuffle=False)
+    metrics = Metrics(validation_data=val_dataset)
+    model.fit(train_dataset, epochs=epochs_times, validation_data=val_dataset, callbacks=[metrics])
+else:
+    X_train, X_test = vectorizer.embed(X_train), vectorizer.embed(X_test)
+    metrics = Metrics(validation_data=(X_test, np.array(y_test)))
+    model.fit(X_train, np.array(y_train), epochs=epochs_times, batch_size=BatchSize, validation_data=(X_test, np.array(y_test)), callbacks=[metrics])
 
 # 保存模型
 model.save('/home/wwy/SerMalDetector/training/malware_location_model.keras')
 
-# # 定位恶意代码
-# def locate_malicious_code(model, sequence, word2vec_model, max_sequence_length):
-#     vectorized_sequence = vectorize_sequences([sequence], word2vec_model, max_sequence_length)[0]
-#     padded_sequence = np.expand_dims(vectorized_sequence, axis=0)
-#     attention_layer = model.layers[1]  # 获取注意力层
-#     attention_model = Model(inputs=model.input, outputs=attention_layer.output)
-#     attention_output = attention_model.predict(padded_sequence)
-#     attention_scores = np.mean(attention_output, axis=1).flatten()
-#     suspicious_indices = np.argsort(attention_scores)[-10:]  # 假设定位前10个可疑API
-#     suspicious_indices = [idx for idx in suspicious_indices if idx < len(sequence)]  # 确保索引在范围内
-#     suspicious_apis = [sequence[idx] for idx in suspicious_indices]
-#     return suspicious_apis
-
-# # 示例定位
-# test_sequence = all_sequences[-1]  # 选择测试集中的一个样本
-# suspicious_apis = locate_malicious_code(model, test_sequence, w2v_model, max_sequence_length)
-# print("Suspicious APIs:", suspicious_apis)
+# 定位恶意代码：批量计算注意力并映射回源码位置，见localize.py
@@ -4,10 +4,14 @@ import numpy as np
 from gensim.models import Word2Vec
 import tensorflow as tf
 from tensorflow.keras.models import Model, load_model
-from tensorflow.keras.layers import Input, LSTM, Dense, Bidirectional
+from tensorflow.keras.layers import Input, LSTM, Dense, Bidirectional, Masking
 from tensorflow.keras.callbacks import Callback
 from sklearn.metrics import f1_score, precision_score, recall_score, confusion_matrix, accuracy_score
 from sklearn.model_selection import train_test_split
+from vectorize import SequenceVectorizer, bucket_boundaries
+from pipeline import list_feature_files, catalog_feature_files, make_streaming_dataset, make_corpus_dataset, make_cached_dataset, make_bucketed_dataset
+from corpus import PackedCorpus
+from vector_cache import VectorCache
 
 # 配置TensorFlow的线程和并发行为
 tf.config.threading.set_inter_op_parallelism_threads(8)
@@ -16,6 +20,8 @@ tf.config.threading.set_intra_op_parallelism_threads(8)
 # 可调参数
 mal_dir = '/home/wwy/datasets/MalinBenPac/features'  # 恶意API序列的文件夹路径
 ben_dir = '/home/wwy/datasets/BenPac/features'  # 正常API序列的文件夹路径
+corpus_dir = None  # 打包语料路径（由corpus.py pack生成），设置后代替mal_dir和ben_dir
+catalog_path = None  # 数据集目录库（create-data/catalog.py生成），设置后按标签查询已提取包的特征文件，代替列出mal_dir和ben_dir
 vector_size = 100  # 嵌入向量的维度 已ok
 max_sequence_length = 800  # 最大序列长度，所有序列将会被填充到这个长度 已ok
 model_save_path = '/home/wwy/SerMalDetector/training/word2vec_window10.model'  # 训练好模型的保存路径
@@ -30,62 +36,83 @@ lstm_dropout = 0.1  # LSTM层输入数据的丢弃比率
 lstm_recurrent_dropout = 0.1  # LSTM层循环连接的丢弃比率
 epochs_times = 17
 BatchSize = 32
+streaming = True  # 流式训练：按batch从磁盘读取并向量化，内存占用不随数据集规模增长
+shuffle_buffer_size = 4096  # 流式训练时shuffle缓冲区的最大文件数
+bucketing = False  # 按长度分桶组batch，每个batch只填充到所在桶的长度，配合Masking层跳过填充步（未登录API与填充同为全零向量，也会被跳过，模型结构随之改变）
+vector_cache_dir = None  # 向量缓存路径，设置后重复运行直接读取已向量化的序列，跳过JSON解析和向量化
+vector_cache_max_bytes = 16 << 30  # 向量缓存的最大容量，超出时淘汰最久未使用的条目
 
 # 加载API序列
-def load_api_sequences(directory):
+def load_api_sequences(files):
     api_sequences = []
-    for filename in os.listdir(directory):
-        if filename.endswith('.json'):
-            with open(os.path.join(directory, filename), 'r') as file:
-                api_sequence = json.load(file)
-                api_sequences.append(api_sequence)
+    for file_path in files:
+        with open(file_path, 'r') as file:
+            api_sequences.append(json.load(file))
     return api_sequences
 
-# 将API序列加载到两个文件夹中
-malicious_sequences = load_api_sequences(mal_dir)
-benign_sequences = load_api_sequences(ben_dir)
-
-# 合并所有序列以便于训练
-all_sequences = malicious_sequences + benign_sequences
-labels = [1] * len(malicious_sequences) + [0] * len(benign_sequences)  # 1表示恶意，0表示正常
+# 列出恶意（含增强）和正常包的特征文件
+def list_dataset_files():
+    if catalog_path:
+        return catalog_feature_files(catalog_path, ('malicious', 'augmented')), catalog_feature_files(catalog_path, 'benign')
+    return list_feature_files(mal_dir), list_feature_files(ben_dir)
 
 # 加载Word2Vec模型
 w2v_model = Word2Vec.load(model_save_path)
-
-# 将API序列转换为向量序列，并填充到相同长度
-def vectorize_sequences(sequences, model, max_length):
-    vectorized_sequences = []
-    for seq in sequences:
-        vectorized_seq = [model.wv[api] if api in model.wv else np.zeros(model.vector_size) for api in seq]
-        # 填充或截断序列
-        if len(vectorized_seq) < max_length:
-            vectorized_seq.extend([np.zeros(model.vector_size)] * (max_length - len(vectorized_seq)))
-        else:
-            vectorized_seq = vectorized_seq[:max_length]
-        vectorized_sequences.append(vectorized_seq)
-    return np.array(vectorized_sequences)
-
-vectorized_sequences = vectorize_sequences(all_sequences, w2v_model, max_sequence_length)
-
-# 数据集划分
-X_train, X_test, y_train, y_test = train_test_split(vectorized_sequences, labels, test_size=0.2, random_state=42, stratify=labels)
+vectorizer = SequenceVectorizer(w2v_model, max_sequence_length)
+cache = VectorCache(vector_cache_dir, vectorizer, vector_cache_max_bytes) if vector_cache_dir else None
+
+if corpus_dir:
+    # 从打包语料读取，按包的索引做分层划分
+    corpus = PackedCorpus(corpus_dir)
+    labels = corpus.labels.tolist()
+    if streaming:
+        all_indices = list(range(len(corpus)))
+        X_train, X_test, y_train, y_test = train_test_split(all_indices, labels, test_size=0.2, random_state=42, stratify=labels)
+    else:
+        encoded_sequences = corpus.encode(vectorizer)
+        sequence_lengths = corpus.lengths(max_sequence_length)
+        X_train, X_test, len_train, len_test, y_train, y_test = train_test_split(encoded_sequences, sequence_lengths, labels, test_size=0.2, random_state=42, stratify=labels)
+elif streaming or cache:
+    # 只加载文件列表，按文件列表做分层划分；使用向量缓存时按batch读取缓存条目，不在内存中拼成填充后的大数组
+    malicious_files, benign_files = list_dataset_files()
+    all_files = malicious_files + benign_files
+    labels = [1] * len(malicious_files) + [0] * len(benign_files)  # 1表示恶意，0表示正常
+    X_train, X_test, y_train, y_test = train_test_split(all_files, labels, test_size=0.2, random_state=42, stratify=labels)
+else:
+    # 将API序列加载到两个列表中
+    malicious_files, benign_files = list_dataset_files()
+    malicious_sequences = load_api_sequences(malicious_files)
+    benign_sequences = load_api_sequences(benign_files)
+
+    # 合并所有序列以便于训练
+    all_sequences = malicious_sequences + benign_sequences
+    labels = [1] * len(malicious_sequences) + [0] * len(benign_sequences)  # 1表示恶意，0表示正常
+
+    # 将API序列编码为int32的token id矩阵，嵌入向量在组batch时再查表
+    encoded_sequences = vectorizer.encode(all_sequences)
+    sequence_lengths = vectorizer.sequence_lengths(all_sequences)
+
+    # 数据集划分
+    X_train, X_test, len_train, len_test, y_train, y_test = train_test_split(encoded_sequences, sequence_lengths, labels, test_size=0.2, random_state=42, stratify=labels)
 
 # 构建Bi-LSTM模型
 def create_model(input_shape):
     inputs = Input(shape=input_shape)
+    # 分桶模式下序列长度可变，全零的填充步由Masking层跳过
+    masked = Masking(mask_value=0.0)(inputs) if bucketing else inputs
     lstm_out = Bidirectional(LSTM(units=lstm_units, 
                                   return_sequences=lstm_return_sequences,
                                   activation=lstm_activation,
                                   recurrent_activation=lstm_recurrent_activation,
                                   dropout=lstm_dropout,
-                                  recurrent_dropout=lstm_recurrent_dropout))(inputs)
+                                  recurrent_dropout=lstm_recurrent_dropout))(masked)
     outputs = Dense(1, activation='sigmoid')(lstm_out)
     
     model = Model(inputs, outputs)
     model.compile(optimizer='adam', loss='binary_crossentropy', metrics=['accuracy'])
     return model
 
-input_shape = (max_sequence_length, vector_size)
+input_shape = (None, vector_size) if bucketing else (max_sequence_length, vector_size)
 model = create_model(input_shape)
 
 # 自定义回调函数计算F1分数等指标
@@ -100,9 +127,15 @@ class Metrics(Callback):
         self.val_tp = []
         self.val_fp = []
 
+    def predict_validation_data(self):
+        if isinstance(self.validation_data, tf.data.Dataset):
+            # 分桶后验证集的顺序与y_test不同，标签随batch一起取出
+            batches = [(self.model.predict_on_batch(x), y.numpy()) for x, y in self.validation_data]
+            return np.concatenate([p for p, _ in batches]).round(), np.concatenate([y for _, y in batches])
+        return (np.asarray(self.model.predict(self.validation_data[0]))).round(), self.validation_data[1]
+
     def on_epoch_end(self, epoch, logs=None):
-        val_predict = (np.asarray(self.model.predict(self.validation_data[0]))).round()
-        val_targ = self.validation_data[1]
+        val_predict, val_targ = self.predict_validation_data()
         _val_f1 = f1_score(val_targ, val_predict)
         _val_recall = recall_score(val_targ, val_predict)
         _val_precision = precision_score(val_targ, val_predict)
@@ -131,18 +164,44 @@ class Metrics(Callback):
 
 # 将数据转换为tf.data.Dataset
 def create_dataset(X, y, batch_size):
+    embedding_matrix = tf.constant(vectorizer.embedding_matrix)
     dataset = tf.data.Dataset.from_tensor_slices((X, y))
     dataset = dataset.shuffle(buffer_size=len(X)).batch(batch_size)
+    dataset = dataset.map(lambda ids, label: (tf.gather(embedding_matrix, ids), label))
     dataset = dataset.prefetch(buffer_size=tf.data.experimental.AUTOTUNE)
     return dataset
 
 # 创建训练和验证数据集
-train_dataset = create_dataset(X_train, np.array(y_train), BatchSize)
-val_dataset = create_dataset(X_test, np.array(y_test), BatchSize)
+boundaries = bucket_boundaries(max_sequence_length) if bucketing else None
+if streaming and corpus_dir:
+    train_dataset = make_corpus_dataset(corpus, X_train, y_train, vectorizer, BatchSize, shuffle_buffer_size=shuffle_buffer_size, bucket_boundaries=boundaries)
+    val_dataset = make_corpus_dataset(corpus, X_test, y_test, vectorizer, BatchSize, shuffle=False, bucket_boundaries=boundaries)
+    validation_inputs = val_dataset
+elif cache and not corpus_dir:
+    # 从向量缓存读取float32向量，未命中的文件向量化一次后写入缓存
+    train_dataset = make_cached_dataset(cache, X_train, y_train, BatchSize, shuffle_buffer_size=shuffle_buffer_size, bucket_boundaries=boundaries)
+    val_dataset = make_cached_dataset(cache, X_test, y_test, BatchSize, shuffle=False, bucket_boundaries=boundaries)
+    validation_inputs = val_dataset
+elif streaming:
+    train_dataset = make_streaming_dataset(X_train, y_train, vectorizer, BatchSize, shuffle_buffer_size=shuffle_buffer_size, bucket_boundaries=boundaries)
+    val_dataset = make_streaming_dataset(X_test, y_test, vectorizer, BatchSize, shuffle=False, bucket_boundaries=boundaries)
+    # 验证集不打乱，predict的输出顺序与y_test一致
+    validation_inputs = val_dataset
+elif bucketing:
+    train_dataset = make_bucketed_dataset(X_train, len_train, np.array(y_train), vectorizer, BatchSize, boundaries)
+    val_dataset = make_bucketed_dataset(X_test, len_test, np.array(y_test), vectorizer, BatchSize, boundaries, shuffle=False)
+else:
+    train_dataset = create_dataset(X_train, np.array(y_train), BatchSize)
+    val_dataset = create_dataset(X_test, np.array(y_test), BatchSize)
+    validation_inputs = vectorizer.embed(X_test)
 
 # 训练模型
-metrics = Metrics(validation_data=(X_test, np.array(y_test)))
+metrics = Metrics(validation_data=val_dataset if bucketing else (validation_inputs, np.array(y_test)))
 model.fit(train_dataset, epochs=epochs_times, validation_data=val_dataset, callbacks=[metrics])
+if cache:
+    # 训练中未命中的文件已写入缓存，更新索引并按容量淘汰
+    cache.save()
+    print(f'Vector cache: {cache.hits} hits, {cache.misses} misses')
 
 # 保存模型
 model.save('/home/wwy/SerMalDetector/training/malware_detection_model.keras')
@@ -151,8 +210,8 @@ model.save('/home/wwy/SerMalDetector/training/malware_detection_model.keras')
 # loaded_model = tf.keras.models.load_model('/home/wwy/SerMalDetector/training/malware_detection_model.keras')
 
 # 示例API序列
-# new_sequences = load_api_sequences('/path/to/new/api/sequences')
-# vectorized_new_sequences = vectorize_sequences(new_sequences, w2v_model, max_sequence_length)
+# new_sequences = load_api_sequences(list_feature_files('/path/to/new/api/sequences'))
+# vectorized_new_sequences = vectorizer.vectorize(new_sequences)
 # predictions = loaded_model.predict(vectorized_new_sequences)
 
 # for i, pred in enumerate(predictions):
@@ -0,0 +1,255 @@
+"""
+TensorFlow-free inference for the trained Bi-LSTM models.
+
+`export` reads the weights of a saved .keras model (and optionally the Word2Vec vocabulary
+and embedding matrix) into one compact .npz file. `scan` then scores feature sequence files
+with a pure-NumPy forward pass that only needs numpy at runtime. `verify` checks that the
+NumPy forward pass reproduces the Keras predictions (it needs TensorFlow, the scan does not).
+For a model trained with bucketing, verify also compares at every bucket width; run it before
+scoring such a model with scan or serve.py --weights.
+
+Usage:
+    python numpy_inference.py export --model malware_detection_model.keras --w2v word2vec_window10.model --out malware_detection_model.npz
+    python numpy_inference.py scan --weights malware_detection_model.npz <feature_dir_or_rst_json> ...
+    python numpy_inference.py verify --model malware_detection_model.keras --weights malware_detection_model.npz [feature_dir]
+"""
+import io
+import os
+import sys
+import json
+import zipfile
+import argparse
+import numpy as np
+from vectorize import SequenceVectorizer, bucket_boundaries
+
+THRESHOLD = 0.5
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def export_keras_model(model_path: str, out_path: str, w2v_path: str = None, max_sequence_length: int = 800):
+    """
+    Writes the weights of a saved Keras 3 model (Bi-LSTM, optional AttentionLayer, Dense) to an .npz file.
+
+    Args:
+    model_path (str): Path to the .keras archive written by model.save.
+    out_path (str): Path of the .npz file to write.
+    w2v_path (str, optional): Word2Vec model whose vocabulary and embedding matrix are bundled for scanning.
+    max_sequence_length (int): Sequence length the model was trained with.
+    """
+    import h5py
+
+    with zipfile.ZipFile(model_path) as archive:
+        config = json.loads(archive.read('config.json'))
+        weights = h5py.File(io.BytesIO(archive.read('model.weights.h5')), 'r')
+
+    layers = {layer['class_name']: layer['config'] for layer in config['config']['layers']}
+    lstm_config = layers['Bidirectional']['layer']['config']
+    arrays = {
+        'forward_kernel': weights['layers/bidirectional/forward_layer/cell/vars/0'][()],
+        'forward_recurrent_kernel': weights['layers/bidirectional/forward_layer/cell/vars/1'][()],
+        'forward_bias': weights['layers/bidirectional/forward_layer/cell/vars/2'][()],
+        'backward_kernel': weights['layers/bidirectional/backward_layer/cell/vars/0'][()],
+        'backward_recurrent_kernel': weights['layers/bidirectional/backward_layer/cell/vars/1'][()],
+        'backward_bias': weights['layers/bidirectional/backward_layer/cell/vars/2'][()],
+        'dense_kernel': weights['layers/dense/vars/0'][()],
+        'dense_bias': weights['layers/dense/vars/1'][()],
+        'return_sequences': np.array(lstm_config['return_sequences']),
+        'masking': np.array('Masking' in layers),
+        'max_sequence_length': np.array(max_sequence_length),
+    }
+    if 'AttentionLayer' in layers:
+        arrays['attention_weight'] = weights['layers/attention_layer/vars/0'][()]
+        arrays['attention_bias'] = weights['layers/attention_layer/vars/1'][()]
+    weights.close()
+
+    if w2v_path:
+        from gensim.models import Word2Vec
+        vectorizer = SequenceVectorizer(Word2Vec.load(w2v_path), max_sequence_length)
+        arrays['vocab'] = np.array(list(vectorizer.token_to_id.keys()))
+        arrays['embedding_matrix'] = vectorizer.embedding_matrix
+    np.savez_compressed(out_path, **arrays)
+
+
+class NumpyBiLSTM:
+    """
+    Pure-NumPy forward pass of the exported Bi-LSTM models.
+
+    The input projection of every time step is computed with one matmul per direction;
+    only the recurrent projection runs step by step, on the whole batch at once.
+
+    Args:
+    weights_path (str): .npz file written by export_keras_model.
+    """
+
+    def __init__(self, weights_path: str):
+        with np.load(weights_path) as data:
+            self.weights = {name: data[name] for name in data.files}
+        self.return_sequences = bool(self.weights['return_sequences'])
+        self.masking = bool(self.weights['masking'])
+        self.max_sequence_length = int(self.weights['max_sequence_length'])
+        self.has_attention = 'attention_weight' in self.weights
+        self.vectorizer = None
+        if 'vocab' in self.weights:
+            self.vectorizer = SequenceVectorizer.from_arrays(
+                self.weights['vocab'].tolist(), self.weights['embedding_matrix'], self.max_sequence_length)
+
+    def _lstm(self, x, mask, direction, reverse):
+        kernel = self.weights[f'{direction}_kernel']
+        recurrent_kernel = self.weights[f'{direction}_recurrent_kernel']
+        bias = self.weights[f'{direction}_bias']
+        batch_size, steps, _ = x.shape
+        units = recurrent_kernel.shape[0]
+
+        # gate order of Keras LSTM kernels: input, forget, cell, output
+        projected = x @ kernel + bias
+        h = np.zeros((batch_size, units), dtype=np.float32)
+        c = np.zeros((batch_size, units), dtype=np.float32)
+        outputs = np.zeros((batch_size, steps, units), dtype=np.float32) if self.return_sequences else None
+        order = range(steps - 1, -1, -1) if reverse else range(steps)
+        for t in order:
+            z = projected[:, t] + h @ recurrent_kernel
+            i = _sigmoid(z[:, :units])
+            f = _sigmoid(z[:, units:2 * units])
+            g = np.tanh(z[:, 2 * units:3 * units])
+            o = _sigmoid(z[:, 3 * units:])
+            new_c = f * c + i * g
+            new_h = o * np.tanh(new_c)
+            if mask is not None:
+                # masked steps keep the previous state and output zeros
+                step_mask = mask[:, t:t + 1]
+                new_c = np.where(step_mask, new_c, c)
+                new_h = np.where(step_mask, new_h, h)
+            c, h = new_c, new_h
+            if outputs is not None:
+                outputs[:, t] = h if mask is None else np.where(mask[:, t:t + 1], h, 0.0)
+        return outputs if outputs is not None else h
+
+    def predict(self, x: np.ndarray) -> np.ndarray:
+        """
+        Returns the malicious probability of every sequence in a float32 batch of shape (batch, steps, vector_size).
+        """
+        x = np.asarray(x, dtype=np.float32)
+        mask = np.any(x != 0.0, axis=-1) if self.masking else None
+        hidden = np.concatenate([self._lstm(x, mask, 'forward', reverse=False),
+                                 self._lstm(x, mask, 'backward', reverse=True)], axis=-1)
+        if self.has_attention:
+            scores = np.tanh(hidden @ self.weights['attention_weight'] + self.weights['attention_bias'])
+            if mask is not None:
+                scores = scores + (1.0 - mask[:, :, np.newaxis]) * -1e9
+            scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+            attention = scores / scores.sum(axis=1, keepdims=True)
+            hidden = np.sum(hidden * attention, axis=1)
+        logits = hidden @ self.weights['dense_kernel'] + self.weights['dense_bias']
+        return _sigmoid(logits).reshape(-1)
+
+    def predict_sequences(self, sequences, batch_size: int = 256) -> np.ndarray:
+        """
+        Vectorizes API sequences with the bundled vocabulary and scores them in batches.
+        """
+        if self.vectorizer is None:
+            raise ValueError('the weights file has no vocabulary, export it again with --w2v')
+        probabilities = np.zeros(len(sequences), dtype=np.float32)
+        for start in range(0, len(sequences), batch_size):
+            batch = sequences[start:start + batch_size]
+            probabilities[start:start + len(batch)] = self.predict(self.vectorizer.vectorize(batch))
+        return probabilities
+
+
+def _collect_feature_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.json')))
+        else:
+            files.append(path)
+    return files
+
+
+def _load_sequences(files):
+    sequences = []
+    for file_path in files:
+        with open(file_path, 'r') as file:
+            sequences.append(json.load(file))
+    return sequences
+
+
+def _random_inputs(model, samples: int, seed: int = 0) -> np.ndarray:
+    """
+    Random embedded sequences of random lengths, with out-of-vocabulary (zero) rows between
+    the API calls and one sequence that is all padding, so a masked model skips steps inside
+    sequences as well as at their end.
+    """
+    rng = np.random.default_rng(seed)
+    ids = rng.integers(1, len(model.vectorizer.embedding_matrix), size=(samples, model.max_sequence_length))
+    ids[rng.random(ids.shape) < 0.1] = 0
+    for row, length in enumerate(rng.integers(1, model.max_sequence_length + 1, size=samples)):
+        ids[row, length:] = 0
+    ids[0] = 0
+    return model.vectorizer.embed(ids.astype(np.int32))
+
+
+def verify(keras_model, model, inputs: np.ndarray) -> float:
+    """
+    Returns the largest absolute difference between the Keras and the NumPy predictions. A masked
+    (bucketed) model is also compared on the inputs cut to every bucket width, as it is scored then.
+    """
+    widths = bucket_boundaries(inputs.shape[1]) if model.masking else [inputs.shape[1]]
+    max_error = 0.0
+    for width in widths:
+        expected = np.asarray(keras_model.predict(inputs[:, :width], verbose=0)).reshape(-1)
+        actual = model.predict(inputs[:, :width])
+        max_error = max(max_error, float(np.max(np.abs(expected - actual))))
+    return max_error
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the Bi-LSTM models to NumPy and scan packages without TensorFlow.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export_parser = subparsers.add_parser('export')
+    export_parser.add_argument('--model', required=True)
+    export_parser.add_argument('--out', required=True)
+    export_parser.add_argument('--w2v', default=None)
+    export_parser.add_argument('--max-sequence-length', type=int, default=800)
+    scan_parser = subparsers.add_parser('scan')
+    scan_parser.add_argument('--weights', required=True)
+    scan_parser.add_argument('--batch-size', type=int, default=256)
+    scan_parser.add_argument('paths', nargs='+', help='*_rst.json files or directories of them')
+    verify_parser = subparsers.add_parser('verify')
+    verify_parser.add_argument('--model', required=True)
+    verify_parser.add_argument('--weights', required=True)
+    verify_parser.add_argument('--samples', type=int, default=64)
+    verify_parser.add_argument('--tolerance', type=float, default=1e-4)
+    verify_parser.add_argument('paths', nargs='*', help='feature files to compare on (random sequences if omitted)')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_keras_model(args.model, args.out, args.w2v, args.max_sequence_length)
+        print(f'Exported {args.model} to {args.out}')
+    elif args.command == 'scan':
+        model = NumpyBiLSTM(args.weights)
+        files = _collect_feature_files(args.paths)
+        probabilities = model.predict_sequences(_load_sequences(files), args.batch_size)
+        for file_path, probability in zip(files, probabilities):
+            print(json.dumps({'path': file_path, 'probability': float(probability),
+                              'class': 'malicious' if probability > THRESHOLD else 'benign'}))
+    else:
+        from tensorflow.keras.models import load_model
+        from layers import AttentionLayer
+        keras_model = load_model(args.model, custom_objects={'AttentionLayer': AttentionLayer})
+        model = NumpyBiLSTM(args.weights)
+        if args.paths:
+            inputs = model.vectorizer.vectorize(_load_sequences(_collect_feature_files(args.paths))[:args.samples])
+        else:
+            inputs = _random_inputs(model, args.samples)
+        max_error = verify(keras_model, model, inputs)
+        masking = ' (masked, every bucket width)' if model.masking else ''
+        print(f'Compared {len(inputs)} sequences{masking}, max absolute difference {max_error:.2e}')
+        if max_error > args.tolerance:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import os
+import sys
+import numpy as np
+import tensorflow as tf
+from vectorize import PAD_ID
+
+AUTOTUNE = tf.data.experimental.AUTOTUNE
+
+
+def list_feature_files(directory):
+    """
+    Lists the feature sequence files of a directory in a stable order without reading them.
+    """
+    return sorted(os.path.join(directory, filename) for filename in os.listdir(directory) if filename.endswith('.json'))
+
+
+def catalog_feature_files(catalog_path, labels):
+    """
+    Lists the feature sequence files of the extracted packages with the given labels in the
+    dataset catalog (create-data/catalog.py), instead of listing the feature directories.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'create-data'))
+    from catalog import Catalog
+    with Catalog(catalog_path) as catalog:
+        return catalog.feature_files(labels)
+
+
+def _build_token_table(vectorizer):
+    tokens = list(vectorizer.token_to_id.keys())
+    ids = [vectorizer.token_to_id[token] for token in tokens]
+    initializer = tf.lookup.KeyValueTensorInitializer(
+        tf.constant(tokens, dtype=tf.string), tf.constant(ids, dtype=tf.int32))
+    return tf.lookup.StaticHashTable(initializer, default_value=PAD_ID)
+
+
+def _pad_to(ids, max_length):
+    ids = tf.pad(ids, [[0, max_length - tf.shape(ids)[0]]], constant_values=PAD_ID)
+    ids.set_shape([max_length])
+    return ids
+
+
+def _pad_vectors_to(vectors, max_length, vector_size):
+    vectors = tf.pad(vectors, [[0, max_length - tf.shape(vectors)[0]], [0, 0]])
+    vectors.set_shape([max_length, vector_size])
+    return vectors
+
+
+def _batch_and_embed(dataset, vectorizer, batch_size, bucket_boundaries):
+    """
+    Batches (ids, label) elements, either as-is or grouped by length bucket, then embeds each batch.
+    Elements that already hold float32 vectors (from a VectorCache) are batched without the embedding gather.
+
+    With bucket_boundaries, every batch only holds sequences of one bucket and is padded to that
+    bucket's width instead of vectorizer.max_length. The model must start with a Masking layer.
+    """
+    embedding_matrix = tf.constant(vectorizer.embedding_matrix)
+    if bucket_boundaries:
+        # bucket i holds lengths in (boundaries[i - 1], boundaries[i]] and is padded to boundaries[i]
+        dataset = dataset.bucket_by_sequence_length(
+            element_length_func=lambda ids, label: tf.shape(ids)[0],
+            bucket_boundaries=[width + 1 for width in bucket_boundaries],
+            bucket_batch_sizes=[batch_size] * (len(bucket_boundaries) + 1),
+            pad_to_bucket_boundary=True)
+    else:
+        dataset = dataset.batch(batch_size)
+    if dataset.element_spec[0].dtype.is_integer:
+        dataset = dataset.map(lambda ids, label: (tf.gather(embedding_matrix, ids), label), num_parallel_calls=AUTOTUNE)
+    return dataset.prefetch(buffer_size=AUTOTUNE)
+
+
+def make_streaming_dataset(files, labels, vectorizer, batch_size: int, shuffle: bool = True,
+                           shuffle_buffer_size: int = 4096, seed: int = 42, bucket_boundaries=None):
+    """
+    Builds a tf.data pipeline that reads and vectorizes feature sequence files lazily.
+
+    Only the file list lives in memory. Each file is read and tokenized inside the graph
+    (the extractor writes a flat JSON array of API names), mapped to int32 ids with a static
+    hash table and padded or truncated to vectorizer.max_length. The float32 embedding gather
+    runs once per batch, so peak memory is bounded by the shuffle buffer and prefetch depth
+    rather than the corpus size.
+
+    Args:
+    files (list): Paths to *_rst.json feature sequence files.
+    labels (list): Label of each file (1 for malicious, 0 for benign).
+    vectorizer (SequenceVectorizer): Provides the vocabulary, embedding matrix and max length.
+    batch_size (int): Number of sequences per batch.
+    shuffle (bool): Whether to shuffle the files every epoch (disable for validation).
+    shuffle_buffer_size (int): Upper bound on the number of files held by the shuffle buffer.
+    seed (int): Seed of the shuffle order.
+    bucket_boundaries (list, optional): Bucket widths for length-bucketed batching, see bucket_boundaries.
+    """
+    max_length = vectorizer.max_length
+    table = _build_token_table(vectorizer)
+
+    def load_ids(path, label):
+        text = tf.strings.regex_replace(tf.io.read_file(path), r'[\[\]"\s]', '')
+        tokens = tf.strings.split(text, ',')
+        ids = table.lookup(tokens)[:max_length]
+        return (ids if bucket_boundaries else _pad_to(ids, max_length)), label
+
+    dataset = tf.data.Dataset.from_tensor_slices((list(files), list(labels)))
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=min(shuffle_buffer_size, len(files)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(load_ids, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    return _batch_and_embed(dataset, vectorizer, batch_size, bucket_boundaries)
+
+
+def make_corpus_dataset(corpus, indices, labels, vectorizer, batch_size: int, shuffle: bool = True,
+                        shuffle_buffer_size: int = 4096, seed: int = 42, bucket_boundaries=None):
+    """
+    Same pipeline as make_streaming_dataset, reading packages from a PackedCorpus by index.
+
+    Token ids are sliced from the memory-mapped shard and remapped to the vectorizer's ids,
+    so no JSON is parsed during training.
+    """
+    max_length = vectorizer.max_length
+    vocabulary_map = corpus.vocabulary_map(vectorizer)
+
+    def encode(index):
+        return vocabulary_map[corpus.ids(int(index))[:max_length]]
+
+    def load_ids(index, label):
+        ids = tf.numpy_function(encode, [index], tf.int32)
+        ids.set_shape([None])
+        return (ids if bucket_boundaries else _pad_to(ids, max_length)), label
+
+    dataset = tf.data.Dataset.from_tensor_slices((list(indices), list(labels)))
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=min(shuffle_buffer_size, len(indices)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(load_ids, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    return _batch_and_embed(dataset, vectorizer, batch_size, bucket_boundaries)
+
+
+def make_cached_dataset(cache, files, labels, batch_size: int, shuffle: bool = True,
+                        shuffle_buffer_size: int = 4096, seed: int = 42, bucket_boundaries=None):
+    """
+    Same pipeline as make_streaming_dataset, reading already vectorized sequences from a VectorCache.
+
+    Cached files are memory-mapped instead of parsed and vectorized; misses are vectorized
+    once and added to the cache.
+    """
+    vectorizer = cache.vectorizer
+    max_length = vectorizer.max_length
+
+    def load_vectors(path, label):
+        vectors = tf.numpy_function(lambda path: np.array(cache.vectors(path.decode('utf-8'))), [path], tf.float32)
+        vectors.set_shape([None, vectorizer.vector_size])
+        return (vectors if bucket_boundaries else _pad_vectors_to(vectors, max_length, vectorizer.vector_size)), label
+
+    dataset = tf.data.Dataset.from_tensor_slices((list(files), list(labels)))
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=min(shuffle_buffer_size, len(files)), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(load_vectors, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    return _batch_and_embed(dataset, vectorizer, batch_size, bucket_boundaries)
+
+
+def make_bucketed_dataset(ids, lengths, labels, vectorizer, batch_size: int, bucket_boundaries, shuffle: bool = True, seed: int = 42):
+    """
+    Length-bucketed pipeline over an in-memory padded id matrix (or padded float32 vectors) and the true length of each row.
+    """
+    dataset = tf.data.Dataset.from_tensor_slices((ids, lengths, labels))
+    if shuffle:
+        dataset = dataset.shuffle(buffer_size=len(lengths), seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.map(lambda row, length, label: (row[:length], label), num_parallel_calls=AUTOTUNE)
+    return _batch_and_embed(dataset, vectorizer, batch_size, bucket_boundaries)
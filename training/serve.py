@@ -0,0 +1,288 @@
+"""
+Resident scoring service for the Bi-LSTM malware detection model.
+
+The Word2Vec and Keras models are loaded once. Concurrent requests are queued and
+scored together in dynamic micro-batches: a batch is closed as soon as it holds
+--max-batch-size packages or --max-wait-ms has passed since its first request.
+
+Usage:
+    python serve.py [--host 127.0.0.1] [--port 8377] [--unix-socket PATH]
+                    [--max-batch-size 64] [--max-wait-ms 10] [--weights MODEL.npz]
+
+With --weights, the model exported by numpy_inference.py is scored with NumPy and
+TensorFlow is never imported.
+
+API:
+    POST /score    {"sequence": ["useNetwork", ...]}  or  {"path": "/abs/path/pkg_rst.json"}
+                   or {"items": [<sequence or path request>, ...]}
+                   -> {"probability": 0.97, "class": "malicious"} (or {"results": [...]})
+    GET  /metrics  queue depth, batch and latency statistics
+    GET  /health
+"""
+import os
+import json
+import time
+import queue
+import socket
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingUnixStreamServer
+import numpy as np
+from vectorize import SequenceVectorizer
+from numpy_inference import NumpyBiLSTM
+
+TRAINING_DIR = os.path.dirname(os.path.abspath(__file__))
+THRESHOLD = 0.5
+
+
+class KerasScorer:
+    """
+    Scores float32 sequence batches with a saved Keras model.
+    """
+
+    def __init__(self, model_path: str):
+        from tensorflow.keras.models import load_model
+        self.model = load_model(model_path)
+
+    def predict(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(vectors)).reshape(-1)
+
+
+class Metrics:
+    """
+    Thread-safe request, batch and latency counters exposed by GET /metrics.
+    """
+
+    def __init__(self, window: int = 2048):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.requests = 0
+        self.failures = 0
+        self.batches = 0
+        self.batched_packages = 0
+        self.latencies = deque(maxlen=window)
+        self.batch_latencies = deque(maxlen=window)
+
+    def record_batch(self, size: int, seconds: float):
+        with self.lock:
+            self.batches += 1
+            self.batched_packages += size
+            self.batch_latencies.append(seconds)
+
+    def record_request(self, seconds: float, failed: bool = False):
+        with self.lock:
+            self.requests += 1
+            self.failures += int(failed)
+            self.latencies.append(seconds)
+
+    def snapshot(self, queue_depth: int):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_latencies = np.array(self.batch_latencies) * 1000
+            uptime = time.time() - self.started
+            return {
+                'uptime_seconds': uptime,
+                'queue_depth': queue_depth,
+                'requests': self.requests,
+                'failures': self.failures,
+                'batches': self.batches,
+                'packages_scored': self.batched_packages,
+                'packages_per_second': self.batched_packages / uptime if uptime else 0.0,
+                'mean_batch_size': self.batched_packages / self.batches if self.batches else 0.0,
+                'request_latency_ms': _percentiles(latencies),
+                'batch_latency_ms': _percentiles(batch_latencies),
+            }
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return {'p50': None, 'p95': None, 'p99': None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+
+class MicroBatcher:
+    """
+    Collects scoring requests from many threads and scores them in dynamic batches on one worker thread.
+
+    Args:
+    vectorizer (SequenceVectorizer): Encodes and embeds API sequences.
+    scorer: Object with a predict(float32 batch) -> probabilities method.
+    max_batch_size (int): Upper bound on the number of packages per batch.
+    max_wait (float): Seconds a batch waits for more requests after its first one.
+    """
+
+    def __init__(self, vectorizer, scorer, max_batch_size: int, max_wait: float, metrics: Metrics):
+        self.vectorizer = vectorizer
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = metrics
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, sequence) -> Future:
+        future = Future()
+        self.queue.put((sequence, future))
+        return future
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            try:
+                probabilities = self.scorer.predict(self.vectorizer.vectorize([sequence for sequence, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.metrics.record_batch(len(batch), time.perf_counter() - start)
+            for (_, future), probability in zip(batch, probabilities):
+                future.set_result(float(probability))
+
+
+def _load_request_sequence(item):
+    if 'sequence' in item:
+        sequence = item['sequence']
+    elif 'path' in item:
+        with open(item['path'], 'r') as file:
+            sequence = json.load(file)
+    else:
+        raise ValueError('request needs a "sequence" or a "path"')
+    # a bad element would fail the whole micro-batch it is scored in, so it is rejected here
+    if not isinstance(sequence, list) or not all(isinstance(api, str) for api in sequence):
+        raise ValueError('a feature sequence must be a JSON array of API names')
+    return sequence
+
+
+def _result(probability):
+    return {'probability': probability, 'class': 'malicious' if probability > THRESHOLD else 'benign'}
+
+
+def make_handler(batcher: MicroBatcher, metrics: Metrics):
+    class ScoringHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def address_string(self):
+            # Unix socket clients have no (host, port) address
+            return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/metrics':
+                self._send(200, metrics.snapshot(batcher.queue.qsize()))
+            elif self.path == '/health':
+                self._send(200, {'status': 'ok'})
+            else:
+                self._send(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/score':
+                self._send(404, {'error': f'unknown path {self.path}'})
+                return
+            start = time.perf_counter()
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                items = request['items'] if 'items' in request else [request]
+                futures = [batcher.submit(_load_request_sequence(item)) for item in items]
+                results = [_result(future.result()) for future in futures]
+            except (ValueError, KeyError, TypeError, OSError) as e:
+                metrics.record_request(time.perf_counter() - start, failed=True)
+                self._send(400, {'error': str(e)})
+                return
+            except Exception as e:
+                metrics.record_request(time.perf_counter() - start, failed=True)
+                self._send(500, {'error': str(e)})
+                return
+            metrics.record_request(time.perf_counter() - start)
+            self._send(200, {'results': results} if 'items' in request else results[0])
+
+    return ScoringHandler
+
+
+class ScoringHTTPServer(ThreadingHTTPServer):
+    # the registry mirror opens many connections at once; the default backlog of 5 resets them
+    request_queue_size = 512
+
+
+class UnixHTTPServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        super().server_bind()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve malware detection scores over HTTP with dynamic micro-batching.')
+    parser.add_argument('--w2v', default=os.path.join(TRAINING_DIR, 'word2vec_window10.model'))
+    parser.add_argument('--model', default=os.path.join(TRAINING_DIR, 'malware_detection_model.keras'))
+    parser.add_argument('--weights', default=None, help='score with the NumPy engine using weights exported by numpy_inference.py')
+    parser.add_argument('--max-sequence-length', type=int, default=800)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8377)
+    parser.add_argument('--unix-socket', default=None, help='listen on this Unix socket instead of TCP')
+    args = parser.parse_args()
+
+    if args.weights:
+        scorer = NumpyBiLSTM(args.weights)
+        vectorizer = scorer.vectorizer
+    else:
+        scorer = KerasScorer(args.model)
+        vectorizer = None
+    if vectorizer is None:
+        # weights exported without --w2v carry no vocabulary
+        from gensim.models import Word2Vec
+        vectorizer = SequenceVectorizer(Word2Vec.load(args.w2v), args.max_sequence_length)
+    metrics = Metrics()
+    batcher = MicroBatcher(vectorizer, scorer, args.max_batch_size, args.max_wait_ms / 1000, metrics)
+    handler = make_handler(batcher, metrics)
+
+    if args.unix_socket:
+        server = UnixHTTPServer(args.unix_socket, handler)
+        print(f'Scoring service listening on unix:{args.unix_socket}')
+    else:
+        server = ScoringHTTPServer((args.host, args.port), handler)
+        server.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        print(f'Scoring service listening on http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Persistent cache of vectorized feature sequences.
+
+An entry holds the float32 vectors of one *_rst.json file, truncated to max_length (the
+padding rows are all zeros and are added back on read). It is keyed by
+(embedding fingerprint, SHA-1 of the file content, max_length). The fingerprint hashes the
+vocabulary and embedding matrix of the Word2Vec model, so retraining or replacing
+word2vec_window10.model yields new keys and the stale entries are never read again. They
+are evicted, least recently used first, as soon as an insert grows the cache past max_bytes.
+
+Layout of cache_dir:
+    <key>.npy    one entry, read back with np.load(mmap_mode='r')
+    index.json   {"entries": {key: {"size", "last_used"}}, "files": {path: [size, mtime_ns, sha1]}}
+
+The "files" table remembers the content hash of every file by (size, mtime), so a warm
+run neither parses nor hashes the feature files.
+
+Opening the cache reconciles the index with the directory: entries written by a run that
+ended before save() are adopted, indexed entries whose file is gone are dropped, and so are
+the "files" rows of feature files that no longer exist.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+
+INDEX_FILE = 'index.json'
+DEFAULT_MAX_BYTES = 16 << 30
+# eviction frees the cache down to this fraction of max_bytes, so it does not run on every insert
+EVICT_TO_FRACTION = 0.9
+# temporary files older than this were left by an interrupted write
+STALE_TMP_SECONDS = 3600
+
+
+def embedding_fingerprint(vectorizer) -> str:
+    """
+    Hashes the vocabulary order and embedding matrix of a SequenceVectorizer.
+    """
+    digest = hashlib.sha1()
+    digest.update('\n'.join(vectorizer.token_to_id).encode('utf-8'))
+    digest.update(np.ascontiguousarray(vectorizer.embedding_matrix).tobytes())
+    return digest.hexdigest()
+
+
+class VectorCache:
+    """
+    On-disk cache of vectorized feature sequence files with size-bounded LRU eviction.
+
+    Args:
+    cache_dir (str): Directory of the cache, created if it does not exist.
+    vectorizer (SequenceVectorizer): Vectorizer of the Word2Vec model the entries are built with.
+    max_bytes (int): Total size of the entries kept in the cache.
+    """
+
+    def __init__(self, cache_dir: str, vectorizer, max_bytes: int = DEFAULT_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.vectorizer = vectorizer
+        self.max_bytes = max_bytes
+        self.fingerprint = embedding_fingerprint(vectorizer)
+        self.hits = 0
+        self.misses = 0
+        index_path = os.path.join(cache_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path, 'r') as file:
+                index = json.load(file)
+        else:
+            index = {'entries': {}, 'files': {}}
+        self.entries = index['entries']
+        self.files = index['files']
+        # vectors() runs on the parallel calls of the tf.data pipelines
+        self.lock = threading.Lock()
+        self._reconcile()
+        self.total_bytes = sum(entry['size'] for entry in self.entries.values())
+        if self.total_bytes > self.max_bytes:
+            self._evict()
+
+    def _reconcile(self):
+        """
+        Brings the index in line with the entries on disk and drops the hashes of removed feature files.
+        """
+        on_disk = set()
+        now = time.time()
+        with os.scandir(self.cache_dir) as files:
+            for entry in files:
+                if entry.name.endswith('.tmp'):
+                    if now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                        os.remove(entry.path)
+                    continue
+                if not entry.name.endswith('.npy'):
+                    continue
+                key = entry.name[:-len('.npy')]
+                on_disk.add(key)
+                if key in self.entries:
+                    continue
+                try:
+                    with open(entry.path, 'rb') as file:
+                        read_header = np.lib.format.read_array_header_1_0 if np.lib.format.read_magic(file) == (1, 0) \
+                            else np.lib.format.read_array_header_2_0
+                        shape, _, dtype = read_header(file)
+                except (OSError, ValueError):
+                    os.remove(entry.path)
+                    continue
+                self.entries[key] = {'size': int(np.prod(shape)) * dtype.itemsize, 'last_used': entry.stat().st_mtime}
+        for key in [key for key in self.entries if key not in on_disk]:
+            del self.entries[key]
+        for path in [path for path in self.files if not os.path.exists(path)]:
+            del self.files[path]
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the cache is under EVICT_TO_FRACTION of max_bytes.
+        """
+        target = self.max_bytes * EVICT_TO_FRACTION
+        for key in sorted(self.entries, key=lambda key: self.entries[key]['last_used']):
+            if self.total_bytes <= target:
+                break
+            self.total_bytes -= self.entries.pop(key)['size']
+            if os.path.exists(self._entry_path(key)):
+                os.remove(self._entry_path(key))
+
+    def file_sha1(self, path: str) -> str:
+        """
+        Returns the SHA-1 of a file's content, hashing it again only when its size or mtime changed.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        known = self.files.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        with open(path, 'rb') as file:
+            sha1 = hashlib.sha1(file.read()).hexdigest()
+        with self.lock:
+            self.files[path] = [stat.st_size, stat.st_mtime_ns, sha1]
+        return sha1
+
+    def _key(self, path, max_length):
+        return hashlib.sha1(f'{self.fingerprint}:{self.file_sha1(path)}:{max_length}'.encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def vectors(self, path: str, max_length: int = None) -> np.ndarray:
+        """
+        Returns the (length, vector_size) float32 vectors of one feature file, memory-mapped on a hit.
+        """
+        max_length = self.vectorizer.max_length if max_length is None else max_length
+        key = self._key(path, max_length)
+        entry_path = self._entry_path(key)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry['last_used'] = time.time()
+        if entry is not None:
+            try:
+                vectors = np.zeros((0, self.vectorizer.vector_size), dtype=np.float32) if entry['size'] == 0 \
+                    else np.load(entry_path, mmap_mode='r')
+                self.hits += 1
+                return vectors
+            except OSError:
+                # removed outside the cache; it is written again below
+                pass
+
+        self.misses += 1
+        with open(path, 'r') as file:
+            sequence = json.load(file)[:max_length]
+        vectors = self.vectorizer.vectorize([sequence], len(sequence))[0]
+        # written under a temporary name first, so an interrupted write never leaves half an entry
+        tmp_path = f'{entry_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as file:
+            np.save(file, vectors)
+        os.replace(tmp_path, entry_path)
+        with self.lock:
+            previous = self.entries.get(key)
+            self.total_bytes += vectors.nbytes - (previous['size'] if previous else 0)
+            self.entries[key] = {'size': vectors.nbytes, 'last_used': time.time()}
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        return vectors
+
+    def lengths(self, paths, max_length: int = None) -> np.ndarray:
+        """
+        Returns the length of every file's cached vectors, vectorizing and caching the misses.
+        The vectors themselves are not kept, batches are read with pad().
+        """
+        return np.array([len(self.vectors(path, max_length)) for path in paths], dtype=np.int32)
+
+    def pad(self, paths, width: int) -> np.ndarray:
+        """
+        Reads the vectors of a batch of files as a zero-padded (len(paths), width, vector_size) float32 array.
+        """
+        padded = np.zeros((len(paths), width, self.vectorizer.vector_size), dtype=np.float32)
+        for row, path in enumerate(paths):
+            vectors = self.vectors(path)[:width]
+            padded[row, :len(vectors)] = vectors
+        return padded
+
+    def save(self):
+        """
+        Writes the index.
+        """
+        index_path = os.path.join(self.cache_dir, INDEX_FILE)
+        tmp_path = f'{index_path}.{os.getpid()}.tmp'
+        with self.lock:
+            with open(tmp_path, 'w') as file:
+                json.dump({'entries': self.entries, 'files': self.files}, file)
+        os.replace(tmp_path, index_path)
@@ -0,0 +1,107 @@
+import numpy as np
+
+# Row 0 of the embedding matrix is reserved for padding and out-of-vocabulary tokens.
+PAD_ID = 0
+
+
+def bucket_boundaries(max_length: int, smallest: int = 32):
+    """
+    Returns doubling bucket widths (32, 64, 128, ...) capped by max_length, which is always the last width.
+    """
+    boundaries = []
+    width = smallest
+    while width < max_length:
+        boundaries.append(width)
+        width *= 2
+    return boundaries + [max_length]
+
+
+def bucket_batches(lengths, batch_size: int, boundaries):
+    """
+    Groups sequence indices into batches of sequences falling in the same length bucket.
+
+    Args:
+    lengths: Length of every sequence, already capped at the last boundary.
+    batch_size (int): Maximum number of sequences per batch.
+    boundaries (list): Increasing bucket widths, as returned by bucket_boundaries.
+
+    Yields:
+    (np.ndarray, int): The indices of a batch and the width its sequences must be padded to.
+    """
+    buckets = np.searchsorted(boundaries, np.asarray(lengths), side='left')
+    for bucket, width in enumerate(boundaries):
+        indices = np.flatnonzero(buckets == bucket)
+        for start in range(0, len(indices), batch_size):
+            yield indices[start:start + batch_size], width
+
+
+class SequenceVectorizer:
+    """
+    Maps API sequences to int32 token-id matrices and embeds them with a single NumPy gather.
+
+    The embedding matrix is built once from a Word2Vec model: row PAD_ID is all zeros and
+    row i + 1 holds the vector of model.wv.index_to_key[i]. Both padding and unknown APIs
+    therefore embed to zero vectors, exactly like the former per-token vectorize_sequences.
+
+    Args:
+    w2v_model: A trained gensim Word2Vec model (or its KeyedVectors).
+    max_length (int): Length every sequence is padded or truncated to.
+    """
+
+    def __init__(self, w2v_model, max_length: int):
+        wv = getattr(w2v_model, 'wv', w2v_model)
+        self.max_length = max_length
+        self.vector_size = wv.vector_size
+        self.token_to_id = {token: i + 1 for i, token in enumerate(wv.index_to_key)}
+        self.embedding_matrix = np.zeros((len(wv.index_to_key) + 1, wv.vector_size), dtype=np.float32)
+        self.embedding_matrix[1:] = wv.vectors
+
+    @classmethod
+    def from_arrays(cls, vocab, embedding_matrix: np.ndarray, max_length: int):
+        """
+        Builds a vectorizer from a vocabulary (token ids 1..n) and its embedding matrix, without gensim.
+        """
+        vectorizer = cls.__new__(cls)
+        vectorizer.max_length = max_length
+        vectorizer.vector_size = embedding_matrix.shape[1]
+        vectorizer.token_to_id = {token: i + 1 for i, token in enumerate(vocab)}
+        vectorizer.embedding_matrix = np.asarray(embedding_matrix, dtype=np.float32)
+        return vectorizer
+
+    def encode(self, sequences, max_length: int = None) -> np.ndarray:
+        """
+        Encodes API sequences into a zero-padded (len(sequences), max_length) int32 matrix.
+        """
+        max_length = self.max_length if max_length is None else max_length
+        ids = np.full((len(sequences), max_length), PAD_ID, dtype=np.int32)
+        lookup = self.token_to_id.get
+        for row, seq in enumerate(sequences):
+            seq = seq[:max_length]
+            ids[row, :len(seq)] = [lookup(api, PAD_ID) for api in seq]
+        return ids
+
+    def sequence_lengths(self, sequences, max_length: int = None) -> np.ndarray:
+        """
+        Returns the length of every sequence after truncation to max_length.
+        """
+        max_length = self.max_length if max_length is None else max_length
+        return np.array([min(len(seq), max_length) for seq in sequences], dtype=np.int32)
+
+    def embed(self, ids: np.ndarray) -> np.ndarray:
+        """
+        Gathers the float32 embedding of every token id, returning an array of shape ids.shape + (vector_size,).
+        """
+        return np.take(self.embedding_matrix, ids, axis=0)
+
+    def vectorize(self, sequences, max_length: int = None) -> np.ndarray:
+        """
+        Encodes and embeds API sequences in one step.
+        """
+        return self.embed(self.encode(sequences, max_length))
+
+
+def vectorize_sequences(sequences, model, max_length):
+    """
+    Drop-in replacement of the former per-script vectorize_sequences, returning float32 instead of float64.
+    """
+    return SequenceVectorizer(model, max_length).vectorize(sequences)
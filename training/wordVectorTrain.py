@@ -1,47 +1,131 @@
 import os
 import json
-import numpy as np
+import hashlib
+from datetime import datetime, timezone
 from gensim.models import Word2Vec
+from corpus import PackedCorpus
 
 # 可调参数
 mal_dir = '/home/wwy/datasets/MalinBenPac/features'  # 恶意API序列的文件夹路径
 ben_dir = '/home/wwy/datasets/BenPac/features'  # 正常API序列的文件夹路径
+corpus_dir = None  # 打包语料路径（由corpus.py pack生成），设置后代替mal_dir和ben_dir
+catalog_path = None  # 数据集目录库（create-data/catalog.py生成），设置后按标签查询已提取包的特征文件，代替列出mal_dir和ben_dir
 vector_size = 100  # 嵌入向量的维度
 window_size = 10  # 上下文窗口的大小 #5 88
 min_count = 1  # 最小出现频次
 sg = 1  # 1表示使用Skip-Gram模型，0表示使用CBOW模型
-workers = 8  # 并行训练使用的线程数
+workers = os.cpu_count()  # 并行训练使用的线程数
 model_save_path = '/home/wwy/SerMalDetector/training/word2vec_window10.model'  # 训练好模型的保存路径
+streaming = True  # 从磁盘上的语料文件（LineSentence格式）训练，可利用所有CPU核；False时将全部序列读入内存列表
+incremental = False  # 加载model_save_path的已有模型，只用上次训练之后新增的包更新词表并继续训练
+corpus_file_path = model_save_path + '.corpus.txt'  # 流式训练时写出的语料文件
+snapshot_path = model_save_path + '.snapshot.json'  # 记录模型训练所用语料快照的文件
 
-# 加载API序列
-def load_api_sequences(directory):
-    api_sequences = []
-    for filename in os.listdir(directory):
-        if filename.endswith('.json'):
-            with open(os.path.join(directory, filename), 'r') as file:
-                api_sequence = json.load(file)
-                api_sequences.append(api_sequence)
-    return api_sequences
-
-# 将API序列加载到两个文件夹中
-malicious_sequences = load_api_sequences(mal_dir)
-benign_sequences = load_api_sequences(ben_dir)
-
-# 合并所有序列以便于训练
-all_sequences = malicious_sequences + benign_sequences
-
-# 训练Word2Vec模型
-model = Word2Vec(
-    sentences=all_sequences, 
-    vector_size=vector_size, 
-    window=window_size, 
-    min_count=min_count, 
-    sg=sg, 
-    workers=workers
-)
 
-# 保存模型
-model.save(model_save_path)
+catalog_labels = [['malicious', 'augmented'], ['benign']]  # 使用catalog_path时查询的标签，恶意（含增强）在前
+
+
+# 按固定顺序逐个产出(包标识, 内容SHA-1, API序列)，不把整个语料读入内存；包标识为打包语料中的标签/包名或特征文件路径
+def iter_packages():
+    if corpus_dir:
+        corpus = PackedCorpus(corpus_dir)
+        for index, record in enumerate(corpus.meta):
+            yield f"{record['label']}/{record['name']}", record['sha1'], corpus.sequence(index)
+    else:
+        if catalog_path:
+            from pipeline import catalog_feature_files
+            files = [file for labels in catalog_labels for file in catalog_feature_files(catalog_path, tuple(labels))]
+        else:
+            files = [os.path.join(directory, filename) for directory in (mal_dir, ben_dir)
+                     for filename in sorted(os.listdir(directory)) if filename.endswith('.json')]
+        for file_path in files:
+            with open(file_path, 'rb') as file:
+                content = file.read()
+            yield os.path.abspath(file_path), hashlib.sha1(content).hexdigest(), json.loads(content)
+
+
+# 将未训练过（或内容已变化）的包写成LineSentence格式：每行一个包，API之间用空格分隔
+def write_corpus_file(path, known_packages):
+    new_packages = {}
+    digest = hashlib.sha1()
+    with open(path, 'w', encoding='utf-8') as file:
+        for package, sha1, sequence in iter_packages():
+            if known_packages.get(package) == sha1:
+                continue
+            line = ' '.join(sequence) + '\n'
+            file.write(line)
+            digest.update(line.encode('utf-8'))
+            new_packages[package] = sha1
+    return new_packages, digest.hexdigest()
+
 
+def load_snapshot():
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, 'r') as file:
+        return json.load(file)
 
 
+previous = load_snapshot() if incremental else None
+if incremental and (previous is None or not os.path.exists(model_save_path)):
+    print(f'No trained model or snapshot at {model_save_path}, training from scratch')
+    incremental = False
+if incremental and 'packages' not in previous:
+    print(f'The snapshot at {snapshot_path} does not record its packages, training from scratch')
+    incremental = False
+# 上次训练过的包：包标识 -> 内容SHA-1，内容变化的包视为新增
+known_packages = previous['packages'] if incremental else {}
+
+if streaming:
+    new_packages, corpus_sha1 = write_corpus_file(corpus_file_path, known_packages)
+    all_sequences, corpus_file = None, corpus_file_path
+else:
+    all_sequences, corpus_file = [], None
+    new_packages = {}
+    for package, sha1, sequence in iter_packages():
+        if known_packages.get(package) != sha1:
+            all_sequences.append(sequence)
+            new_packages[package] = sha1
+    corpus_sha1 = hashlib.sha1('\n'.join(new_packages.values()).encode('utf-8')).hexdigest()
+
+if incremental:
+    if not new_packages:
+        print('No new packages since the last training, the model is unchanged')
+        raise SystemExit(0)
+    # 更新词表后只在新增的包上继续训练
+    model = Word2Vec.load(model_save_path)
+    model.workers = workers
+    model.build_vocab(corpus_iterable=all_sequences, corpus_file=corpus_file, update=True)
+    model.train(corpus_iterable=all_sequences, corpus_file=corpus_file, total_examples=model.corpus_count, total_words=model.corpus_total_words, epochs=model.epochs)
+else:
+    # 训练Word2Vec模型
+    model = Word2Vec(
+        sentences=all_sequences,
+        corpus_file=corpus_file,
+        vector_size=vector_size,
+        window=window_size,
+        min_count=min_count,
+        sg=sg,
+        workers=workers
+    )
+
+# 保存模型
+model.save(model_save_path)
+
+# 记录本次训练所用的语料快照，增量训练据此找出新增的包
+trained = {
+    'mode': 'incremental' if incremental else 'full',
+    'source': corpus_dir or ({'catalog': catalog_path, 'labels': catalog_labels} if catalog_path else [mal_dir, ben_dir]),
+    'corpus_sha1': corpus_sha1,
+    'packages': len(new_packages),
+    'vocabulary': len(model.wv.index_to_key),
+    'trained_at': datetime.now(timezone.utc).isoformat(),
+}
+snapshot = {
+    'model': model_save_path,
+    'packages': {**known_packages, **new_packages},
+    'history': (previous['history'] if incremental else []) + [trained],
+}
+with open(snapshot_path, 'w') as file:
+    json.dump(snapshot, file)
+print(f"Trained on {len(new_packages)} packages ({trained['mode']}), {len(snapshot['packages'])} packages in the snapshot")